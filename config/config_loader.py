@@ -1,24 +1,35 @@
 from __future__ import annotations
+import copy
 import os
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 import yaml
 
 _BASE_DIR = Path(__file__).resolve().parent
 
 
+# path -> (mtime_ns, dados): o YAML só é reparseado quando o arquivo muda
+_CACHE: Dict[Path, Tuple[int, Dict[str, Any]]] = {}
+
+
 def _read_yaml(path: Path) -> Dict[str, Any]:
-    if not path.exists():
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
         return {}
+    hit = _CACHE.get(path)
+    if hit is not None and hit[0] == mtime:
+        return copy.deepcopy(hit[1])
     try:
         with path.open("r", encoding="utf-8") as f:
             data = yaml.safe_load(f) or {}
         if not isinstance(data, dict):
             return {}
-        return data
     except Exception:
         return {}
+    _CACHE[path] = (mtime, data)
+    return copy.deepcopy(data)
 
 
 def get_settings() -> Dict[str, Any]:
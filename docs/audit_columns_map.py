@@ -16,7 +16,8 @@ def main() -> None:
     root = Path(__file__).resolve().parents[1]
     _add_paths(root)
 
-    from censo_app.transform import _get_external_colmap
+    from config.config_loader import get_settings
+    from censo_app.schema import get_parquet_schema
 
     csv_map = root / "docs" / "columns_map.csv"
     if not csv_map.exists():
@@ -38,10 +39,21 @@ def main() -> None:
     out_types = root / "docs" / "columns_types_summary.csv"
     type_counts.to_csv(out_types, index=False, encoding="utf-8-sig")
 
+    # Conferir o mapa contra o rodapé do Parquet atual (se disponível)
+    parquet_path = (get_settings() or {}).get("paths", {}).get("parquet_default")
+    stale = None
+    if parquet_path and Path(parquet_path).exists():
+        schema = get_parquet_schema(parquet_path)
+        stale = sorted(set(df["parquet_column"]) ^ set(schema.columns))
+
     print(f"Total de colunas no Parquet: {total}")
     print(f"Com equivalente no app (não-nulo): {mapped}")
     print(f"Sem equivalente (app_equivalent vazio): {len(no_equiv)} -> salvo em {out_no_equiv}")
     print(f"Resumo de tipos salvo em {out_types}")
+    if stale is not None:
+        print(f"Colunas divergentes entre o mapa e o Parquet atual: {len(stale)}")
+        if stale:
+            print("Execute generate_column_map.py para atualizar o mapa.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+from __future__ import annotations
+import sys
+from pathlib import Path
+
+
+def _add_paths(root: Path) -> None:
+    src = root / "src"
+    if str(src) not in sys.path:
+        sys.path.insert(0, str(src))
+    if str(root) not in sys.path:
+        sys.path.insert(0, str(root))
+
+
+def main() -> None:
+    """Compila o Excel de RM/AU no lookup CSV + meta.json lido pelo app.
+
+    Uso: python docs/compile_rm_au_lookup.py [caminho_excel] [caminho_saida.csv]
+    Sem argumentos, usa paths.rm_au_excel_default (ou insumos/) e o diretório de cache.
+    """
+    root = Path(__file__).resolve().parents[1]
+    _add_paths(root)
+
+    from config.config_loader import get_settings
+    from censo_app.rm_au import compile_rm_au_lookup
+
+    args = sys.argv[1:]
+    if args:
+        excel_path = args[0]
+    else:
+        configured = (get_settings() or {}).get("paths", {}).get("rm_au_excel_default")
+        candidates = [c for c in (configured, str(root / "insumos" / "Composicao_RM_2024.xlsx")) if c]
+        excel_path = next((c for c in candidates if Path(c).exists()), candidates[0])
+    if not Path(excel_path).exists():
+        raise SystemExit(f"Excel de RM/AU não encontrado: {excel_path}")
+
+    out = compile_rm_au_lookup(excel_path, args[1] if len(args) > 1 else None)
+    print(f"Lookup RM/AU salvo em: {out}")
+    print(f"Metadados: {out.with_suffix('.meta.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import importlib.util
 import json
 import sys
 from pathlib import Path
@@ -19,13 +20,12 @@ def main() -> None:
     _add_paths(root)
 
     # Lazy imports after sys.path is prepared
-    try:
-        import duckdb  # type: ignore
-    except Exception as e:
-        raise SystemExit("duckdb não encontrado. Instale com: pip install duckdb") from e
+    if importlib.util.find_spec("duckdb") is None:
+        raise SystemExit("duckdb não encontrado. Instale com: pip install duckdb")
 
     from config.config_loader import get_settings
     from censo_app import transform as T
+    from censo_app.schema import get_parquet_schema
 
     settings = get_settings() or {}
     parquet_path = (
@@ -37,22 +37,15 @@ def main() -> None:
     if not p.exists():
         raise SystemExit(f"Arquivo Parquet não encontrado: {parquet_path}")
 
-    # 1) Coletar nomes e tipos do Parquet usando DuckDB
-    con = duckdb.connect()
-    desc = con.execute(
-        f"DESCRIBE SELECT * FROM read_parquet('{p.as_posix()}')"
-    ).fetchdf()
-    con.close()
+    # 1) Coletar nomes e tipos do rodapé do Parquet (registro de esquema, sem varrer dados)
+    schema = get_parquet_schema(str(p))
+    cols_df = pd.DataFrame({
+        "parquet_column": list(schema.columns),
+        "parquet_type": [schema.types[c] for c in schema.columns],
+    })
 
-    # desc: columns: column_name, column_type, null, key, default, extra
-    cols_df = desc.rename(columns={"column_name": "parquet_column", "column_type": "parquet_type"})[
-        ["parquet_column", "parquet_type"]
-    ].copy()
-
-    # 2) Determinar equivalente no app via função de alias/normalização
-    dummy = pd.DataFrame(columns=cols_df["parquet_column"].tolist())
-    renamed = T._rename_by_alias(dummy)
-    canon_map = {orig: new for orig, new in zip(dummy.columns, renamed.columns)}
+    # 2) Determinar equivalente no app pelos nomes canônicos do registro
+    canon_map = schema.canon
 
     cols_df["app_equivalent"] = cols_df["parquet_column"].map(canon_map).where(
         cols_df["parquet_column"].map(canon_map).ne(cols_df["parquet_column"]), None
@@ -60,7 +53,7 @@ def main() -> None:
 
     # 3) Alias humano e mapeamentos de código (quando houver)
     def human_alias(col: str | None) -> str | None:
-        if not col:
+        if not isinstance(col, str) or not col:
             return None
         # Variáveis V0001..V0007
         if col.upper().startswith("V000") and len(col) == 5:
@@ -83,7 +76,7 @@ def main() -> None:
         return None
 
     def code_map(col: str | None) -> str | None:
-        if not col:
+        if not isinstance(col, str) or not col:
             return None
         if col == "CD_SITUACAO":
             return json.dumps(T.SITUACAO_DET_MAP, ensure_ascii=False)
@@ -100,7 +93,7 @@ def main() -> None:
 
     # 4) Tipo sugerido no app (conhecido para alguns campos)
     def app_type(col: str | None) -> str | None:
-        if not col:
+        if not isinstance(col, str) or not col:
             return None
         if col in ("V0005", "V0006"):
             return "float64"
@@ -0,0 +1,128 @@
+from __future__ import annotations
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+
+def _add_paths(root: Path) -> None:
+    src = root / "src"
+    if str(src) not in sys.path:
+        sys.path.insert(0, str(src))
+    if str(root) not in sys.path:
+        sys.path.insert(0, str(root))
+
+
+def _q(c: str) -> str:
+    return '"' + c.replace('"', '""') + '"'
+
+
+def main() -> None:
+    """Reescreve o Parquet de origem no layout otimizado lido pelo app.
+
+    - particionado por CD_UF no estilo hive (<saida>/CD_UF=35/data_0.parquet)
+    - ordenado por CD_MUN, CD_SETOR dentro de cada UF
+    - row groups de --row-group-size linhas, zstd, dicionário e min/max por coluna
+    - <saida>/_layout.json gravado por último (marca o layout para os carregadores)
+
+    Uso: python docs/optimize_parquet.py [origem.parquet] [diretorio_saida] [--row-group-size N]
+    Sem argumentos, usa paths.parquet_default e grava <origem>_otimizado ao lado.
+    Depois, aponte paths.parquet_default para o diretório de saída.
+    """
+    root = Path(__file__).resolve().parents[1]
+    _add_paths(root)
+
+    if importlib.util.find_spec("duckdb") is None:
+        raise SystemExit("duckdb não encontrado. Instale com: pip install duckdb")
+
+    from config.config_loader import get_settings
+    from censo_app.db import cursor
+    from censo_app.layout import LAYOUT_MARKER, LAYOUT_VERSION, PARTITION_COLUMN, detect_layout
+    from censo_app.schema import get_parquet_schema
+
+    ap = argparse.ArgumentParser(description="Gera o layout Parquet otimizado (CD_UF hive + ordenação geográfica).")
+    ap.add_argument("origem", nargs="?")
+    ap.add_argument("saida", nargs="?")
+    ap.add_argument("--row-group-size", type=int, default=16_384,
+                    help="linhas por row group (padrão 16384: poda por município sem inflar o arquivo)")
+    ap.add_argument("--compression-level", type=int, default=3)
+    args = ap.parse_args()
+
+    src = Path(args.origem or (get_settings() or {}).get("paths", {}).get("parquet_default")
+               or root / "data" / "base_integrada_final.parquet")
+    if not src.exists():
+        raise SystemExit(f"Arquivo Parquet não encontrado: {src}")
+    if detect_layout(str(src)):
+        raise SystemExit(f"A origem já está no layout otimizado: {src}")
+    out = Path(args.saida) if args.saida else src.with_name(f"{src.stem}_otimizado")
+
+    schema = get_parquet_schema(str(src))
+    phys = {k: schema.physical(k) for k in (PARTITION_COLUMN, "CD_MUN", "CD_SETOR")}
+    if phys[PARTITION_COLUMN] is None:
+        raise SystemExit("Coluna de UF não encontrada na origem (ver docs/columns_map.csv).")
+    uf = phys[PARTITION_COLUMN]
+    order = ", ".join(_q(c) for c in (uf, phys["CD_MUN"], phys["CD_SETOR"]) if c)
+    # A coluna de partição vira o diretório CD_UF=<uf> (nome canônico) e sai dos arquivos
+    select = f"SELECT * EXCLUDE ({_q(uf)}), {_q(uf)} AS {PARTITION_COLUMN} FROM read_parquet('{src.as_posix()}') ORDER BY {order}"
+
+    tmp = out.with_name(f"{out.name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    t0 = time.perf_counter()
+    with cursor() as con:
+        con.execute(
+            f"COPY ({select}) TO '{tmp.as_posix()}' (FORMAT PARQUET, PARTITION_BY ({PARTITION_COLUMN}), "
+            f"COMPRESSION ZSTD, COMPRESSION_LEVEL {int(args.compression_level)}, "
+            f"ROW_GROUP_SIZE {int(args.row_group_size)})"
+        )
+        files = f"{tmp.as_posix()}/*/*.parquet"
+        n_src = con.execute(f"SELECT COUNT(*) FROM read_parquet('{src.as_posix()}')").fetchone()[0]
+        n_out = con.execute(f"SELECT COUNT(*) FROM read_parquet('{files}')").fetchone()[0]
+        if n_src != n_out:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise SystemExit(f"Contagem divergente após a reescrita: {n_src} != {n_out}")
+        geo = [c for c in (phys["CD_MUN"], phys["CD_SETOR"]) if c]
+        stats = con.execute(
+            f"SELECT path_in_schema, COUNT(*), COUNT(stats_min_value) FROM parquet_metadata('{files}') "
+            f"WHERE path_in_schema IN ({', '.join(repr(c) for c in geo)}) GROUP BY 1"
+        ).fetchall()
+        partitions = con.execute(
+            f"SELECT regexp_extract(file_name, '{PARTITION_COLUMN}=([^/\\\\]+)', 1), SUM(num_rows), SUM(num_row_groups) "
+            f"FROM parquet_file_metadata('{files}') GROUP BY 1 ORDER BY 1"
+        ).fetchall()
+    for col, n_rg, n_stats in stats:
+        if n_stats != n_rg:
+            print(f"Aviso: {col} sem min/max em {n_rg - n_stats} de {n_rg} row groups")
+
+    src_stat = src.stat()
+    meta = {
+        "version": LAYOUT_VERSION,
+        "partition": PARTITION_COLUMN,
+        "partition_type": schema.types.get(uf, "VARCHAR"),
+        "sort": ["CD_MUN", "CD_SETOR"],
+        "row_group_size": int(args.row_group_size),
+        "compression": f"zstd:{int(args.compression_level)}",
+        "rows": int(n_out),
+        "partitions": {str(k): {"rows": int(r), "row_groups": int(g)} for k, r, g in partitions},
+        "source": {"path": src.resolve().as_posix(), "mtime_ns": src_stat.st_mtime_ns, "size": src_stat.st_size},
+    }
+    (tmp / LAYOUT_MARKER).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    if out.exists():
+        old = out.with_name(f"{out.name}.old{os.getpid()}")
+        os.replace(out, old)
+        os.replace(tmp, out)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp, out)
+
+    size = sum(f.stat().st_size for f in out.rglob("*.parquet"))
+    print(f"Layout otimizado salvo em: {out} ({n_out:,} linhas, {len(partitions)} partições, "
+          f"{size / 2**20:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+    print(f"Aponte paths.parquet_default para: {out}")
+
+
+if __name__ == "__main__":
+    main()
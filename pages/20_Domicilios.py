@@ -3,20 +3,44 @@ import pandas as pd
 from pathlib import Path
 
 from config.config_loader import get_settings
-from censo_app.transform import carregar_sp_idade_sexo_enriquecido as carregar_base
+from censo_app.transform import carregar_sp_idade_sexo_enriquecido as carregar_base, TIPO_MAP
 from censo_app.viz import construir_grafico_pizza, construir_grafico_barra
+from censo_app.bitmap import BitmapIndex
+from censo_app.clustered import OffsetIndex
+from censo_app.territory import SEARCH_LIMIT, TerritorySearch
 
 st.set_page_config(page_title="Domicílios", layout="wide", initial_sidebar_state="collapsed")
 
 SETTINGS = get_settings()
 
-@st.cache_data(show_spinner=False)
-def carregar_df():
+@st.cache_resource(show_spinner=False, max_entries=2)
+def carregar_df(colunas: tuple[str, ...] = ()):
+    # Um frame por processo, compartilhado (somente leitura) por todas as sessões:
+    # cache_data devolveria uma cópia desserializada a cada rerun de cada sessão
     parquet = SETTINGS.get("paths", {}).get("parquet", "data/sp.parquet")
     excel_rm = SETTINGS.get("paths", {}).get("rm_xlsx", "insumos/Composicao_RM_2024.xlsx")
-    df = carregar_base(parquet, limite=None, detalhar=False, uf="35", caminho_excel=excel_rm)
+    # Projeção: apenas chaves geográficas, situação/tipo e as colunas dos grupos configurados.
+    # agrupar_geo: ordem (CD_MUN, CD_SETOR), exigida por indice_offsets.
+    # Lido uma vez; Situação/Tipo/escala são aplicados por bitmaps (indice_bitmap).
+    df = carregar_base(parquet, limite=None, detalhar=False, uf="35", caminho_excel=excel_rm,
+                       familias=("geo", "situacao", "tipo"), colunas=list(colunas), agrupar_geo=True)
     return df
 
+@st.cache_resource(show_spinner=False)
+def indice_bitmap(colunas: tuple[str, ...] = ()) -> BitmapIndex:
+    # Bitmaps por valor sobre as posições de carregar_df (mesma ordem de linhas)
+    return BitmapIndex.from_frame(carregar_df(colunas))
+
+@st.cache_resource(show_spinner=False)
+def indice_offsets(colunas: tuple[str, ...] = ()) -> OffsetIndex:
+    # Início/fim por município e setor (carregar_df sai ordenado por CD_MUN, CD_SETOR)
+    return OffsetIndex.from_frame(carregar_df(colunas))
+
+@st.cache_resource(show_spinner=False)
+def indice_busca(colunas: tuple[str, ...] = ()) -> TerritorySearch:
+    # Árvore territorial + busca por código/nome; só os primeiros resultados vão ao navegador
+    return TerritorySearch.from_frame(carregar_df(colunas))
+
 @st.cache_data(show_spinner=False)
 def ler_grupos():
     import yaml
@@ -33,56 +57,70 @@ def _fmt_mun(cd: str|None, lookup: pd.DataFrame):
         return str(cd)
     return f"{row.iloc[0]['NM_MUN']} ({row.iloc[0]['CD_MUN']})"
 
-df = carregar_df()
 _cfg = ler_grupos() or {}
 grupos = (_cfg.get("groups") or [])
 palette = (_cfg.get("palette") or [])
+colunas_grupos = tuple(dict.fromkeys(c for g in grupos for c in g.get("columns", [])))
 
 st.title("Domicílios — Indicadores Categóricos")
 
 with st.sidebar:
     st.subheader("Filtros")
-    sit_opts = sorted(df.get("SITUACAO", pd.Series(dtype=str)).dropna().unique().tolist()) or ["Urbana","Rural"]
-    tipos = sorted(pd.to_numeric(df.get("CD_TIPO"), errors="coerce").dropna().unique().astype(int).tolist())
+    sit_opts = ["Rural", "Urbana"]
+    tipos = sorted(TIPO_MAP.keys())
     sel_sit = st.multiselect("Situação", options=sit_opts, default=sit_opts)
     sel_tipos = st.multiselect("Tipo de Setor", options=tipos, default=tipos)
     nivel = st.selectbox("Nível", ["Estado","RM/AU","Região Intermediária","Região Imediata","Município","Setores"], index=4)
 
-df_filt = df.copy()
-if "SITUACAO" in df_filt.columns:
-    df_filt = df_filt[df_filt["SITUACAO"].isin(sel_sit)]
-if "CD_TIPO" in df_filt.columns and sel_tipos:
-    df_filt = df_filt[df_filt["CD_TIPO"].isin(sel_tipos)]
+if not sel_sit:
+    st.info("Selecione ao menos uma Situação.")
+    st.stop()
+# Filtros como AND/OR de bitmaps por setor; o frame só é recortado depois
+df_all = carregar_df(colunas_grupos)
+bix = indice_bitmap(colunas_grupos)
+offsets = indice_offsets(colunas_grupos)
+bits = bix.select(SITUACAO=sel_sit, CD_TIPO=sel_tipos)
+mask = bix.mask(bits)
+df_filt = df_all[mask]
 
 # Escopo geográfico (mesma lógica da Demografia, versão compacta)
 title_suffix = "Estado de São Paulo"
-if nivel == "RM/AU" and "NOME_RM_AU" in df_filt.columns:
-    nomes = sorted(df_filt["NOME_RM_AU"].dropna().unique().tolist())
+if nivel == "RM/AU" and "NOME_RM_AU" in bix.bitmaps:
+    nomes = sorted(bix.present("NOME_RM_AU", bits))
     sel = st.selectbox("Região (RM/AU)", nomes)
-    df_scope = df_filt[df_filt["NOME_RM_AU"].eq(sel)]
+    df_scope = df_all[bix.mask(bix.select(bits, NOME_RM_AU=[sel]))]
     title_suffix = sel
-elif nivel == "Região Intermediária" and "NM_RGINT" in df_filt.columns:
-    nomes = sorted(df_filt["NM_RGINT"].dropna().unique().tolist())
+elif nivel == "Região Intermediária" and "NM_RGINT" in bix.bitmaps:
+    nomes = sorted(bix.present("NM_RGINT", bits))
     sel = st.selectbox("Região Intermediária", nomes)
-    df_scope = df_filt[df_filt["NM_RGINT"].eq(sel)]
+    df_scope = df_all[bix.mask(bix.select(bits, NM_RGINT=[sel]))]
     title_suffix = sel
-elif nivel == "Região Imediata" and "NM_RGI" in df_filt.columns:
-    nomes = sorted(df_filt["NM_RGI"].dropna().unique().tolist())
+elif nivel == "Região Imediata" and "NM_RGI" in bix.bitmaps:
+    nomes = sorted(bix.present("NM_RGI", bits))
     sel = st.selectbox("Região Imediata", nomes)
-    df_scope = df_filt[df_filt["NM_RGI"].eq(sel)]
+    df_scope = df_all[bix.mask(bix.select(bits, NM_RGI=[sel]))]
     title_suffix = sel
 elif nivel == "Município" and {"CD_MUN","NM_MUN"} <= set(df_filt.columns):
     mun_df = df_filt[["CD_MUN","NM_MUN"]].dropna().drop_duplicates()
     sel_mun = st.selectbox("Município", [None]+mun_df["CD_MUN"].tolist(), format_func=lambda x: _fmt_mun(x, mun_df))
     if sel_mun:
-        df_scope = df_filt[df_filt["CD_MUN"].astype(str).eq(str(sel_mun))]
+        df_scope = offsets.take(df_all, "CD_MUN", sel_mun, mask)
         title_suffix = _fmt_mun(sel_mun, mun_df)
     else:
         st.stop()
 elif nivel == "Setores" and "CD_SETOR" in df_filt.columns:
-    set_opts = sorted(df_filt["CD_SETOR"].dropna().unique().tolist())
-    sel_set = st.selectbox("Setor", set_opts)
-    df_scope = df_filt[df_filt["CD_SETOR"].eq(sel_set)]
+    busca = st.text_input(f"Buscar setor (código) — até {SEARCH_LIMIT} resultados", key="dom_setor_busca")
+    indice = indice_busca(colunas_grupos)
+    found = indice.search(busca, level="CD_SETOR", row_mask=mask)
+    if found.empty:
+        st.info("Nenhum setor encontrado para a busca.")
+        st.stop()
+    muns = indice.tree.levels["CD_MUN"]["label"] if "CD_MUN" in indice.tree.levels else pd.Series(dtype=object)
+    pais = dict(zip(found["key"], found["parent"]))
+    sel_set = st.selectbox("Setor", found["key"].tolist(), format_func=lambda c: f"{c} — {muns.get(pais.get(c), '')}")
+    if found.attrs["total"] > len(found):
+        st.caption(f"{len(found)} de {found.attrs['total']:,} setores — refine a busca para ver outros.".replace(",", "."))
+    df_scope = offsets.take(df_all, "CD_SETOR", sel_set, mask)
     title_suffix = f"Setor {sel_set}"
 else:
     df_scope = df_filt
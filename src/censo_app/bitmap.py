@@ -0,0 +1,107 @@
+"""Índices bitmap por valor sobre as posições dos setores (filtros das páginas).
+
+Para cada coluna de filtro (SITUACAO, CD_SITUACAO, CD_TIPO, RM/AU, RGI, RGINT) e cada
+valor distinto guarda um bitmap compactado (np.packbits) das linhas do frame por setor.
+Uma combinação de filtros vira OR dentro da coluna e AND entre colunas, em operações
+vetorizadas sobre bytes, antes de materializar qualquer recorte do frame.
+"""
+from __future__ import annotations
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .cube import _factorize
+
+# nome do índice -> colunas (RM_AU: par TIPO_RM_AU em maiúsculas + NOME_RM_AU, como no cubo)
+BITMAP_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "SITUACAO": ("SITUACAO",),
+    "CD_SITUACAO": ("CD_SITUACAO",),
+    "CD_TIPO": ("CD_TIPO",),
+    "RM_AU": ("TIPO_RM_AU", "NOME_RM_AU"),
+    "RM_NOME": ("RM_NOME",),
+    "AU_NOME": ("AU_NOME",),
+    "NOME_RM_AU": ("NOME_RM_AU",),
+    "NM_RGI": ("NM_RGI",),
+    "NM_RGINT": ("NM_RGINT",),
+}
+
+
+class BitmapIndex:
+    """bitmaps[nome] = (valores, matriz uint8 (k, ceil(n/8))) com um bitmap por valor."""
+
+    def __init__(self, n_rows: int, bitmaps: Dict[str, Tuple[pd.Index, np.ndarray]]):
+        self.n_rows = n_rows
+        self.bitmaps = bitmaps
+        self._all = np.packbits(np.ones(n_rows, dtype=bool))
+        # valor -> linha da matriz (dict: consulta O(1) também para pares RM/AU)
+        self._pos = {name: {v: i for i, v in enumerate(labels)} for name, (labels, _) in bitmaps.items()}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: Optional[Dict[str, Tuple[str, ...]]] = None) -> "BitmapIndex":
+        """Índice sobre as posições de df (0..len-1); colunas ausentes são ignoradas."""
+        n = len(df)
+        nbytes = (n + 7) // 8
+        bitmaps: Dict[str, Tuple[pd.Index, np.ndarray]] = {}
+        for name, cols in (columns or BITMAP_COLUMNS).items():
+            if not all(c in df.columns for c in cols):
+                continue
+            codes, labels = _factorize(df.reset_index(drop=True), cols)
+            mat = np.zeros((len(labels), nbytes), dtype=np.uint8)
+            valid = np.flatnonzero(codes >= 0)
+            order = valid[np.argsort(codes[valid], kind="stable")]
+            sc = codes[order]
+            bounds = np.flatnonzero(np.r_[True, sc[1:] != sc[:-1], True]) if len(sc) else np.array([0])
+            bits = np.zeros(n, dtype=bool)
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                rows = order[a:b]
+                bits[rows] = True
+                mat[sc[a]] = np.packbits(bits)
+                bits[rows] = False
+            bitmaps[name] = (labels, mat)
+        return cls(n, bitmaps)
+
+    def all(self) -> np.ndarray:
+        """Bitmap com todas as linhas."""
+        return self._all.copy()
+
+    def none(self) -> np.ndarray:
+        return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def bitmap(self, name: str, values: Iterable[Hashable]) -> np.ndarray:
+        """OR dos bitmaps dos valores pedidos (valores inexistentes não contribuem)."""
+        lookup = self._pos[name]
+        pos = [lookup[v] for v in values if v in lookup]
+        if not pos:
+            return self.none()
+        return np.bitwise_or.reduce(self.bitmaps[name][1][pos], axis=0)
+
+    def select(self, within: Optional[np.ndarray] = None, **filters: Optional[Sequence]) -> np.ndarray:
+        """AND entre índices do OR dos valores; filtro None/vazio não restringe."""
+        out = self.all() if within is None else within.copy()
+        for name, values in filters.items():
+            if values is None or len(values) == 0 or name not in self.bitmaps:
+                continue
+            out &= self.bitmap(name, values)
+        return out
+
+    def present(self, name: str, within: np.ndarray) -> List[Hashable]:
+        """Valores do índice com ao menos uma linha dentro do bitmap (opções em cascata)."""
+        labels, mat = self.bitmaps[name]
+        hit = (mat & within).any(axis=1)
+        return [labels[i] for i in np.flatnonzero(hit)]
+
+    def mask(self, bits: np.ndarray) -> np.ndarray:
+        """Bitmap -> máscara booleana de len n_rows."""
+        return np.unpackbits(bits, count=self.n_rows).astype(bool)
+
+    def positions(self, bits: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(self.mask(bits))
+
+    def count(self, bits: np.ndarray) -> int:
+        return int(np.unpackbits(bits, count=self.n_rows).sum())
+
+
+# Alias em PT-BR
+def construir_indice_bitmap(df: pd.DataFrame) -> BitmapIndex:
+    return BitmapIndex.from_frame(df)
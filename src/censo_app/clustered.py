@@ -0,0 +1,89 @@
+"""Ordem geográfica agrupada (CD_MUN, CD_SETOR) e tabela de offsets por chave.
+
+O frame enriquecido sai do carregamento ordenado por município e setor, de modo que
+as linhas de cada município (e de cada setor) são contíguas. O OffsetIndex guarda
+início/fim de cada bloco: extrair o escopo de um município ou setor vira um fatiamento
+df.iloc[início:fim] (sem varrer a coluna), opcionalmente combinado com a máscara dos
+filtros já aplicados no mesmo intervalo.
+"""
+from __future__ import annotations
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+CLUSTER_KEYS: Tuple[str, ...] = ("CD_MUN", "CD_SETOR")
+
+
+def cluster_by_geo(df: pd.DataFrame, keys: Tuple[str, ...] = CLUSTER_KEYS) -> pd.DataFrame:
+    """df ordenado (estável, nulos ao fim) pelas chaves presentes; índice 0..n-1."""
+    by = [k for k in keys if k in df.columns]
+    if not by:
+        return df
+    out = df.sort_values(by, kind="stable", na_position="last", ignore_index=True)
+    out.attrs = df.attrs
+    return out
+
+
+def _runs(values: pd.Series) -> Dict[Hashable, Tuple[int, int]]:
+    """valor -> (início, fim) do bloco contíguo; ValueError se o valor aparece em mais de um bloco."""
+    codes, labels = pd.factorize(values, use_na_sentinel=True)
+    n = len(codes)
+    if n == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], n]
+    rc = codes[starts]
+    keep = rc >= 0
+    if np.unique(rc[keep]).size != int(keep.sum()):
+        raise ValueError(f"Frame não está agrupado por {values.name}: use cluster_by_geo antes do índice.")
+    return dict(zip(np.asarray(labels, dtype=object)[rc[keep]].tolist(), zip(starts[keep].tolist(), ends[keep].tolist())))
+
+
+class OffsetIndex:
+    """offsets[chave][valor] = (início, fim) das linhas do valor no frame agrupado."""
+
+    def __init__(self, n_rows: int, offsets: Dict[str, Dict[Hashable, Tuple[int, int]]]):
+        self.n_rows = n_rows
+        self.offsets = offsets
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, keys: Tuple[str, ...] = CLUSTER_KEYS) -> "OffsetIndex":
+        """Índice sobre as posições de df (já ordenado por cluster_by_geo); chaves ausentes são ignoradas."""
+        return cls(len(df), {k: _runs(df[k]) for k in keys if k in df.columns})
+
+    def range(self, key: str, value: Hashable) -> Tuple[int, int]:
+        """(início, fim) do valor; (0, 0) se ausente."""
+        return self.offsets.get(key, {}).get(value, (0, 0))
+
+    def take(self, df: pd.DataFrame, key: str, value: Hashable, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Fatia df[início:fim] do valor; mask (len n_rows) restringe às linhas filtradas do intervalo."""
+        return self._slice(df, self.range(key, value), mask)
+
+    def take_many(self, df: pd.DataFrame, key: str, values: Iterable[Hashable],
+                  mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Concatenação das fatias dos valores, na ordem do frame."""
+        spans = sorted({self.range(key, v) for v in values} - {(0, 0)})
+        if not spans:
+            return df.iloc[0:0]
+        if len(spans) == 1:
+            return self._slice(df, spans[0], mask)
+        pos = np.concatenate([np.arange(a, b) for a, b in spans])
+        if mask is not None:
+            pos = pos[mask[pos]]
+        return df.iloc[pos]
+
+    @staticmethod
+    def _slice(df: pd.DataFrame, span: Tuple[int, int], mask: Optional[np.ndarray]) -> pd.DataFrame:
+        a, b = span
+        out = df.iloc[a:b]
+        return out if mask is None else out[mask[a:b]]
+
+
+# Aliases em PT-BR
+def agrupar_por_geo(df: pd.DataFrame) -> pd.DataFrame:
+    return cluster_by_geo(df)
+
+
+def construir_indice_offsets(df: pd.DataFrame) -> OffsetIndex:
+    return OffsetIndex.from_frame(df)
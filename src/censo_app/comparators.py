@@ -0,0 +1,163 @@
+"""Comparadores de um município/setor: todos os níveis que o contêm, de uma vez.
+
+Para cada município guarda, uma vez, o nó de cada nível do cubo que o contém
+(RM/AU — ou RM_NOME/AU_NOME no legado —, Região Imediata, Região Intermediária e Estado;
+para setores, também o próprio município). pyramids() devolve as pirâmides de todos os
+candidatos numa única soma sobre as fatias de situação/tipo escolhidas (ou, com recorte
+RM/AU ativo, sobre as linhas do recorte) e memoiza cada uma por (nó, filtros) com
+despejo LRU: trocar ou sobrepor comparadores não refaz agregação.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .cube import CUBE_LEVELS, ESTADO, PyramidCube, _factorize
+from .tensor import PyramidTensor
+
+# Ordem de preferência (o primeiro com população é o comparador padrão)
+COMPARATOR_LEVELS: Tuple[str, ...] = ("CD_MUN", "RM_AU", "RM_NOME", "AU_NOME", "NM_RGI", "NM_RGINT", ESTADO)
+STATE_TITLE = "Estado de São Paulo"
+
+
+@dataclass(frozen=True)
+class Comparator:
+    key: Tuple[str, Hashable]  # (nível do cubo, nó); Estado = (ESTADO, None)
+    title: str
+
+
+def _title(level: str, value: Hashable, mun_name: object = None) -> str:
+    if level == "RM_AU":
+        return f"{value[0]} — {value[1]}"
+    if level == "RM_NOME":
+        return f"RM — {value}"
+    if level == "AU_NOME":
+        return f"AU — {value}"
+    if level == "NM_RGI":
+        return f"Região Imediata — {value}"
+    if level == "NM_RGINT":
+        return f"Região Intermediária — {value}"
+    if level == "CD_MUN":
+        return f"Município — {mun_name if isinstance(mun_name, str) and mun_name else value}"
+    return STATE_TITLE
+
+
+class ComparatorEngine:
+    """Candidatos por município + pirâmides (11, 2) memoizadas por (nó, situação, tipos, recorte)."""
+
+    def __init__(self, tensor: PyramidTensor, cube: PyramidCube, sectors: pd.DataFrame, max_entries: int = 256):
+        self.tensor = tensor
+        self.cube = cube
+        self.max_entries = max_entries
+        self._memo: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        sectors = sectors.reset_index(drop=True)
+        # códigos por setor dos níveis do cubo (recortes ad hoc: linhas do nó ∩ recorte)
+        self._codes: Dict[str, Tuple[np.ndarray, pd.Index]] = {
+            name: _factorize(sectors, cols) for name, cols in CUBE_LEVELS.items()
+            if name in cube.nodes and all(c in sectors.columns for c in cols)
+        }
+        # nó de cada nível por município (primeiro setor com valor)
+        self._by_mun: Dict[Hashable, List[Comparator]] = {}
+        if "CD_MUN" in self._codes:
+            mun_codes, muns = self._codes["CD_MUN"]
+            names = sectors["NM_MUN"] if "NM_MUN" in sectors.columns else pd.Series(pd.NA, index=sectors.index)
+            first: Dict[str, np.ndarray] = {}
+            for name, (codes, _) in self._codes.items():
+                ok = (mun_codes >= 0) & (codes >= 0)
+                node = np.full(len(muns), -1, dtype=np.int64)
+                # ordem reversa: a última atribuição (primeiro setor) prevalece
+                node[mun_codes[ok][::-1]] = codes[ok][::-1]
+                first[name] = node
+            name_at = np.full(len(muns), -1, dtype=np.int64)
+            rows = np.flatnonzero(mun_codes >= 0)[::-1]
+            name_at[mun_codes[rows]] = rows
+            for i, mun in enumerate(muns):
+                out = []
+                for level in COMPARATOR_LEVELS[1:-1]:
+                    if level not in first or first[level][i] < 0:
+                        continue
+                    # RM/AU unificada tem precedência sobre as colunas legadas
+                    if level in ("RM_NOME", "AU_NOME") and "RM_AU" in first and first["RM_AU"][i] >= 0:
+                        continue
+                    value = self._codes[level][1][first[level][i]]
+                    out.append(Comparator((level, value), _title(level, value)))
+                out.append(Comparator((ESTADO, None), STATE_TITLE))
+                self._by_mun[mun] = [Comparator(("CD_MUN", mun), _title("CD_MUN", mun, names.iat[name_at[i]]))] + out
+
+    def candidates(self, cd_mun: Hashable, include_municipality: bool = False) -> List[Comparator]:
+        """Níveis que contêm o município (com o próprio município à frente, para setores)."""
+        out = self._by_mun.get(cd_mun)
+        if out is None:
+            return [Comparator((ESTADO, None), STATE_TITLE)]
+        return list(out) if include_municipality else out[1:]
+
+    def _node(self, key: Tuple[str, Hashable]) -> np.ndarray:
+        level, value = key
+        if level == ESTADO:
+            return self.cube.total
+        labels, data = self.cube.nodes[level]
+        try:
+            return data[labels.get_loc(value)]
+        except KeyError:
+            return np.zeros_like(self.cube.total)
+
+    def _rows(self, key: Tuple[str, Hashable], restrict: np.ndarray) -> np.ndarray:
+        level, value = key
+        if level == ESTADO:
+            return np.flatnonzero(restrict)
+        codes, labels = self._codes[level]
+        try:
+            i = labels.get_loc(value)
+        except KeyError:
+            return np.zeros(0, dtype=np.intp)
+        return np.flatnonzero((codes == i) & restrict)
+
+    def pyramids(self, comparators: Sequence[Comparator], situacao: Optional[Sequence] = None,
+                 tipos: Optional[Sequence] = None, restrict: Optional[np.ndarray] = None,
+                 restrict_key: Hashable = None) -> Dict[Tuple[str, Hashable], np.ndarray]:
+        """{chave: pirâmide (11, 2)} dos comparadores sob os filtros; None = sem filtro.
+
+        restrict: máscara por setor do recorte RM/AU (identificado por restrict_key na memória).
+        Os arrays devolvidos são compartilhados (somente leitura).
+        """
+        fkey = (None if situacao is None else tuple(situacao), None if tipos is None else tuple(tipos),
+                restrict_key if restrict is not None else None)
+        out: Dict[Tuple[str, Hashable], np.ndarray] = {}
+        missing = []
+        with self._lock:
+            for c in comparators:
+                got = self._memo.get((c.key, fkey))
+                if got is None:
+                    missing.append(c.key)
+                else:
+                    self._memo.move_to_end((c.key, fkey))
+                    out[c.key] = got
+        if not missing:
+            return out
+        if restrict is None:
+            # uma soma para todos os candidatos: (k, S, T, faixa, sexo) -> (k, faixa, sexo)
+            si = self.cube._slices("situacoes", situacao)
+            ti = self.cube._slices("tipos", tipos)
+            stacked = np.stack([self._node(k) for k in missing])
+            result = stacked[:, si][:, :, ti].sum(axis=(1, 2), dtype=np.uint64)
+        else:
+            result = np.stack([self.cube.partitions_for_rows(self.tensor, self._rows(k, restrict)).pyramid(situacao, tipos)
+                               for k in missing])
+        result.setflags(write=False)
+        with self._lock:
+            for k, pyr in zip(missing, result):
+                out[k] = pyr
+                self._memo[(k, fkey)] = pyr
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return out
+
+
+# Alias em PT-BR
+def montar_comparadores(tensor: PyramidTensor, cubo: PyramidCube, setores: pd.DataFrame) -> ComparatorEngine:
+    return ComparatorEngine(tensor, cubo, setores)
@@ -0,0 +1,189 @@
+"""Cubo pré-calculado de pirâmides por nó territorial x SITUACAO x CD_TIPO.
+
+Montado uma vez a partir do PyramidTensor (por versão do dataset): para cada nó de
+Estado -> RGINT -> RGI -> município e para cada RM/AU guarda os totais
+(situação, tipo, faixa, sexo). Uma seleção da página vira uma consulta ao índice do
+nível + soma sobre as poucas fatias de situação/tipo escolhidas, sem varrer setores.
+
+PartitionedPyramid mantém a soma corrente das partições (situação, tipo) de um escopo:
+ao marcar/desmarcar um valor de filtro, soma ou subtrai só as partições que mudaram.
+"""
+from __future__ import annotations
+from itertools import product
+from typing import Dict, FrozenSet, Hashable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .tensor import PyramidTensor, pyramid_frame
+
+ESTADO = "__estado__"
+
+# nível do cubo -> colunas do frame por setor (RM_AU: par TIPO_RM_AU em maiúsculas + NOME_RM_AU)
+CUBE_LEVELS: Dict[str, Tuple[str, ...]] = {
+    "NM_RGINT": ("NM_RGINT",),
+    "NM_RGI": ("NM_RGI",),
+    "CD_MUN": ("CD_MUN",),
+    "RM_AU": ("TIPO_RM_AU", "NOME_RM_AU"),
+    "RM_NOME": ("RM_NOME",),
+    "AU_NOME": ("AU_NOME",),
+}
+
+
+def _factorize(geo: pd.DataFrame, cols: Tuple[str, ...]) -> Tuple[np.ndarray, pd.Index]:
+    if len(cols) == 1:
+        codes, labels = pd.factorize(geo[cols[0]], use_na_sentinel=True)
+        return codes, pd.Index(labels)
+    na = np.zeros(len(geo), dtype=bool)
+    parts = []
+    for c in cols:
+        na |= geo[c].isna().to_numpy()
+        parts.append(geo[c].astype(str).str.upper() if c == "TIPO_RM_AU" else geo[c])
+    codes, labels = pd.factorize(pd.MultiIndex.from_arrays(parts))
+    codes = np.where(na, -1, codes)
+    return codes, labels
+
+
+class PyramidCube:
+    """Totais (nó, situação, tipo, faixa, sexo); a última fatia de situação/tipo guarda ausentes."""
+
+    def __init__(self, situacoes: pd.Index, tipos: pd.Index, total: np.ndarray,
+                 nodes: Dict[str, Tuple[pd.Index, np.ndarray]], cell: Optional[np.ndarray] = None):
+        self.situacoes = situacoes
+        self.tipos = tipos
+        self.total = total
+        self.nodes = nodes
+        self.cell = cell  # célula situação*(T)+tipo de cada setor (partições de recortes ad hoc)
+        # rótulo -> fatia (dict: seleção de filtros sem Index.isin a cada consulta)
+        self._pos = {"situacoes": {v: i for i, v in enumerate(situacoes)},
+                     "tipos": {v: i for i, v in enumerate(tipos)}}
+
+    @classmethod
+    def from_tensor(cls, tensor: PyramidTensor, geo: Optional[pd.DataFrame] = None,
+                    levels: Optional[Dict[str, Tuple[str, ...]]] = None) -> "PyramidCube":
+        """geo: frame por setor na ordem do tensor (padrão: tensor.geo; a página passa o já limpo)."""
+        geo = tensor.geo if geo is None else geo.reset_index(drop=True)
+        n = tensor.n_sectors
+        sit_codes, situacoes = _factorize(geo, ("SITUACAO",)) if "SITUACAO" in geo.columns else (np.full(n, -1), pd.Index([]))
+        tipo_codes, tipos = _factorize(geo, ("CD_TIPO",)) if "CD_TIPO" in geo.columns else (np.full(n, -1), pd.Index([]))
+        S, T = len(situacoes) + 1, len(tipos) + 1
+        cell = np.where(sit_codes < 0, S - 1, sit_codes) * T + np.where(tipo_codes < 0, T - 1, tipo_codes)
+        shape = tensor.counts.shape[1:]
+
+        def _rollup(codes: np.ndarray, k: int) -> np.ndarray:
+            out = np.zeros((k * S * T,) + shape, dtype=np.uint64)
+            keep = codes >= 0
+            key = codes[keep].astype(np.int64) * (S * T) + cell[keep]
+            if len(key):
+                order = np.argsort(key, kind="stable")
+                sk = key[order]
+                starts = np.flatnonzero(np.r_[True, sk[1:] != sk[:-1]])
+                rows = np.flatnonzero(keep)[order]
+                out[sk[starts]] = np.add.reduceat(tensor.counts[rows].astype(np.uint64), starts, axis=0)
+            return out.reshape((k, S, T) + shape)
+
+        total = _rollup(np.zeros(n, dtype=np.int64), 1)[0]
+        nodes: Dict[str, Tuple[pd.Index, np.ndarray]] = {}
+        for name, cols in (levels or CUBE_LEVELS).items():
+            if not all(c in geo.columns for c in cols):
+                continue
+            codes, labels = _factorize(geo, cols)
+            nodes[name] = (labels, _rollup(codes, len(labels)))
+        return cls(situacoes, tipos, total, nodes, cell)
+
+    def _slices(self, axis: str, wanted: Optional[Sequence]) -> np.ndarray:
+        lookup = self._pos[axis]
+        if wanted is None:
+            return np.arange(len(lookup) + 1)
+        return np.array(sorted({lookup[v] for v in wanted if v in lookup}), dtype=np.intp)
+
+    def pyramid(self, level: str, value: Hashable = None, situacao: Optional[Sequence] = None,
+                tipos: Optional[Sequence] = None) -> np.ndarray:
+        """Pirâmide (11, 2) do nó; None em situacao/tipos = sem filtro (inclui ausentes)."""
+        if level == ESTADO:
+            arr = self.total
+        else:
+            labels, data = self.nodes[level]
+            try:
+                arr = data[labels.get_loc(value)]
+            except KeyError:
+                return np.zeros(self.total.shape[2:], dtype=np.uint64)
+        si, ti = self._slices("situacoes", situacao), self._slices("tipos", tipos)
+        return arr[np.ix_(si, ti)].sum(axis=(0, 1), dtype=np.uint64)
+
+    def frame(self, level: str, value: Hashable = None, situacao: Optional[Sequence] = None,
+              tipos: Optional[Sequence] = None, age_order: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return pyramid_frame(self.pyramid(level, value, situacao, tipos), age_order)
+
+    def partitions(self, level: str, value: Hashable = None) -> "PartitionedPyramid":
+        """Partições (situação, tipo) de um nó do cubo (visão, sem cópia); nó ausente = zeros."""
+        if level == ESTADO:
+            arr = self.total
+        else:
+            labels, data = self.nodes[level]
+            try:
+                arr = data[labels.get_loc(value)]
+            except KeyError:
+                arr = np.zeros_like(self.total)
+        return PartitionedPyramid(self, arr)
+
+    def partitions_for_rows(self, tensor: PyramidTensor, rows: np.ndarray) -> "PartitionedPyramid":
+        """Partições de um recorte ad hoc (posições de setores), somadas uma vez por célula."""
+        if self.cell is None:
+            raise ValueError("Cubo sem códigos de célula por setor: monte-o com from_tensor.")
+        S, T = len(self.situacoes) + 1, len(self.tipos) + 1
+        out = np.zeros((S * T,) + self.total.shape[2:], dtype=np.uint64)
+        rows = np.asarray(rows)
+        if len(rows):
+            key = self.cell[rows]
+            order = np.argsort(key, kind="stable")
+            sk = key[order]
+            starts = np.flatnonzero(np.r_[True, sk[1:] != sk[:-1]])
+            out[sk[starts]] = np.add.reduceat(tensor.counts[rows[order]].astype(np.uint64), starts, axis=0)
+        return PartitionedPyramid(self, out.reshape((S, T) + self.total.shape[2:]))
+
+
+class PartitionedPyramid:
+    """parts[situação, tipo] de um escopo + soma das células selecionadas, atualizada por deltas."""
+
+    def __init__(self, cube: PyramidCube, parts: np.ndarray):
+        self.cube = cube
+        self.parts = parts
+        # (células, soma) trocados juntos numa única atribuição: chamadas simultâneas (objeto
+        # compartilhado entre sessões) partem cada uma de um par consistente
+        self._state: Tuple[FrozenSet[Tuple[int, int]], np.ndarray] = (
+            frozenset(), np.zeros(parts.shape[2:], dtype=np.uint64))
+
+    def pyramid(self, situacao: Optional[Sequence] = None, tipos: Optional[Sequence] = None) -> np.ndarray:
+        """Pirâmide (11, 2) das células pedidas (None = sem filtro, inclui ausentes).
+
+        Só as células que entraram/saíram desde a chamada anterior são somadas/subtraídas;
+        se a troca for maior que a nova seleção, recalcula direto.
+        """
+        cube = self.cube
+        cells = frozenset(product(cube._slices("situacoes", situacao).tolist(),
+                                  cube._slices("tipos", tipos).tolist()))
+        prev_cells, prev_sum = self._state
+        added, removed = cells - prev_cells, prev_cells - cells
+        if len(added) + len(removed) > len(cells):
+            total = self._sum_cells(cells)
+        else:
+            # removed ⊆ células da soma anterior: a subtração uint64 não estoura
+            total = prev_sum + self._sum_cells(added) - self._sum_cells(removed)
+        self._state = (cells, total)
+        return total.copy()
+
+    def _sum_cells(self, cells) -> np.ndarray:
+        if not cells:
+            return np.zeros(self.parts.shape[2:], dtype=np.uint64)
+        si, ti = zip(*cells)
+        return self.parts[list(si), list(ti)].sum(axis=0, dtype=np.uint64)
+
+    def frame(self, situacao: Optional[Sequence] = None, tipos: Optional[Sequence] = None,
+              age_order: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return pyramid_frame(self.pyramid(situacao, tipos), age_order)
+
+
+# Alias em PT-BR
+def construir_cubo_piramide(tensor: PyramidTensor, geo: Optional[pd.DataFrame] = None) -> PyramidCube:
+    return PyramidCube.from_tensor(tensor, geo)
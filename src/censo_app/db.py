@@ -0,0 +1,286 @@
+"""Conexão DuckDB compartilhada pelo processo, com cursores por thread.
+
+Uma única instância DuckDB (em memória) atende todas as sessões do Streamlit. Cada
+thread recebe seu próprio cursor (conexão filha da mesma instância) e o número de
+consultas simultâneas é limitado por um semáforo: numa rajada de usuários as
+consultas esperam na fila em vez de cada sessão abrir um motor próprio e disputar RAM.
+O cursor de uma thread é fechado quando ela termina (as threads de execução do
+Streamlit são descartáveis) ou quando reset_pool fecha a instância.
+
+Configuração em config/settings.yaml, seção `duckdb`:
+- threads, memory_limit, temp_directory (spill em disco)
+- max_concurrent_queries, acquire_timeout_s
+"""
+from __future__ import annotations
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path as _P
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+try:
+    import duckdb  # type: ignore
+except Exception:
+    duckdb = None  # type: ignore
+
+_DEFAULTS: Dict[str, Any] = {
+    "threads": None,
+    "memory_limit": None,
+    "temp_directory": None,
+    "max_concurrent_queries": 4,
+    "acquire_timeout_s": 120,
+}
+
+# Raiz do projeto (src/censo_app/db.py -> censo_app -> src -> raiz)
+ROOT_DIR = _P(__file__).resolve().parents[2]
+
+_lock = threading.Lock()
+_local = threading.local()
+_pool: Optional["_Pool"] = None
+_settings: Dict[str, Any] = {}
+_generation = 0
+_stats: Dict[str, Any] = {}
+
+
+class _Pool:
+    """Instância, semáforo e cursores de thread de uma geração (reset_pool abre outra)."""
+
+    def __init__(self, con: Any, slots: int, generation: int, stats: Dict[str, Any]):
+        self.con = con
+        self.slots = slots
+        self.sem = threading.BoundedSemaphore(slots)
+        self.generation = generation
+        self.stats = stats
+        self.closed = False
+        self.cursors: List[weakref.finalize] = []
+
+
+def _close_quietly(obj: Any) -> None:
+    # Chamado também por finalizadores (coleta de lixo): sem lock e sem exceções
+    try:
+        obj.close()
+    except Exception:
+        pass
+
+
+class _ThreadCursor:
+    """Cursor da thread; o finalizador o fecha quando o threading.local solta a entrada."""
+
+    __slots__ = ("pool", "cursor", "close", "__weakref__")
+
+    def __init__(self, pool: _Pool, cur: Any):
+        self.pool = pool
+        self.cursor = cur
+        self.close = weakref.finalize(self, _close_quietly, cur)
+
+
+class _Slot:
+    """Vaga do semáforo em posse de uma thread; depth conta os cursor() abertos sobre ela."""
+
+    __slots__ = ("pool", "depth")
+
+    def __init__(self, pool: _Pool):
+        self.pool = pool
+        self.depth = 1
+
+
+def _load_settings() -> Dict[str, Any]:
+    try:
+        from config.config_loader import cfg
+        user = cfg("duckdb", {}) or {}
+    except Exception:
+        user = {}
+    out = dict(_DEFAULTS)
+    out.update({k: v for k, v in user.items() if k in _DEFAULTS and v is not None})
+    return out
+
+
+def _engine_config(settings: Mapping[str, Any]) -> Dict[str, Any]:
+    conf: Dict[str, Any] = {}
+    if settings.get("threads"):
+        conf["threads"] = int(settings["threads"])
+    if settings.get("memory_limit"):
+        conf["memory_limit"] = str(settings["memory_limit"])
+    tmp = settings.get("temp_directory")
+    if tmp:
+        p = _P(tmp) if _P(tmp).is_absolute() else ROOT_DIR / tmp
+        try:
+            p.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass
+        conf["temp_directory"] = p.as_posix()
+    return conf
+
+
+def _get_pool() -> _Pool:
+    """Geração atual (instância criada na primeira consulta)."""
+    global _pool, _settings, _generation, _stats
+    pool = _pool
+    if pool is not None:
+        return pool
+    with _lock:
+        if _pool is not None:
+            return _pool
+        if duckdb is None:
+            raise ModuleNotFoundError("Instale 'duckdb' (pip install duckdb).")
+        _settings = _load_settings()
+        conf = _engine_config(_settings)
+        error = None
+        try:
+            con = duckdb.connect(config=conf)
+        except Exception as e:
+            # Configuração inválida não deve derrubar o app: usa os padrões do DuckDB
+            error = str(e)
+            con = duckdb.connect()
+        _stats = {
+            "cursors_created": 0, "active": 0, "waiting": 0, "peak_active": 0,
+            "queries": 0, "timeouts": 0, "wait_s_total": 0.0,
+            "engine_config": conf, "config_error": error,
+        }
+        _generation += 1
+        _pool = _Pool(con, max(1, int(_settings["max_concurrent_queries"])), _generation, _stats)
+        return _pool
+
+
+def _thread_cursor(pool: _Pool):
+    entry: Optional[_ThreadCursor] = getattr(_local, "entry", None)
+    if entry is not None and entry.pool is pool:
+        return entry.cursor
+    if entry is not None:
+        entry.close()  # cursor de uma geração anterior
+    entry = _ThreadCursor(pool, pool.con.cursor())
+    _local.entry = entry
+    with _lock:
+        pool.stats["cursors_created"] += 1
+        pool.cursors = [f for f in pool.cursors if f.alive] + [entry.close]
+    return entry.cursor
+
+
+def _acquire(timeout: Optional[float]) -> _Pool:
+    """Vaga no semáforo da geração atual; refaz a espera se reset_pool a fechou nesse meio tempo."""
+    while True:
+        pool = _get_pool()
+        wait = float(timeout if timeout is not None else _settings["acquire_timeout_s"])
+        st = pool.stats
+        with _lock:
+            st["waiting"] += 1
+        t0 = time.perf_counter()
+        ok = pool.sem.acquire(timeout=wait)
+        with _lock:
+            st["waiting"] -= 1
+            st["wait_s_total"] += time.perf_counter() - t0
+            if not ok:
+                st["timeouts"] += 1
+            elif not pool.closed:
+                st["active"] += 1
+                st["queries"] += 1
+                st["peak_active"] = max(st["peak_active"], st["active"])
+        if not ok:
+            raise TimeoutError(f"DuckDB ocupado: nenhuma vaga em {wait:.0f}s (max_concurrent_queries="
+                               f"{pool.slots}). Tente novamente.")
+        if not pool.closed:
+            return pool
+        pool.sem.release()
+
+
+@contextmanager
+def cursor(register: Optional[Mapping[str, Any]] = None, timeout: Optional[float] = None,
+           dedicated: bool = False) -> Iterator[Any]:
+    """Cursor DuckDB da thread atual, respeitando o limite de consultas simultâneas.
+
+    - register: DataFrames a registrar como views (removidos ao sair do bloco)
+    - timeout: espera máxima na fila (padrão: duckdb.acquire_timeout_s)
+    - dedicated: cursor próprio, fechado ao sair (para resultados consumidos aos poucos,
+      que não podem ser interrompidos por outra consulta da mesma thread)
+
+    A vaga fica ocupada enquanto o bloco estiver aberto. Dentro de um gerador isso vale
+    por toda a vida dele: a vaga só volta quando o gerador é esgotado ou fechado
+    (close() ou coleta lançam GeneratorExit no yield, que passa pelo finally abaixo).
+    Um cursor() aberto na mesma thread enquanto ela já tem uma vaga (por exemplo, uma
+    consulta durante o consumo de iter_sp_age_sex_batches) reusa essa vaga em vez de
+    esperar na fila por outra.
+    """
+    slot: Optional[_Slot] = getattr(_local, "slot", None)
+    pool = _get_pool()
+    with _lock:
+        nested = slot is not None and slot.pool is pool and slot.depth > 0 and not pool.closed
+        if nested:
+            slot.depth += 1
+    if not nested:
+        pool = _acquire(timeout)
+        slot = _Slot(pool)
+        _local.slot = slot
+    names = list(register or {})
+    cur = None
+    try:
+        cur = pool.con.cursor() if dedicated else _thread_cursor(pool)
+        for name in names:
+            cur.register(name, register[name])
+        yield cur
+    finally:
+        if cur is not None:
+            for name in names:
+                try:
+                    cur.unregister(name)
+                except Exception:
+                    pass
+            if dedicated:
+                _close_quietly(cur)
+        # o finally pode rodar em outra thread (coleta de um gerador): conta pelo próprio slot
+        with _lock:
+            slot.depth -= 1
+            last = slot.depth == 0
+            if last:
+                pool.stats["active"] -= 1
+        if last:
+            pool.sem.release()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Estatísticas do pool (cursores, consultas ativas/em espera, timeouts, configuração)."""
+    with _lock:
+        out = dict(_stats)
+        out.update({"initialized": _pool is not None, "settings": dict(_settings)})
+    return out
+
+
+def reset_pool(timeout: Optional[float] = None) -> None:
+    """Fecha a instância compartilhada; a próxima consulta relê settings.yaml.
+
+    Novas consultas já vão para uma instância nova. A antiga só é fechada depois que
+    as consultas em andamento devolvem todas as vagas do semáforo (espera até timeout,
+    padrão acquire_timeout_s); os cursores de thread dela são fechados junto. Se não
+    drenar a tempo: TimeoutError, e a instância antiga fica aberta até ser coletada.
+    """
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    wait = float(timeout if timeout is not None else _settings.get("acquire_timeout_s", _DEFAULTS["acquire_timeout_s"]))
+    deadline = time.monotonic() + wait
+    taken = 0
+    try:
+        while taken < pool.slots:
+            if not pool.sem.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"reset_pool: {pool.slots - taken} consulta(s) ainda em andamento "
+                                   f"após {wait:.0f}s; a instância anterior não foi fechada.")
+            taken += 1
+        # Com todas as vagas em mãos ninguém usa a instância; quem pegar vaga depois a vê fechada
+        pool.closed = True
+        for fin in pool.cursors:
+            fin()
+        _close_quietly(pool.con)
+    finally:
+        for _ in range(taken):
+            pool.sem.release()
+
+
+# Aliases em PT-BR
+def estatisticas_pool() -> Dict[str, Any]:
+    return pool_stats()
+
+
+def reiniciar_pool() -> None:
+    reset_pool()
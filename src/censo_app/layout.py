@@ -0,0 +1,65 @@
+"""Layout otimizado do Parquet de origem (gerado por docs/optimize_parquet.py).
+
+Diretório particionado no estilo hive por CD_UF (<dir>/CD_UF=35/data_0.parquet), com as
+linhas ordenadas por CD_MUN/CD_SETOR, row groups de tamanho ajustado, zstd + dicionário
+e estatísticas min/max nas chaves geográficas. O arquivo <dir>/_layout.json marca o
+layout (gravado por último) e serve de impressão digital do diretório.
+
+Os carregadores passam por parquet_source(): com o layout detectado, a leitura aponta
+só para a partição da UF pedida e os filtros por município/setor são podados pelos
+min/max dos row groups; sem ele, lê o arquivo único como antes.
+"""
+from __future__ import annotations
+import json
+import os
+from pathlib import Path as _P
+from typing import Any, Dict, Optional, Tuple
+
+LAYOUT_MARKER = "_layout.json"
+LAYOUT_VERSION = 1
+PARTITION_COLUMN = "CD_UF"
+
+
+def detect_layout(path_parquet: str) -> Optional[Dict[str, Any]]:
+    """Metadados do layout otimizado, ou None (arquivo único / diretório sem marcador)."""
+    marker = _P(path_parquet) / LAYOUT_MARKER
+    if not marker.is_file():
+        return None
+    try:
+        meta = json.loads(marker.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != LAYOUT_VERSION or meta.get("partition") != PARTITION_COLUMN:
+        return None
+    return meta
+
+
+def source_stat(path_parquet: str) -> Tuple[int, int]:
+    """(mtime_ns, tamanho) do arquivo, ou do marcador quando é o layout otimizado."""
+    p = _P(path_parquet)
+    st = os.stat(p / LAYOUT_MARKER) if detect_layout(path_parquet) else os.stat(p)
+    return st.st_mtime_ns, st.st_size
+
+
+def parquet_source(path_parquet: str, uf_code: Optional[str] = None) -> Tuple[str, bool]:
+    """(expressão read_parquet(...), UF já restrita pela partição)."""
+    p = _P(path_parquet)
+    meta = detect_layout(path_parquet)
+    if meta is None:
+        return f"read_parquet('{p.as_posix()}')", False
+    hive = f"hive_partitioning=true, hive_types={{'{PARTITION_COLUMN}': '{meta.get('partition_type', 'VARCHAR')}'}}"
+    part = p / f"{PARTITION_COLUMN}={uf_code}" if uf_code else None
+    if part is not None and part.is_dir():
+        return f"read_parquet('{part.as_posix()}/*.parquet', {hive})", True
+    return f"read_parquet('{p.as_posix()}/*/*.parquet', {hive})", False
+
+
+def parquet_glob(path_parquet: str) -> str:
+    """Caminho/glob dos arquivos de dados (para parquet_metadata e afins)."""
+    p = _P(path_parquet)
+    return f"{p.as_posix()}/*/*.parquet" if detect_layout(path_parquet) else p.as_posix()
+
+
+# Alias em PT-BR
+def detectar_layout(caminho_parquet: str) -> Optional[Dict[str, Any]]:
+    return detect_layout(caminho_parquet)
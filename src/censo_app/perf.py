@@ -0,0 +1,136 @@
+"""Medição leve de tempo e memória (RSS) por etapa do pipeline.
+
+- RSS atual: psutil
+- Pico de RSS do processo: resource.getrusage (Unix) ou psutil peak_wset (Windows)
+- Por etapa: variação de RSS (fim - início) e pico dentro da etapa, amostrado por uma
+  thread auxiliar enquanto o bloco roda (psutil). O pico do processo (ru_maxrss) é uma
+  marca de toda a vida do processo e não diz qual etapa o atingiu; sem psutil, o pico da
+  etapa só é conhecido quando ela eleva essa marca.
+Sem psutil nem resource, os campos de memória ficam None. As medidas são do processo:
+etapas simultâneas em outras threads entram na conta.
+"""
+from __future__ import annotations
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import psutil  # type: ignore
+except Exception:
+    psutil = None  # type: ignore
+
+try:
+    import resource  # type: ignore  # indisponível no Windows
+except Exception:
+    resource = None  # type: ignore
+
+# Intervalo de amostragem do pico dentro da etapa (segundos)
+SAMPLE_INTERVAL = 0.005
+
+
+def _maxrss_bytes(value: float, platform: str = sys.platform) -> float:
+    """ru_maxrss em bytes: o macOS informa bytes; Linux e BSDs, KB."""
+    return float(value) if platform == "darwin" else float(value) * 1024
+
+
+def rss_mb() -> Optional[float]:
+    """RSS atual do processo em MB (None sem psutil)."""
+    if psutil is None:
+        return None
+    try:
+        return psutil.Process().memory_info().rss / 2**20
+    except Exception:
+        return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Pico de RSS do processo em MB desde o início (high-water mark)."""
+    if resource is not None:
+        try:
+            return _maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) / 2**20
+        except Exception:
+            pass
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().peak_wset / 2**20
+        except Exception:
+            pass
+    return None
+
+
+class _PeakSampler:
+    """Maior RSS observado enquanto ativo (thread daemon, amostras a cada interval s)."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, name="perf-rss", daemon=True)
+            self._thread.start()
+
+    def _sample(self) -> None:
+        cur = rss_mb()
+        if cur is not None and (self.peak is None or cur > self.peak):
+            self.peak = cur
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def stop(self) -> Optional[float]:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        return self.peak
+
+
+def _r(v: Optional[float]) -> Optional[float]:
+    return None if v is None else round(v, 1)
+
+
+@contextmanager
+def stage(stats: List[Dict[str, Any]], name: str, interval: float = SAMPLE_INTERVAL) -> Iterator[None]:
+    """Registra em stats, ao final do bloco:
+
+    {etapa, segundos, rss_mb (fim), delta_rss_mb (fim - início), pico_etapa_mb (dentro
+    do bloco), pico_rss_mb (do processo)}. interval=0 desliga a amostragem: o pico da
+    etapa passa a vir só de ru_maxrss, quando a etapa eleva o pico do processo.
+    """
+    rss0, peak0 = rss_mb(), peak_rss_mb()
+    sampler = _PeakSampler(interval) if interval > 0 else None
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        secs = time.perf_counter() - t0
+        sampled = sampler.stop() if sampler is not None else None
+        rss1, peak1 = rss_mb(), peak_rss_mb()
+        if sampled is not None:
+            in_stage = max(v for v in (sampled, rss0, rss1) if v is not None)
+        elif peak0 is not None and peak1 is not None and peak1 > peak0:
+            in_stage = peak1
+        else:
+            in_stage = None
+        stats.append({
+            "etapa": name,
+            "segundos": round(secs, 4),
+            "rss_mb": _r(rss1),
+            "delta_rss_mb": _r(None if rss0 is None or rss1 is None else rss1 - rss0),
+            "pico_etapa_mb": _r(in_stage),
+            "pico_rss_mb": _r(peak1),
+        })
+
+
+def format_stats(stats: List[Dict[str, Any]]) -> str:
+    """Tabela de texto simples das etapas (para verbose/logs)."""
+    cols = (("rss_mb", "rss_mb"), ("delta_rss_mb", "delta_mb"), ("pico_etapa_mb", "pico_et"), ("pico_rss_mb", "pico_mb"))
+    lines = [f"{'etapa':<22}{'s':>9}" + "".join(f"{h:>10}" for _, h in cols)]
+    for s in stats:
+        vals = ["-" if s.get(k) is None else f"{s[k]:.1f}" for k, _ in cols]
+        lines.append(f"{s['etapa']:<22}{s['segundos']:>9.3f}" + "".join(f"{v:>10}" for v in vals))
+    return "\n".join(lines)
@@ -0,0 +1,142 @@
+"""Cadeia da Demografia como um DAG pequeno de etapas puras memoizadas por conteúdo.
+
+    piramide(escopo, filtros) → piramide_padrao(faixas) → tabela(faixas) ─────────┐
+                                                                                 ├→ tabela_comparada
+    comparador(comp_escopo, filtros) → comparador_padrao(faixas) → tabela_comparador ┘
+
+A chave de cada execução é (etapa, impressão digital da base, parâmetros da etapa e de
+todas as anteriores): tuplas pequenas montadas pela página, nunca o hash de um DataFrame.
+Trocar o comparador refaz só o seu ramo e a tabela comparada; a pirâmide principal, a
+padronização e a tabela são reaproveitadas. As etapas de entrada (piramide, comparador)
+não têm função própria: o valor vem de uma chamada sem argumentos passada em run() e só
+é avaliado quando a chave não está na memória. Os resultados são compartilhados entre
+chamadas (e sessões): as etapas não alteram as entradas e quem recebe não deve alterá-los.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .demog_utils import pad_pyramid_categories
+from .perf import stage
+from .tables import build_abnt_demographic_table, compare_abnt_tables
+
+# Registros de tempo (perf.stage) mantidos por grafo
+_MAX_STATS = 200
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: Optional[Callable[..., Any]] = None  # None: etapa de entrada (valor vem de run(sources=...))
+    deps: Tuple[str, ...] = ()  # valores passados em ordem, como argumentos posicionais
+    params: Tuple[str, ...] = ()  # parâmetros de run() lidos pela etapa (por nome)
+
+
+class StageGraph:
+    """Etapas por nome + memória LRU {chave de conteúdo: resultado}, segura entre threads."""
+
+    def __init__(self, stages: Iterable[Stage], fingerprint: str = "", max_entries: int = 256):
+        self.stages: Dict[str, Stage] = {}
+        for s in stages:
+            if s.name in self.stages:
+                raise ValueError(f"Etapa repetida: {s.name}")
+            self.stages[s.name] = s
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stats: List[Dict[str, Any]] = []
+        self._memo: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._scope: Dict[str, Tuple[str, ...]] = {}
+        for name in self.stages:
+            self._scope[name] = self._closure(name, ())
+
+    def _closure(self, name: str, path: Tuple[str, ...]) -> Tuple[str, ...]:
+        # Parâmetros da etapa e de todas as dependências (ordem estável, sem repetição)
+        if name in path:
+            raise ValueError(f"Ciclo entre etapas: {' → '.join(path + (name,))}")
+        if name not in self.stages:
+            raise ValueError(f"Etapa desconhecida: {name}")
+        if name in self._scope:
+            return self._scope[name]
+        s = self.stages[name]
+        out = list(s.params)
+        for d in s.deps:
+            out.extend(p for p in self._closure(d, path + (name,)) if p not in out)
+        return tuple(out)
+
+    def key(self, name: str, params: Mapping[str, Hashable]) -> Tuple:
+        """(etapa, impressão digital, (parâmetro, valor)...) — KeyError se faltar parâmetro."""
+        try:
+            return (name, self.fingerprint) + tuple((p, params[p]) for p in self._scope[name])
+        except KeyError as e:
+            raise KeyError(f"Parâmetro ausente para a etapa '{name}': {e.args[0]}") from None
+
+    def run(self, name: str, sources: Optional[Mapping[str, Callable[[], Any]]] = None,
+            **params: Hashable) -> Any:
+        """Resultado da etapa; dependências e entradas só são calculadas fora da memória."""
+        k = self.key(name, params)
+        with self._lock:
+            if k in self._memo:
+                self._memo.move_to_end(k)
+                self.hits += 1
+                return self._memo[k]
+        s = self.stages[name]
+        if s.fn is None:
+            if not sources or name not in sources:
+                raise KeyError(f"Etapa de entrada '{name}' sem fonte em sources.")
+            compute: Callable[[], Any] = sources[name]
+        else:
+            args = [self.run(d, sources, **params) for d in s.deps]
+            kwargs = {p: params[p] for p in s.params}
+            compute = lambda: s.fn(*args, **kwargs)  # noqa: E731
+        # Cálculo fora do lock: sessões diferentes não esperam umas pelas outras
+        rec: List[Dict[str, Any]] = []
+        with stage(rec, name):
+            value = compute()
+        with self._lock:
+            self.stats.extend(rec)
+            del self.stats[:-_MAX_STATS]
+            self.misses += 1
+            self._memo[k] = value
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memo.clear()
+
+
+def _pad(df: pd.DataFrame, faixas: Sequence[str]) -> pd.DataFrame:
+    return pad_pyramid_categories(df, list(faixas))
+
+
+def _table(df: pd.DataFrame, faixas: Sequence[str]) -> pd.DataFrame:
+    return build_abnt_demographic_table(df, list(faixas))
+
+
+DEMOGRAPHY_STAGES: Tuple[Stage, ...] = (
+    Stage("piramide", params=("escopo", "filtros")),
+    Stage("piramide_padrao", _pad, deps=("piramide",), params=("faixas",)),
+    Stage("tabela", _table, deps=("piramide_padrao",), params=("faixas",)),
+    Stage("comparador", params=("comp_escopo", "filtros")),
+    Stage("comparador_padrao", _pad, deps=("comparador",), params=("faixas",)),
+    Stage("tabela_comparador", _table, deps=("comparador_padrao",), params=("faixas",)),
+    Stage("tabela_comparada", compare_abnt_tables, deps=("tabela", "tabela_comparador")),
+)
+
+
+def demography_graph(fingerprint: str = "", max_entries: int = 256) -> StageGraph:
+    """Grafo das etapas da Demografia (pirâmide → padronização → tabela ABNT → comparação)."""
+    return StageGraph(DEMOGRAPHY_STAGES, fingerprint, max_entries)
+
+
+# Alias em PT-BR
+def grafo_demografia(impressao: str = "") -> StageGraph:
+    return demography_graph(impressao)
@@ -0,0 +1,156 @@
+"""Regiões personalizadas (conjuntos de municípios e/ou setores) e pertinência esparsa.
+
+Uma região é definida por listas de CD_MUN e de CD_SETOR (consórcios, recortes de
+estudo...). As definições salvas ficam em JSON (settings.yaml paths.custom_regions,
+padrão data/regioes_personalizadas.json). Sobre as posições dos setores do tensor, as
+regiões viram uma matriz CSR (regiões × setores); as pirâmides de todas as regiões saem
+de um único produto CSR × (setores × 22), feito com um reduceat do NumPy sobre os
+indptr/indices. Os filtros (máscara por setor) recortam as entradas da CSR, e não a
+matriz de contagens: só as linhas dos setores pertencentes são lidas.
+"""
+from __future__ import annotations
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path as _P
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .clustered import OffsetIndex
+
+# Máximo de pares (região, setor) reunidos por lote no caminho NumPy
+_GATHER_BATCH = 1 << 20
+
+
+@dataclass(frozen=True)
+class RegionDef:
+    name: str
+    municipalities: Tuple[str, ...] = ()
+    sectors: Tuple[str, ...] = ()
+    description: str = ""
+
+    def to_dict(self) -> Dict:
+        return {"nome": self.name, "municipios": list(self.municipalities),
+                "setores": list(self.sectors), "descricao": self.description}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "RegionDef":
+        name = str(d.get("nome") or d.get("name") or "").strip()
+        if not name:
+            raise ValueError("Região personalizada sem nome.")
+        muns = tuple(str(x).strip() for x in (d.get("municipios") or d.get("municipalities") or []) if str(x).strip())
+        sets = tuple(str(x).strip() for x in (d.get("setores") or d.get("sectors") or []) if str(x).strip())
+        if not muns and not sets:
+            raise ValueError(f"Região personalizada '{name}' sem municípios nem setores.")
+        return cls(name, muns, sets, str(d.get("descricao") or d.get("description") or ""))
+
+
+def default_regions_path() -> _P:
+    """settings.yaml paths.custom_regions ou data/regioes_personalizadas.json na raiz."""
+    from .transform import ROOT_DIR
+    try:
+        from config.config_loader import cfg
+        p = cfg("paths.custom_regions", None)
+    except Exception:
+        p = None
+    path = _P(p) if p else (ROOT_DIR / "data" / "regioes_personalizadas.json")
+    return path if path.is_absolute() else (ROOT_DIR / path)
+
+
+def load_region_defs(path: Optional[str] = None) -> List[RegionDef]:
+    """Definições salvas (lista vazia se o arquivo não existe)."""
+    p = _P(path) if path else default_regions_path()
+    if not p.exists():
+        return []
+    data = json.loads(p.read_text(encoding="utf-8"))
+    return [RegionDef.from_dict(d) for d in (data.get("regioes") if isinstance(data, dict) else data) or []]
+
+
+def save_region_defs(defs: Sequence[RegionDef], path: Optional[str] = None) -> _P:
+    """Grava as definições (escrita atômica); nomes repetidos: vale a última."""
+    p = _P(path) if path else default_regions_path()
+    by_name = {d.name: d for d in defs}
+    raw = json.dumps({"regioes": [d.to_dict() for d in by_name.values()]}, ensure_ascii=False, indent=2)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f"{p.name}.tmp{os.getpid()}")
+    tmp.write_text(raw, encoding="utf-8")
+    os.replace(tmp, p)
+    return p
+
+
+def _str_lookup(offsets: OffsetIndex, key: str) -> Dict[str, Tuple[int, int]]:
+    return {str(k): v for k, v in offsets.offsets.get(key, {}).items()}
+
+
+class RegionMatrix:
+    """Pertinência CSR: setores da região i = indices[indptr[i]:indptr[i+1]] (posições ordenadas)."""
+
+    def __init__(self, names: Sequence[str], indptr: np.ndarray, indices: np.ndarray, n_sectors: int):
+        self.names = list(names)
+        self.indptr = indptr
+        self.indices = indices
+        self.n_sectors = n_sectors
+
+    @classmethod
+    def from_defs(cls, defs: Iterable[RegionDef], geo: pd.DataFrame,
+                  offsets: Optional[OffsetIndex] = None) -> "RegionMatrix":
+        """geo: frame por setor na ordem do tensor; offsets (OffsetIndex de geo) evita isin por região."""
+        defs = list(defs)
+        offsets = offsets or OffsetIndex.from_frame(geo)
+        spans = {k: _str_lookup(offsets, k) for k in ("CD_MUN", "CD_SETOR")}
+        parts: List[np.ndarray] = []
+        for d in defs:
+            ranges = [spans["CD_MUN"].get(m) for m in d.municipalities] + [spans["CD_SETOR"].get(s) for s in d.sectors]
+            pos = [np.arange(a, b) for a, b in (r for r in ranges if r is not None)]
+            parts.append(np.unique(np.concatenate(pos)) if pos else np.zeros(0, dtype=np.int64))
+        indptr = np.zeros(len(defs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in parts])
+        indices = np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+        return cls([d.name for d in defs], indptr, indices, len(geo))
+
+    def _masked(self, mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """(indptr, indices) só com os setores em mask; sem mask, a própria CSR."""
+        if mask is None:
+            return self.indptr, self.indices
+        keep = mask[self.indices]
+        csum = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=csum[1:])
+        return csum[self.indptr], self.indices[keep]
+
+    def aggregate(self, counts: np.ndarray, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Somas (regiões, ...) de counts[setor, ...]; mask (bool por setor) aplica os filtros."""
+        shape = counts.shape[1:]
+        dense = counts.reshape(self.n_sectors, -1)
+        indptr, indices = self._masked(mask)
+        k = len(self.names)
+        out = np.zeros((k, dense.shape[1]), dtype=np.uint64)
+        lo = 0
+        while lo < k:
+            # lote de regiões com até _GATHER_BATCH pares (ao menos uma região)
+            hi = max(lo + 1, int(np.searchsorted(indptr, indptr[lo] + _GATHER_BATCH, side="right")) - 1)
+            hi = min(hi, k)
+            a, b = indptr[lo], indptr[hi]
+            if b > a:
+                rows = dense[indices[a:b]].astype(np.uint64)
+                starts = indptr[lo:hi] - a
+                nonempty = indptr[lo + 1:hi + 1] > indptr[lo:hi]
+                sums = np.add.reduceat(rows, starts[nonempty], axis=0)
+                out[np.arange(lo, hi)[nonempty]] = sums
+            lo = hi
+        return out.reshape((k,) + shape)
+
+
+# Aliases em PT-BR
+def carregar_regioes(caminho: Optional[str] = None) -> List[RegionDef]:
+    return load_region_defs(caminho)
+
+
+def salvar_regioes(regioes: Sequence[RegionDef], caminho: Optional[str] = None) -> _P:
+    return save_region_defs(regioes, caminho)
+
+
+def matriz_regioes(regioes: Iterable[RegionDef], geo: pd.DataFrame,
+                   offsets: Optional[OffsetIndex] = None) -> RegionMatrix:
+    return RegionMatrix.from_defs(regioes, geo, offsets)
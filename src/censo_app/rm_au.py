@@ -0,0 +1,246 @@
+"""Lookup RM/AU compilado a partir do Excel de composição (Composicao_RM_2024.xlsx).
+
+O workbook é lido (openpyxl) só na compilação, que grava:
+- <cache_dir>/rm_au_lookup_<chave>.csv: CD_MUN, RM_NOME, AU_NOME (uma linha por município)
+- o mesmo nome com .meta.json: versão, esquema, sha256 do CSV e mtime/tamanho do workbook
+
+Os carregadores leem só o CSV. O artefato é recompilado quando o workbook muda
+(mtime/tamanho), quando a versão/esquema não conferem ou quando o checksum falha.
+Compilação prévia: python docs/compile_rm_au_lookup.py
+Se a compilação falhar (diretório de cache somente leitura, workbook sem abas
+reconhecidas), o carregamento segue sem RM/AU e registra um aviso; a falha fica
+memorizada até o workbook mudar, de modo que o Excel não é relido a cada consulta.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path as _P
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+RM_AU_LOOKUP_VERSION = 1
+RM_AU_LOOKUP_SCHEMA: Tuple[str, ...] = ("CD_MUN", "RM_NOME", "AU_NOME")
+
+RmAuMaps = Tuple[Optional[Dict[str, str]], Optional[Dict[str, str]]]
+
+_log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# caminho do CSV -> (stamp do meta.json, (mtime_ns, tamanho) do workbook, mapas)
+_LOADED: Dict[str, Tuple[Tuple[int, int], Tuple, RmAuMaps]] = {}
+# caminho do CSV -> (mtime_ns, tamanho) do workbook cuja compilação falhou
+_FAILED: Dict[str, Optional[Tuple[int, int]]] = {}
+
+
+def _parse_excel(excel_path: str) -> RmAuMaps:
+    """Mapas CD_MUN -> RM_NOME / AU_NOME lidos do workbook (abas exatas, senão heurística)."""
+    from .transform import _norm_cd_mun, _normalize_simple, _normcol
+    try:
+        xls = pd.ExcelFile(excel_path, engine="openpyxl")
+    except Exception:
+        return None, None
+
+    def _exact_map(sheet_name: str) -> Optional[Dict[str, str]]:
+        if sheet_name not in xls.sheet_names:
+            return None
+        try:
+            tmp = pd.read_excel(xls, sheet_name=sheet_name)
+        except Exception:
+            return None
+        cols = {str(c).strip(): c for c in tmp.columns}
+        inv = {_normalize_simple(k).upper(): v for k, v in cols.items()}
+        get = lambda k: inv.get(_normalize_simple(k).upper())
+        cod = get("COD_MUN")
+        nom = get("NOME_CATMETROPOL")
+        uf = get("SIGLA_UF")
+        if not (cod and nom and uf):
+            return None
+        tmp = tmp[[cod, nom, uf]].copy()
+        tmp = tmp[tmp[uf].astype(str).str.upper().eq("SP")]
+        if tmp.empty:
+            return None
+        tmp["CD_MUN"] = _norm_cd_mun(tmp[cod])
+        tmp = tmp[["CD_MUN", nom]].dropna().drop_duplicates()
+        return dict(zip(tmp["CD_MUN"], tmp[nom]))
+
+    rm_map = _exact_map("Composição - Recortes Metropoli")
+    au_map = _exact_map("Composição - Aglomerações Urban")
+
+    # Fallback heurístico se preciso
+    if rm_map is None or au_map is None:
+        try:
+            norm = lambda s: _normalize_simple(s).lower()
+            rm_sheet = None
+            au_sheet = None
+            for name in xls.sheet_names:
+                n = norm(name)
+                if "metrop" in n and ("composicao" in n or "composi" in n):
+                    rm_sheet = name
+                if "aglomer" in n and ("urban" in n or "urbana" in n or "urbanas" in n):
+                    au_sheet = name
+            rm_sheet = rm_sheet or "Composição - Recortes Metropoli"
+            au_sheet = au_sheet or "Composição - Aglomerações Urban"
+            rm_df = pd.read_excel(xls, sheet_name=rm_sheet)
+            au_df = pd.read_excel(xls, sheet_name=au_sheet)
+
+            def build_map(d: pd.DataFrame, name_candidates: List[str]) -> Optional[Dict[str, str]]:
+                d = d.copy()
+                d.columns = [_normcol(c) for c in d.columns]
+                if "COD_MUN" not in d.columns:
+                    for c in list(d.columns):
+                        if c in {"CODIGO_DO_MUNICIPIO", "COD_MUNICIPIO", "CD_GEOCODM", "CD_MUN", "COD_MUN"}:
+                            d.rename(columns={c: "COD_MUN"}, inplace=True)
+                            break
+                nom_col = next((c for c in name_candidates if c in d.columns), None)
+                if "COD_MUN" not in d.columns or nom_col is None:
+                    return None
+                d["CD_MUN"] = _norm_cd_mun(d["COD_MUN"])
+                d = d[["CD_MUN", nom_col]].dropna().drop_duplicates()
+                return dict(zip(d["CD_MUN"], d[nom_col]))
+            if rm_map is None:
+                rm_map = build_map(rm_df, ["NOME_CATMETROPOL", "RM_NOME", "RM", "NOME_RM"])
+            if au_map is None:
+                au_map = build_map(au_df, ["NOME_CATAU", "AU_NOME", "AU", "NOME_AU"])
+        except Exception:
+            pass
+
+    return rm_map, au_map
+
+
+def default_lookup_path(excel_path: str) -> _P:
+    """Artefato no diretório de cache (paths.cache_dir), um por workbook."""
+    from .snapshot import default_cache_dir
+    key = hashlib.sha256(_P(excel_path).resolve().as_posix().encode("utf-8")).hexdigest()[:8]
+    return default_cache_dir() / f"rm_au_lookup_{key}.csv"
+
+
+def _meta_path(lookup_path: _P) -> _P:
+    return lookup_path.with_suffix(".meta.json")
+
+
+def _workbook_stamp(excel_path: str) -> Dict[str, Any]:
+    mtime_ns, size = _source_key(excel_path)
+    return {"path": _P(excel_path).resolve().as_posix(), "mtime_ns": mtime_ns, "size": size}
+
+
+def compile_rm_au_lookup(excel_path: str, lookup_path: Optional[str] = None) -> _P:
+    """Lê o workbook e grava o CSV compilado + meta.json (escrita atômica)."""
+    if not _P(excel_path).exists():
+        raise FileNotFoundError(f"Excel de RM/AU não encontrado: {excel_path}")
+    out = _P(lookup_path) if lookup_path else default_lookup_path(excel_path)
+    rm_map, au_map = _parse_excel(excel_path)
+    if rm_map is None and au_map is None:
+        raise ValueError(f"Nenhuma aba de composição RM/AU reconhecida em: {excel_path}")
+    rm_map, au_map = rm_map or {}, au_map or {}
+    muns = sorted(set(rm_map) | set(au_map))
+    df = pd.DataFrame({
+        "CD_MUN": muns,
+        "RM_NOME": [rm_map.get(m) for m in muns],
+        "AU_NOME": [au_map.get(m) for m in muns],
+    })
+    raw = df.to_csv(index=False, lineterminator="\n").encode("utf-8")
+    meta = {
+        "version": RM_AU_LOOKUP_VERSION,
+        "schema": list(RM_AU_LOOKUP_SCHEMA),
+        "rows": len(df),
+        "sha256": hashlib.sha256(raw).hexdigest(),
+        "source": _workbook_stamp(excel_path),
+    }
+    out.parent.mkdir(parents=True, exist_ok=True)
+    for target, data in ((out, raw), (_meta_path(out), json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))):
+        tmp = target.with_name(f"{target.name}.tmp{os.getpid()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, target)
+    with _lock:
+        _LOADED.pop(out.resolve().as_posix(), None)
+    return out
+
+
+def _source_key(excel_path: Optional[str]) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(excel_path) if excel_path else None
+    except OSError:
+        st = None
+    return None if st is None else (st.st_mtime_ns, st.st_size)
+
+
+def _read_valid(lookup: _P, excel_path: Optional[str]) -> Optional[RmAuMaps]:
+    """Mapas do artefato, ou None se ausente, desatualizado ou corrompido."""
+    meta_p = _meta_path(lookup)
+    try:
+        st = os.stat(meta_p)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    current = _source_key(excel_path)  # None: workbook ausente, vale o artefato existente
+    key = lookup.resolve().as_posix()
+    with _lock:
+        hit = _LOADED.get(key)
+    if hit is not None and hit[0] == stamp and current in (None, hit[1]):
+        return hit[2]
+    try:
+        meta = json.loads(meta_p.read_text(encoding="utf-8"))
+        raw = lookup.read_bytes()
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != RM_AU_LOOKUP_VERSION or tuple(meta.get("schema") or ()) != RM_AU_LOOKUP_SCHEMA:
+        return None
+    if hashlib.sha256(raw).hexdigest() != meta.get("sha256"):
+        return None
+    src = meta.get("source") or {}
+    source = (src.get("mtime_ns"), src.get("size"))
+    if current is not None and source != current:
+        return None
+    df = pd.read_csv(lookup, dtype=str, keep_default_na=False, na_values=[""])
+    if tuple(df.columns) != RM_AU_LOOKUP_SCHEMA:
+        return None
+    rm = df.dropna(subset=["RM_NOME"])
+    au = df.dropna(subset=["AU_NOME"])
+    maps: RmAuMaps = (dict(zip(rm["CD_MUN"], rm["RM_NOME"])) or None,
+                      dict(zip(au["CD_MUN"], au["AU_NOME"])) or None)
+    with _lock:
+        _LOADED[key] = (stamp, source, maps)
+    return maps
+
+
+def load_rm_au_lookup(excel_path: str, lookup_path: Optional[str] = None, compile_missing: bool = True) -> RmAuMaps:
+    """(rm_map, au_map) CD_MUN -> nome, lidos do artefato compilado.
+
+    Sem artefato válido, compila a partir do workbook (uma vez; os demais processos
+    passam a ler o arquivo) quando compile_missing=True. Se a compilação falhar,
+    devolve (None, None) com um aviso no log e não tenta de novo até o workbook mudar.
+    """
+    lookup = _P(lookup_path) if lookup_path else default_lookup_path(excel_path)
+    maps = _read_valid(lookup, excel_path)
+    if maps is not None:
+        return maps
+    if not compile_missing or not _P(excel_path).exists():
+        return None, None
+    key, source = lookup.resolve().as_posix(), _source_key(excel_path)
+    with _lock:
+        if key in _FAILED and _FAILED[key] == source:
+            return None, None
+    try:
+        compile_rm_au_lookup(excel_path, lookup.as_posix())
+    except (OSError, ValueError) as e:
+        with _lock:
+            _FAILED[key] = source
+        _log.warning("Lookup RM/AU não compilado (%s); seguindo sem RM/AU. "
+                     "Compile com: python docs/compile_rm_au_lookup.py", e)
+        return None, None
+    with _lock:
+        _FAILED.pop(key, None)
+    return _read_valid(lookup, excel_path) or (None, None)
+
+
+# Aliases em PT-BR
+def compilar_lookup_rm_au(caminho_excel: str, caminho_lookup: Optional[str] = None) -> _P:
+    return compile_rm_au_lookup(caminho_excel, lookup_path=caminho_lookup)
+
+
+def carregar_lookup_rm_au(caminho_excel: str, caminho_lookup: Optional[str] = None) -> RmAuMaps:
+    return load_rm_au_lookup(caminho_excel, lookup_path=caminho_lookup)
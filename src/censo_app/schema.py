@@ -0,0 +1,116 @@
+"""Registro de esquema dos Parquets do Censo, resolvido só pelo rodapé (footer).
+
+Nomes, tipos e número de linhas vêm dos metadados do arquivo (DESCRIBE do DuckDB /
+parquet_file_metadata), sem varrer dados. A partir deles são resolvidos uma única vez
+por impressão digital do arquivo:
+- nome canônico de cada coluna (columns_map.csv, ALIASES, V000x)
+- as 22 colunas Sexo x faixa etária
+- coluna de UF
+
+A entrada é reaproveitada enquanto o Parquet (mtime/tamanho) e o columns_map.csv
+não mudarem.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from pathlib import Path as _P
+from typing import Dict, List, Optional, Tuple
+
+from . import transform as T
+from .db import cursor as _db_cursor
+from .layout import parquet_glob, parquet_source, source_stat
+
+try:
+    import duckdb  # type: ignore
+except Exception:
+    duckdb = None  # type: ignore
+
+
+@dataclass(frozen=True)
+class ParquetSchema:
+    path: str
+    fingerprint: Tuple
+    columns: Tuple[str, ...]
+    types: Dict[str, str]
+    canon: Dict[str, str]
+    num_rows: Optional[int] = None
+    male_cols: Tuple[str, ...] = ()
+    female_cols: Tuple[str, ...] = ()
+    _physical: Dict[str, str] = field(default_factory=dict, repr=False)
+
+    def physical(self, name: str) -> Optional[str]:
+        """Nome físico a partir do canônico (ou do próprio físico)."""
+        if name in self.types:
+            return name
+        return self._physical.get(name)
+
+    @property
+    def age_sex_cols(self) -> List[str]:
+        return list(self.male_cols) + list(self.female_cols)
+
+    @property
+    def uf_col(self) -> Optional[str]:
+        return self._physical.get("CD_UF")
+
+
+# caminho resolvido -> ParquetSchema (validado pela impressão digital a cada consulta)
+_REGISTRY: Dict[str, ParquetSchema] = {}
+
+
+def schema_fingerprint(path_parquet: str, colmap_path: Optional[str] = None) -> Tuple:
+    """(mtime_ns, tamanho) do Parquet (ou do _layout.json do layout otimizado) + versão do columns_map.csv."""
+    return source_stat(path_parquet) + T._colmap_stamp(colmap_path)
+
+
+def _read_footer(path: str) -> Tuple[List[Tuple[str, str]], Optional[int]]:
+    with _db_cursor() as con:
+        desc = con.execute(f"DESCRIBE SELECT * FROM {parquet_source(path)[0]}").fetchall()
+        try:
+            n = con.execute(f"SELECT SUM(num_rows) FROM parquet_file_metadata('{parquet_glob(path)}')").fetchone()[0]
+            num_rows = int(n) if n is not None else None
+        except Exception:
+            num_rows = None
+    return [(r[0], r[1]) for r in desc], num_rows
+
+
+def get_parquet_schema(path_parquet: str, colmap_path: Optional[str] = None) -> ParquetSchema:
+    """Esquema resolvido do Parquet; lê apenas o footer e reaproveita entre chamadas."""
+    if duckdb is None:
+        raise ModuleNotFoundError("Instale 'duckdb' (pip install duckdb).")
+    p = _P(path_parquet)
+    if not p.exists():
+        raise FileNotFoundError(f"Parquet não encontrado: {p}")
+    key = p.resolve().as_posix()
+    fp = schema_fingerprint(key, colmap_path)
+    hit = _REGISTRY.get(key)
+    if hit is not None and hit.fingerprint == fp:
+        return hit
+    desc, num_rows = _read_footer(p.as_posix())
+    cols = [c for c, _ in desc]
+    canon = T._canonical_column_names(cols, colmap_path)
+    physical: Dict[str, str] = {}
+    for c in cols:
+        physical.setdefault(canon[c], c)
+    inv = {v: k for k, v in canon.items()}
+    m_cols, f_cols = T._pick_exact_age_cols(list(canon.values()))
+    schema = ParquetSchema(
+        path=key,
+        fingerprint=fp,
+        columns=tuple(cols),
+        types=dict(desc),
+        canon=canon,
+        num_rows=num_rows,
+        male_cols=tuple(inv.get(c, c) for c in m_cols),
+        female_cols=tuple(inv.get(c, c) for c in f_cols),
+        _physical=physical,
+    )
+    _REGISTRY[key] = schema
+    return schema
+
+
+def clear_schema_registry() -> None:
+    _REGISTRY.clear()
+
+
+# Alias em PT-BR
+def obter_esquema_parquet(path_parquet: str, caminho_colmap: Optional[str] = None) -> ParquetSchema:
+    return get_parquet_schema(path_parquet, colmap_path=caminho_colmap)
@@ -0,0 +1,97 @@
+"""Base da Demografia compartilhada pelo processo (somente leitura).
+
+O frame wide vira, uma única vez por impressão digital das fontes, o tensor, o frame
+por setor (rótulos territoriais já limpos) e os índices derivados (cubo, bitmaps,
+offsets, busca territorial). A página guarda o objeto com st.cache_resource, de modo
+que todas as sessões leem as mesmas estruturas; a sessão mantém só filtros e
+resultados pequenos. Os arrays NumPy são marcados como não graváveis e os frames
+dependem do copy-on-write do pandas: quem precisar alterar deve copiar antes.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bitmap import BitmapIndex
+from .clustered import OffsetIndex
+from .cube import PyramidCube
+from .tensor import PyramidTensor
+from .territory import TerritorySearch
+from .text_utils import clean_label
+from .transform import join_dimension, municipality_dimension
+
+# Rótulos territoriais limpos por município e reanexados aos setores
+LABEL_COLUMNS = ("NOME_RM_AU", "TIPO_RM_AU", "RM_NOME", "AU_NOME", "NM_MUN", "NM_RGI", "NM_RGINT")
+
+
+def _clean(val: object) -> object:
+    v = clean_label(val)
+    return pd.NA if v is None else v
+
+
+def _arrays(obj: Any, seen: set) -> Iterator[np.ndarray]:
+    # ndarrays alcançáveis pelos atributos/containers (frames pandas ficam de fora)
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from _arrays(v, seen)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            yield from _arrays(v, seen)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        for v in vars(obj).values():
+            yield from _arrays(v, seen)
+
+
+@dataclass(frozen=True)
+class SharedDataset:
+    fingerprint: str
+    tensor: PyramidTensor
+    sectors: pd.DataFrame  # tensor.sectors_frame() com rótulos limpos (uma linha por setor)
+    cube: PyramidCube
+    bitmaps: BitmapIndex
+    offsets: OffsetIndex
+    search: TerritorySearch
+    stats: Tuple[Dict[str, Any], ...] = ()  # df_wide.attrs["pipeline_stats"] da carga
+
+    @classmethod
+    def from_wide(cls, df_wide: pd.DataFrame, fingerprint: str = "") -> "SharedDataset":
+        """Monta tensor, frame por setor e índices; df_wide pode ser descartado em seguida."""
+        tensor = PyramidTensor.from_wide(df_wide)
+        # attrs seriam copiados (deepcopy) a cada operação sobre os recortes: ficam no objeto
+        tensor.geo.attrs = {}
+        sectors = tensor.sectors_frame()
+        if "CD_MUN" in sectors.columns:
+            dim = municipality_dimension(sectors)
+            for col in LABEL_COLUMNS:
+                if col in dim.columns:
+                    dim[col] = dim[col].apply(_clean)
+            sectors = join_dimension(sectors, dim)
+        out = cls(fingerprint, tensor, sectors, PyramidCube.from_tensor(tensor, sectors),
+                  BitmapIndex.from_frame(sectors), OffsetIndex.from_frame(sectors),
+                  TerritorySearch.from_frame(sectors), tuple(df_wide.attrs.get("pipeline_stats", ())))
+        out.freeze()
+        return out
+
+    def _owned_arrays(self) -> Iterator[np.ndarray]:
+        return _arrays([self.tensor, self.cube, self.bitmaps, self.offsets, self.search], set())
+
+    def freeze(self) -> None:
+        """Torna não graváveis os arrays de tensor, cubo e índices."""
+        for a in self._owned_arrays():
+            a.setflags(write=False)
+
+    def nbytes(self) -> int:
+        """Memória aproximada: frame por setor + arrays de tensor, cubo e índices."""
+        return int(self.sectors.memory_usage(deep=True).sum()) + sum(int(a.nbytes) for a in self._owned_arrays())
+
+
+# Alias em PT-BR
+def montar_base_compartilhada(df_largo: pd.DataFrame, impressao: str = "") -> SharedDataset:
+    return SharedDataset.from_wide(df_largo, impressao)
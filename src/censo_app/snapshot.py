@@ -0,0 +1,161 @@
+"""Snapshot em disco do frame enriquecido (Parquet compactado em data/cache).
+
+O pipeline completo (leitura DuckDB, aliases, normalização, decodificação,
+coerção de V000x e merge RM/AU) é executado apenas quando a impressão digital
+das fontes muda:
+- Parquet de origem (mtime + tamanho; no layout otimizado, o _layout.json)
+- docs/columns_map.csv (hash do conteúdo)
+- Excel de RM/AU (mtime)
+- parâmetros de carga (UF, famílias, colunas, filtros)
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+from pathlib import Path as _P
+from typing import Any, Dict, Optional, Sequence
+
+import pandas as pd
+
+from . import transform as T
+from .layout import LAYOUT_MARKER, detect_layout
+
+# Incrementar quando a forma do frame enriquecido mudar (invalida snapshots antigos)
+SNAPSHOT_VERSION = 2
+
+_DEFAULT_EXCEL = "insumos/Composicao_RM_2024.xlsx"
+
+
+def _stat_key(path: Optional[str]) -> Dict[str, Any]:
+    try:
+        # Layout otimizado (diretório): o _layout.json é regravado a cada otimização
+        st = os.stat(_P(path) / LAYOUT_MARKER if detect_layout(path) else path) if path else None
+    except OSError:
+        st = None
+    if st is None:
+        return {"path": str(path), "exists": False}
+    return {"path": _P(path).resolve().as_posix(), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _file_sha256(path: _P) -> Optional[str]:
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+def source_fingerprint(path_parquet: str, excel_path: Optional[str] = None,
+                       colmap_path: Optional[str] = None, **params: Any) -> str:
+    """Impressão digital (sha256 curto) das fontes e parâmetros de carga."""
+    colmap = _P(colmap_path) if colmap_path else T.COLMAP_DEFAULT_PATH
+    key = {
+        "version": SNAPSHOT_VERSION,
+        "parquet": _stat_key(path_parquet),
+        "columns_map_sha256": _file_sha256(colmap),
+        "excel": _stat_key(excel_path or _DEFAULT_EXCEL),
+        "params": params,
+    }
+    raw = json.dumps(key, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def default_cache_dir() -> _P:
+    """Diretório dos snapshots: settings.yaml paths.cache_dir ou data/cache na raiz."""
+    try:
+        from config.config_loader import cfg
+        d = cfg("paths.cache_dir", None)
+    except Exception:
+        d = None
+    p = _P(d) if d else (T.ROOT_DIR / "data" / "cache")
+    return p if p.is_absolute() else (T.ROOT_DIR / p)
+
+
+_OBJECT_COLS_KEY = b"censo_app.object_cols"
+
+
+def _write_atomic(df: pd.DataFrame, target: _P) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_suffix(f".tmp{os.getpid()}")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Colunas object (texto com pd.NA/None) voltam como object na leitura, e não como str
+    obj_cols = [str(c) for c in df.columns if df[c].dtype == object]
+    meta = dict(table.schema.metadata or {})
+    meta[_OBJECT_COLS_KEY] = json.dumps(obj_cols).encode("utf-8")
+    pq.write_table(table.replace_schema_metadata(meta), tmp, compression="zstd")
+    os.replace(tmp, target)
+
+
+def _read_snapshot(target: _P, arrow: bool = False) -> pd.DataFrame:
+    import pyarrow.parquet as pq
+    table = pq.read_table(target)
+    if arrow:
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    df = table.to_pandas()
+    obj_cols = json.loads((table.schema.metadata or {}).get(_OBJECT_COLS_KEY, b"[]"))
+    for c in obj_cols:
+        if c in df.columns and df[c].dtype != object:
+            df[c] = df[c].astype(object).where(df[c].notna(), pd.NA)
+    return df
+
+
+def _prune_old(cache_dir: _P, prefix: str, keep: _P) -> None:
+    for old in cache_dir.glob(f"{prefix}_*.parquet"):
+        if old != keep:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+
+def load_sp_age_sex_snapshot(path_parquet: str, uf_code: str = "35", excel_path: Optional[str] = None,
+                             families: Optional[Sequence[str]] = None, columns: Optional[Sequence[str]] = None,
+                             filters: Optional[Dict[str, Sequence]] = None, cache_dir: Optional[str] = None,
+                             rebuild: bool = False, arrow: bool = False, compact: bool = False,
+                             cluster: bool = False) -> pd.DataFrame:
+    """Como load_sp_age_sex_enriched, mas servido de um snapshot em disco.
+
+    O snapshot é reconstruído automaticamente (e os antigos removidos) apenas quando
+    a impressão digital das fontes/parâmetros muda, ou com rebuild=True. Falhas de
+    leitura/escrita do snapshot nunca impedem o carregamento: caem no pipeline normal.
+    cluster entra na impressão digital: o snapshot guarda as linhas já na ordem pedida.
+    """
+    params = {
+        "uf": uf_code,
+        "families": list(families) if families is not None else None,
+        "columns": list(columns or []),
+        "filters": {k: list(v) if not isinstance(v, (str, int)) else v for k, v in (filters or {}).items()},
+        "arrow": bool(arrow),
+        "compact": bool(compact),
+        "cluster": bool(cluster),
+    }
+    fp = source_fingerprint(path_parquet, excel_path=excel_path, **params)
+    cdir = _P(cache_dir) if cache_dir else default_cache_dir()
+    prefix = f"enriched_uf{uf_code}_" + hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:8]
+    target = cdir / f"{prefix}_{fp}.parquet"
+    if target.exists() and not rebuild:
+        try:
+            return _read_snapshot(target, arrow=arrow)
+        except Exception:
+            pass  # snapshot corrompido/incompatível: reconstrói
+    df = T.load_sp_age_sex_enriched(path_parquet, uf_code=uf_code, excel_path=excel_path,
+                                    families=families, columns=columns, filters=filters, arrow=arrow,
+                                    compact=compact, cluster=cluster)
+    try:
+        _write_atomic(df, target)
+        _prune_old(cdir, prefix, target)
+    except Exception:
+        pass
+    return df
+
+
+# Alias em PT-BR
+def carregar_sp_idade_sexo_snapshot(path_parquet: str, uf: str = "35", caminho_excel: Optional[str] = None,
+                                    familias: Optional[Sequence[str]] = None, colunas: Optional[Sequence[str]] = None,
+                                    filtros: Optional[Dict[str, Sequence]] = None, dir_cache: Optional[str] = None,
+                                    reconstruir: bool = False, arrow: bool = False,
+                                    compactar: bool = False, agrupar_geo: bool = False) -> pd.DataFrame:
+    return load_sp_age_sex_snapshot(path_parquet, uf_code=uf, excel_path=caminho_excel, families=familias,
+                                    columns=colunas, filters=filtros, cache_dir=dir_cache, rebuild=reconstruir,
+                                    arrow=arrow, compact=compactar, cluster=agrupar_geo)
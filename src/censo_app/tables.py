@@ -66,6 +66,35 @@ def build_abnt_demographic_table(df_plot: pd.DataFrame, age_order: List[str]) ->
     return out.reset_index(drop=True)
 
 
+def compare_abnt_tables(table: pd.DataFrame, comp_table: pd.DataFrame) -> pd.DataFrame:
+    """Add '% do Total' and 'Δ vs Comp.' (pp against the comparator's age shares) to an ABNT table.
+    Both inputs come from build_abnt_demographic_table and are left untouched.
+    """
+    out = table.copy()
+    total_main = float(out.loc[out['Faixa Etária'] == "TOTAL", 'Total'].iloc[0]) if not out.empty else 0.0
+    out['% do Total'] = out.apply(
+        lambda r: round((float(r['Total']) / total_main * 100.0), 1) if r['Faixa Etária'] != 'TOTAL' and total_main > 0 else (100.0 if r['Faixa Etária'] == 'TOTAL' else 0.0),
+        axis=1
+    )
+    total_comp = float(comp_table.loc[comp_table['Faixa Etária'] == "TOTAL", 'Total'].iloc[0]) if not comp_table.empty else 0.0
+    comp_pct = comp_table[['Faixa Etária', 'Total']].copy()
+    comp_pct['% do Total (Comp)'] = comp_pct.apply(
+        lambda r: round((float(r['Total']) / total_comp * 100.0), 1) if r['Faixa Etária'] != 'TOTAL' and total_comp > 0 else (100.0 if r['Faixa Etária'] == 'TOTAL' else 0.0),
+        axis=1
+    )
+    out = out.merge(comp_pct[['Faixa Etária', '% do Total (Comp)']], on='Faixa Etária', how='left')
+    out['Δ vs Comp.'] = out.apply(
+        lambda r: (r['% do Total'] - r['% do Total (Comp)']) if pd.notna(r.get('% do Total (Comp)')) and r['Faixa Etária'] != 'TOTAL' else None,
+        axis=1
+    )
+    # '% do Total' and 'Δ vs Comp.' right after '% Feminino'; the comparator share is dropped
+    cols = [c for c in out.columns if c != '% do Total (Comp)']
+    base_order = ['Faixa Etária', 'Masculino', 'Feminino', 'Total', '% Masculino', '% Feminino']
+    extra = ['% do Total', 'Δ vs Comp.']
+    ordered = [c for c in base_order if c in cols] + [c for c in extra if c in cols] + [c for c in cols if c not in set(base_order + extra)]
+    return out[ordered]
+
+
 def render_abnt_html(df: pd.DataFrame) -> str:
     """Render a simplified ABNT table as HTML (no vertical borders)."""
     df_fmt = df.copy()
@@ -120,5 +149,8 @@ def render_abnt_html(df: pd.DataFrame) -> str:
 def montar_tabela_demografica_abnt(df_pivot: pd.DataFrame, ordem_idade: List[str]) -> pd.DataFrame:
     return build_abnt_demographic_table(df_pivot, ordem_idade)
 
+def comparar_tabelas_abnt(tabela: pd.DataFrame, tabela_comparador: pd.DataFrame) -> pd.DataFrame:
+    return compare_abnt_tables(tabela, tabela_comparador)
+
 def renderizar_abnt_html(df: pd.DataFrame) -> str:
     return render_abnt_html(df)
@@ -0,0 +1,124 @@
+"""Tensor setor x faixa etária x sexo para as pirâmides.
+
+As 22 colunas Sexo x faixa do frame wide viram um ndarray uint32 denso de forma
+(n_setores, 11, 2), acompanhado do frame geográfico por setor (uma linha por setor)
+e de índices inteiros por nível (setor -> município/RGI/RGINT/RM-AU...). Qualquer
+pirâmide passa a ser um recorte + soma; o frame faixa_etaria/sexo/populacao usado por
+build_abnt_demographic_table e make_age_pyramid é gerado só quando pedido.
+"""
+from __future__ import annotations
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .transform import AGE_GROUPS, _parse_age_sex_key, _pick_exact_age_cols
+
+SEXES: Tuple[str, ...] = ("Masculino", "Feminino")
+
+# Colunas por setor mantidas ao lado do tensor (filtros, escalas e rótulos da página)
+GEO_COLUMNS: Tuple[str, ...] = (
+    "CD_SETOR","CD_MUN","NM_MUN","CD_UF","NM_UF","NM_RGINT","NM_RGI",
+    "RM_NOME","AU_NOME","NOME_RM_AU","TIPO_RM_AU","REGIAO_RM_AU",
+    "CD_SITUACAO","SITUACAO","SITUACAO_DET_TXT","CD_TIPO","TP_SETOR_TXT","V0001",
+)
+
+Rows = Optional[np.ndarray]  # índices (ou máscara booleana) de setores; None = todos
+
+
+def pyramid_frame(pyr: np.ndarray, age_order: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Pirâmide (11, 2) -> frame sexo/faixa_etaria/populacao na ordem de age_order."""
+    order = list(age_order or AGE_GROUPS)
+    pos = {g: i for i, g in enumerate(AGE_GROUPS)}
+    sexo, faixa, pop = [], [], []
+    for si, s in enumerate(SEXES):
+        for g in order:
+            sexo.append(s)
+            faixa.append(g)
+            pop.append(int(pyr[pos[g], si]) if g in pos else 0)
+    return pd.DataFrame({"sexo": sexo, "faixa_etaria": faixa, "populacao": np.asarray(pop, dtype="int64")})
+
+
+class PyramidTensor:
+    """counts[setor, faixa, sexo] (uint32) + geo (frame por setor, mesma ordem)."""
+
+    def __init__(self, counts: np.ndarray, geo: pd.DataFrame, has_null: np.ndarray):
+        self.counts = counts
+        self.geo = geo.reset_index(drop=True)
+        self.has_null = has_null
+        self._codes: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_wide(cls, df_wide: pd.DataFrame) -> "PyramidTensor":
+        m_cols, f_cols = _pick_exact_age_cols(df_wide.columns.tolist())
+        if not m_cols + f_cols:
+            raise ValueError("As colunas etárias esperadas (11 por sexo) não foram encontradas.")
+        n = len(df_wide)
+        counts = np.zeros((n, len(AGE_GROUPS), len(SEXES)), dtype=np.uint32)
+        has_null = np.zeros(n, dtype=bool)
+        for col in m_cols + f_cols:
+            sexo, faixa = _parse_age_sex_key(col)
+            vals = pd.to_numeric(df_wide[col], errors="coerce")
+            isna = vals.isna().to_numpy()
+            has_null |= isna
+            arr = np.clip(vals.to_numpy(dtype="float64", na_value=0.0), 0, None)
+            counts[:, AGE_GROUPS.index(faixa), SEXES.index(sexo)] = arr.astype(np.uint32)
+        geo = df_wide[[c for c in GEO_COLUMNS if c in df_wide.columns]]
+        return cls(counts, geo, has_null)
+
+    @property
+    def n_sectors(self) -> int:
+        return self.counts.shape[0]
+
+    def codes(self, level: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(códigos int32 por setor, rótulos) do nível; -1 para setor sem valor."""
+        if level not in self._codes:
+            if level not in self.geo.columns:
+                raise KeyError(f"Nível geográfico ausente: {level}")
+            codes, labels = pd.factorize(self.geo[level], use_na_sentinel=True)
+            self._codes[level] = (codes.astype(np.int32), np.asarray(labels, dtype=object))
+        return self._codes[level]
+
+    def rows_where(self, level: str, values: Sequence) -> np.ndarray:
+        """Máscara booleana dos setores cujo nível está em values."""
+        codes, labels = self.codes(level)
+        wanted = np.flatnonzero(pd.Index(labels).isin(list(values)))
+        return np.isin(codes, wanted)
+
+    def pyramid(self, rows: Rows = None) -> np.ndarray:
+        """Soma (11, 2) uint64 dos setores selecionados."""
+        sel = self.counts if rows is None else self.counts[rows]
+        return sel.sum(axis=0, dtype=np.uint64)
+
+    def by(self, level: str, rows: Rows = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(rótulos, somas (k, 11, 2)) por valor do nível, via ordenação + reduceat."""
+        codes, labels = self.codes(level)
+        idx = np.arange(self.n_sectors) if rows is None else np.arange(self.n_sectors)[rows]
+        idx = idx[codes[idx] >= 0]
+        if len(idx) == 0:
+            return labels[:0], np.zeros((0, len(AGE_GROUPS), len(SEXES)), dtype=np.uint64)
+        order = idx[np.argsort(codes[idx], kind="stable")]
+        sc = codes[order]
+        starts = np.flatnonzero(np.r_[True, sc[1:] != sc[:-1]])
+        sums = np.add.reduceat(self.counts[order].astype(np.uint64), starts, axis=0)
+        return labels[sc[starts]], sums
+
+    def to_frame(self, pyr: np.ndarray, age_order: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Frame sexo/faixa_etaria/populacao (mesma forma de pad_pyramid_categories)."""
+        return pyramid_frame(pyr, age_order)
+
+    def sectors_frame(self) -> pd.DataFrame:
+        """geo + __ix (linha do setor no tensor) + __nulo (setor com célula etária ausente)."""
+        out = self.geo.copy()
+        out["__ix"] = np.arange(self.n_sectors)
+        out["__nulo"] = self.has_null
+        return out
+
+    def frame_for(self, sectors: pd.DataFrame, age_order: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Pirâmide de um recorte de sectors_frame() (usa a coluna __ix)."""
+        return self.to_frame(self.pyramid(sectors["__ix"].to_numpy()), age_order)
+
+
+# Alias em PT-BR
+def construir_tensor_piramide(df_largo: pd.DataFrame) -> PyramidTensor:
+    return PyramidTensor.from_wide(df_largo)
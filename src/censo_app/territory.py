@@ -0,0 +1,188 @@
+"""Árvore territorial (Estado → RGINT → RGI → município → setor) e busca para seletores.
+
+TerritoryTree resume o frame por setor uma vez: para cada nível, um frame por nó com
+rótulo, pai, população (V0001) e número de setores. TerritorySearch indexa códigos e
+nomes sem acento/caixa, com lista ordenada de tokens (prefixo por bisect) e listas de
+trigramas (substring); os seletores buscam no servidor e mandam ao navegador só os
+primeiros resultados, em vez de todas as opções a cada rerun.
+"""
+from __future__ import annotations
+import bisect
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .cube import ESTADO
+
+TREE_LEVELS: Tuple[str, ...] = ("NM_RGINT", "NM_RGI", "CD_MUN", "CD_SETOR")
+# Nível -> coluna de rótulo (os demais usam a própria chave)
+TREE_LABELS: Dict[str, str] = {"CD_MUN": "NM_MUN"}
+SEARCH_LIMIT = 50
+
+
+def fold(s: object) -> str:
+    """Texto sem acentos, minúsculo e com espaços simples (comparação de busca)."""
+    s = str(s)
+    if not s.isascii():
+        s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+    return " ".join(s.lower().split())
+
+
+class TerritoryTree:
+    """levels[nível] = frame indexado pela chave: label, parent, populacao, setores (ordem da chave)."""
+
+    def __init__(self, levels: Dict[str, pd.DataFrame], sector_rows: Optional[np.ndarray] = None):
+        self.levels = levels
+        self.sector_rows = sector_rows  # posição no frame de origem de cada setor (ordem de levels["CD_SETOR"])
+        self._children = {name: f.groupby("parent", sort=False).indices for name, f in levels.items()}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, levels: Sequence[str] = TREE_LEVELS) -> "TerritoryTree":
+        present = [lv for lv in levels if lv in df.columns]
+        pop = pd.to_numeric(df["V0001"], errors="coerce").fillna(0) if "V0001" in df.columns else pd.Series(0, index=df.index)
+        base = df[present + [c for c in set(TREE_LABELS.values()) if c in df.columns]].copy()
+        base["__pop"] = pop.to_numpy()
+        base["__row"] = np.arange(len(df))
+        out: Dict[str, pd.DataFrame] = {}
+        sector_rows = None
+        for i, lv in enumerate(present):
+            parent = present[i - 1] if i else None
+            lab = TREE_LABELS.get(lv)
+            sub = base[base[lv].notna()]
+            agg = {"populacao": ("__pop", "sum"), "setores": ("__pop", "size"), "__row": ("__row", "first")}
+            if parent:
+                agg["parent"] = (parent, "first")
+            if lab and lab in base.columns:
+                agg["label"] = (lab, "first")
+            g = sub.groupby(lv, sort=True, observed=True).agg(**agg)
+            if not parent:
+                g["parent"] = ESTADO
+            if "label" not in g.columns:
+                g["label"] = g.index.astype(str)
+            g["label"] = g["label"].where(g["label"].notna(), g.index.astype(str))
+            g["populacao"] = g["populacao"].astype("int64")
+            if lv == "CD_SETOR":
+                sector_rows = g["__row"].to_numpy()
+            out[lv] = g[["label", "parent", "populacao", "setores"]]
+        return cls(out, sector_rows)
+
+    def children(self, level: str, parent: object = ESTADO) -> pd.DataFrame:
+        """Nós do nível cujo pai é parent (ordem da chave)."""
+        f = self.levels[level]
+        return f.iloc[self._children[level].get(parent, np.zeros(0, dtype=np.intp))] if parent is not None else f
+
+    def population(self, level: str, key: object) -> int:
+        try:
+            return int(self.levels[level].at[key, "populacao"])
+        except KeyError:
+            return 0
+
+
+class TerritorySearch:
+    """Busca por código/nome (sem acento) nos nós da árvore; resultados ordenados por relevância e população."""
+
+    def __init__(self, tree: TerritoryTree, levels: Optional[Sequence[str]] = None):
+        self.tree = tree
+        parts = []
+        for lv in (levels or list(tree.levels)):
+            f = tree.levels[lv]
+            rows = tree.sector_rows if lv == "CD_SETOR" and tree.sector_rows is not None else np.full(len(f), -1)
+            parts.append(pd.DataFrame({"level": lv, "key": f.index.to_numpy(dtype=object), "label": f["label"].to_numpy(dtype=object),
+                                       "parent": f["parent"].to_numpy(dtype=object), "populacao": f["populacao"].to_numpy(),
+                                       "row": rows}))
+        self.entries = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+            columns=["level", "key", "label", "parent", "populacao", "row"])
+        self._level = self.entries["level"].to_numpy(dtype=object)
+        self._parent = self.entries["parent"].to_numpy(dtype=object)
+        self._row = self.entries["row"].to_numpy(dtype=np.int64)
+        self._pop = self.entries["populacao"].to_numpy()
+        keys = [fold(k) for k in self.entries["key"]]
+        labels = [fold(v) for v in self.entries["label"]]
+        self._key = np.asarray(keys, dtype=object)
+        self._label = np.asarray(labels, dtype=object)
+        self._text = [k if k == v else f"{k} {v}" for k, v in zip(keys, labels)]
+        # tokens (prefixo) e trigramas (substring)
+        toks: List[Tuple[str, int]] = []
+        grams: Dict[str, List[int]] = {}
+        for i, t in enumerate(self._text):
+            toks.extend((w, i) for w in set(re.split(r"[\s\-/]+", t)) if w)
+            for g in {t[j:j + 3] for j in range(len(t) - 2)}:
+                grams.setdefault(g, []).append(i)
+        toks.sort()
+        self._tok = [w for w, _ in toks]
+        self._tok_id = np.asarray([i for _, i in toks], dtype=np.int64)
+        self._grams = {g: np.asarray(v, dtype=np.int64) for g, v in grams.items()}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, levels: Sequence[str] = TREE_LEVELS) -> "TerritorySearch":
+        return cls(TerritoryTree.from_frame(df, levels))
+
+    def _scope(self, level: Optional[str], parent: object, row_mask: Optional[np.ndarray]) -> np.ndarray:
+        ok = np.ones(len(self._level), dtype=bool)
+        if level is not None:
+            ok &= self._level == level
+        if parent is not None:
+            ok &= self._parent == parent
+        if row_mask is not None:
+            # filtros da página valem só para setores (entradas com posição no frame)
+            sect = self._row >= 0
+            ok[sect] &= row_mask[self._row[sect]]
+        return ok
+
+    def _candidates(self, q: str) -> np.ndarray:
+        if len(q) < 3:
+            return np.unique(self._candidates_prefix(q))
+        lists = sorted((self._grams.get(q[j:j + 3]) for j in range(len(q) - 2)),
+                       key=lambda a: -1 if a is None else len(a))
+        if lists[0] is None:
+            return np.zeros(0, dtype=np.int64)
+        cand = lists[0]
+        for a in lists[1:]:
+            cand = np.intersect1d(cand, a, assume_unique=True)
+            if not len(cand):
+                break
+        return np.asarray([i for i in cand if q in self._text[i]], dtype=np.int64)
+
+    def search(self, query: str = "", level: Optional[str] = None, parent: object = None,
+               row_mask: Optional[np.ndarray] = None, limit: int = SEARCH_LIMIT) -> pd.DataFrame:
+        """Até limit nós (level, key, label, parent, populacao).
+
+        Consulta vazia: nós do escopo na ordem da chave. Senão: chave/nome igual, depois
+        começando pela consulta, palavra começando pela consulta e, por fim, substring.
+        attrs["total"] = número de nós que casam (antes do limite).
+        """
+        ok = self._scope(level, parent, row_mask)
+        q = fold(query)
+        if not q:
+            idx = np.flatnonzero(ok)
+        else:
+            cand = self._candidates(q)
+            idx = cand[ok[cand]]
+            if len(idx):
+                key, lab = self._key[idx], self._label[idx]
+                rank = np.full(len(idx), 2, dtype=np.int8)
+                rank[np.fromiter((k.startswith(q) or v.startswith(q) for k, v in zip(key, lab)), bool, len(idx))] = 1
+                rank[(key == q) | (lab == q)] = 0
+                if len(q) >= 3:
+                    rank[(rank == 2) & ~np.isin(idx, self._candidates_prefix(q))] = 3
+                idx = idx[np.lexsort((-self._pop[idx], rank))]
+        out = self.entries.iloc[idx[:limit]][["level", "key", "label", "parent", "populacao"]].reset_index(drop=True)
+        out.attrs["total"] = int(len(idx))
+        return out
+
+    def _candidates_prefix(self, q: str) -> np.ndarray:
+        lo = bisect.bisect_left(self._tok, q)
+        hi = bisect.bisect_left(self._tok, q + "￿")
+        return self._tok_id[lo:hi]
+
+
+# Aliases em PT-BR
+def construir_arvore_territorial(df: pd.DataFrame) -> TerritoryTree:
+    return TerritoryTree.from_frame(df)
+
+
+def construir_busca_territorial(df: pd.DataFrame) -> TerritorySearch:
+    return TerritorySearch.from_frame(df)
@@ -1,8 +1,10 @@
 from __future__ import annotations
-from typing import List, Tuple, Optional, Dict, Sequence
+from typing import Iterator, List, Tuple, Optional, Dict, Sequence
+from contextlib import closing
 from functools import lru_cache
 import os
 import re, unicodedata
+import numpy as np
 import pandas as pd
 from pathlib import Path as _P
 
@@ -11,6 +13,18 @@ try:
 except Exception:
     duckdb = None  # type: ignore
 
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+except Exception:
+    pa = None  # type: ignore
+    pc = None  # type: ignore
+
+from .db import cursor as _db_cursor
+from .perf import stage as _stage, format_stats as _format_stats
+from .clustered import cluster_by_geo
+from .layout import parquet_source
+
 SITUACAO_DET_MAP: Dict[int, str] = {
     1: "Área urbana de alta densidade de edificações de cidade ou vila",
     2: "Área urbana de baixa densidade de edificações de cidade ou vila",
@@ -52,24 +66,37 @@ VAR_LABELS: Dict[str, str] = {
     "V0007": "Total de Domicílios Particulares Ocupados (DPPO + DPIO)",
 }
 
-# Cache do mapeamento externo gerado em docs/columns_map.csv
-_COLMAP_CACHE: Optional[Dict[str, str]] = None
+# Raiz do projeto (src/censo_app/transform.py -> censo_app -> src -> raiz)
+ROOT_DIR = _P(__file__).resolve().parents[2]
+COLMAP_DEFAULT_PATH = ROOT_DIR / "docs" / "columns_map.csv"
+
+# Cache do mapeamento externo gerado em docs/columns_map.csv:
+# caminho -> ((mtime_ns, tamanho), mapeamento). Invalidado quando o CSV muda.
+_COLMAP_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+
+def _colmap_stamp(path: Optional[str] = None) -> Tuple[str, Tuple[int, int]]:
+    """(caminho, (mtime_ns, tamanho)) do columns_map.csv; (0, 0) se não existir."""
+    csv_path = _P(path) if path else COLMAP_DEFAULT_PATH
+    try:
+        st = csv_path.stat()
+        return csv_path.as_posix(), (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return csv_path.as_posix(), (0, 0)
 
 def _get_external_colmap(path: Optional[str] = None) -> Dict[str, str]:
     """Lê docs/columns_map.csv (se existir) e devolve um dicionário
     parquet_column -> app_equivalent (apenas quando diferente e não vazio).
 
-    Resultado é cacheado para reduzir IO.
+    Resultado é cacheado por (mtime, tamanho) do arquivo para reduzir IO.
     """
-    global _COLMAP_CACHE
-    if _COLMAP_CACHE is not None:
-        return _COLMAP_CACHE
-    root = _P(__file__).resolve().parents[3]
-    csv_path = _P(path) if path else (root / "docs" / "columns_map.csv")
+    key, stamp = _colmap_stamp(path)
+    hit = _COLMAP_CACHE.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
     out: Dict[str, str] = {}
     try:
-        if csv_path.exists():
-            df_map = pd.read_csv(csv_path)
+        if stamp != (0, 0):
+            df_map = pd.read_csv(key)
             if set(["parquet_column", "app_equivalent"]).issubset(df_map.columns):
                 for row in df_map.itertuples(index=False):
                     orig = getattr(row, "parquet_column", None)
@@ -78,7 +105,7 @@ def _get_external_colmap(path: Optional[str] = None) -> Dict[str, str]:
                         out[orig] = eqv
     except Exception:
         out = {}
-    _COLMAP_CACHE = out
+    _COLMAP_CACHE[key] = (stamp, out)
     return out
 
 def _normcol(s: str) -> str:
@@ -103,33 +130,47 @@ ALIASES = {
     "NM_RGINT": {"NM_RGINT","NOME_DA_REGIAO_GEOGRAFICA_INTERMEDIARIA"},
     "NM_RGI": {"NM_RGI","NOME_DA_REGIAO_GEOGRAFICA_IMEDIATA"},
 }
+# Variantes já normalizadas (uma vez, na importação)
+_NORM_ALIASES: Tuple[Tuple[str, Tuple[str, ...]], ...] = tuple(
+    (canon, tuple(_normcol(v) for v in variants)) for canon, variants in ALIASES.items()
+)
+_V000_RE = re.compile(r"(?i)v000([1-7])")
 
-def _rename_by_alias(df: pd.DataFrame) -> pd.DataFrame:
-    # 0) Aplicar mapeamento externo (se disponível)
-    ext = _get_external_colmap()
-    if ext:
-        df = df.rename(columns={c: ext[c] for c in df.columns if c in ext})
+def _canonical_column_names(columns: Sequence[str], colmap_path: Optional[str] = None) -> Dict[str, str]:
+    """Resolve nome físico -> nome canônico aplicando as mesmas regras de
+    _rename_by_alias (mapeamento externo, ALIASES e V000x), apenas sobre os nomes.
 
-    rename = {}
-    norm_lookup = {_normcol(c): c for c in df.columns}
+    Permite decidir a projeção antes de ler qualquer dado do Parquet. O resultado
+    é memorizado por (nomes, versão do columns_map.csv).
+    """
+    return dict(_canonical_column_names_cached(tuple(columns), *_colmap_stamp(colmap_path)))
+
+@lru_cache(maxsize=32)
+def _canonical_column_names_cached(columns: Tuple[str, ...], colmap_key: str,
+                                   colmap_stamp: Tuple[int, int]) -> Dict[str, str]:
+    ext = _get_external_colmap(colmap_key)
+    # 0) Aplicar mapeamento externo (se disponível)
+    step0 = {c: ext.get(c, c) for c in columns}
+    norm_lookup = {_normcol(c): c for c in step0.values()}
     # 1) Aliases semânticos (campos de identificação/descrição)
-    for canon, variants in ALIASES.items():
-        for v in variants:
-            nv = _normcol(v)
+    rename = {}
+    for canon, variants in _NORM_ALIASES:
+        for nv in variants:
             if nv in norm_lookup:
                 rename[norm_lookup[nv]] = canon
                 break
-    out = df.rename(columns=rename)
     # 2) Normalizar códigos v0001..v0007 para maiúsculo (V0001..V0007)
-    extra = {}
-    for c in out.columns:
-        m = re.fullmatch(r"(?i)v000([1-7])", str(c).strip())
-        if m:
-            extra[c] = f"V000{m.group(1)}"
-    if extra:
-        out = out.rename(columns=extra)
+    out: Dict[str, str] = {}
+    for orig, mid in step0.items():
+        name = rename.get(mid, mid)
+        m = _V000_RE.fullmatch(str(name).strip())
+        out[orig] = f"V000{m.group(1)}" if m else name
     return out
 
+def _rename_by_alias(df: pd.DataFrame) -> pd.DataFrame:
+    canon = _canonical_column_names(df.columns.tolist())
+    return df.rename(columns={k: v for k, v in canon.items() if k != v})
+
 def get_variable_label(code: str) -> Optional[str]:
     """Retorna o rótulo humano de uma variável V000x, se conhecido.
 
@@ -138,38 +179,98 @@ def get_variable_label(code: str) -> Optional[str]:
     k = str(code).strip().upper()
     return VAR_LABELS.get(k)
 
+# Códigos/rótulos da situação detalhada considerados urbanos (SITUACAO = "Urbana")
+_URBAN_CODES = (1, 2, 3)
+_URBAN_DET_TXT = {SITUACAO_DET_MAP[c] for c in _URBAN_CODES}
+
 def _derive_macro_from_cd(cd):
     try:
         c = int(str(cd))
     except Exception:
         return None
-    return "Urbana" if c in (1,2,3) else "Rural"
+    return "Urbana" if c in _URBAN_CODES else "Rural"
 
-def _normalize_codes(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
+# --- Caminho Arrow: colunas pd.ArrowDtype são tratadas com pyarrow.compute, sem
+# passar por objetos Python (ver load_sp_age_sex_enriched(arrow=True)) ---
+def _is_arrow(s: pd.Series) -> bool:
+    return isinstance(s.dtype, pd.ArrowDtype)
+
+def _from_pa(arr, index) -> pd.Series:
+    return pd.Series(pd.arrays.ArrowExtensionArray(arr), index=index)
+
+def _pa_text(s: pd.Series):
+    arr = pa.array(s.array)
+    return arr if pa.types.is_string(arr.type) else pc.cast(arr, pa.string())
+
+def _arrow_lookup(s: pd.Series, mapping: Dict) -> pd.Series:
+    """Equivalente Arrow de s.map(mapping): index_in + take."""
+    arr = pa.array(s.array)
+    keys = pa.array(list(mapping))
+    try:
+        keys = keys.cast(arr.type)
+    except Exception:
+        arr, keys = _pa_text(s), pa.array([str(k) for k in mapping])
+    idx = pc.index_in(arr, value_set=keys)
+    return _from_pa(pc.take(pa.array(list(mapping.values())), idx), s.index)
+
+def _arrow_macro(s: pd.Series, urban_values) -> pd.Series:
+    """Urbana/Rural por pertinência a urban_values (nulo -> nulo)."""
+    arr = pa.array(s.array)
+    try:
+        vset = pa.array(list(urban_values)).cast(arr.type)
+    except Exception:
+        arr, vset = _pa_text(s), pa.array([str(v) for v in urban_values])
+    out = pc.if_else(pc.is_in(arr, value_set=vset), "Urbana", "Rural")
+    return _from_pa(pc.if_else(pc.is_valid(arr), out, pa.scalar(None, pa.string())), s.index)
+
+def _normalize_codes(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+    out = df if inplace else df.copy()
     for key in ("CD_SETOR","CD_MUN","CD_UF"):
         if key in out.columns:
-            out[key] = out[key].astype(str).str.extract(r"(\d+)")[0].fillna(out[key].astype(str))
+            if _is_arrow(out[key]):
+                txt = _pa_text(out[key])
+                digits = pc.struct_field(pc.extract_regex(txt, r"(?P<d>\d+)"), [0])
+                out[key] = _from_pa(pc.coalesce(digits, txt), out.index)
+            else:
+                out[key] = out[key].astype(str).str.extract(r"(\d+)")[0].fillna(out[key].astype(str))
     return out
 
-def _ensure_decodes(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
+def _ensure_decodes(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+    out = df if inplace else df.copy()
     if "CD_SITUACAO" not in out.columns and "SITUACAO_DET_TXT" in out.columns:
         inv = {v:k for k,v in SITUACAO_DET_MAP.items()}
-        out["CD_SITUACAO"] = out["SITUACAO_DET_TXT"].map(inv).astype("Int64")
+        if _is_arrow(out["SITUACAO_DET_TXT"]):
+            out["CD_SITUACAO"] = _arrow_lookup(out["SITUACAO_DET_TXT"], inv)
+        else:
+            out["CD_SITUACAO"] = out["SITUACAO_DET_TXT"].map(inv).astype("Int64")
     if "SITUACAO_DET_TXT" not in out.columns and "CD_SITUACAO" in out.columns:
-        out["SITUACAO_DET_TXT"] = pd.to_numeric(out["CD_SITUACAO"], errors="coerce").map(SITUACAO_DET_MAP)
+        if _is_arrow(out["CD_SITUACAO"]):
+            out["SITUACAO_DET_TXT"] = _arrow_lookup(out["CD_SITUACAO"], SITUACAO_DET_MAP)
+        else:
+            out["SITUACAO_DET_TXT"] = pd.to_numeric(out["CD_SITUACAO"], errors="coerce").map(SITUACAO_DET_MAP)
     if "CD_TIPO" not in out.columns and "TP_SETOR_TXT" in out.columns:
         invt = {v:k for k,v in TIPO_MAP.items()}
-        out["CD_TIPO"] = out["TP_SETOR_TXT"].map(invt).astype("Int64")
+        if _is_arrow(out["TP_SETOR_TXT"]):
+            out["CD_TIPO"] = _arrow_lookup(out["TP_SETOR_TXT"], invt)
+        else:
+            out["CD_TIPO"] = out["TP_SETOR_TXT"].map(invt).astype("Int64")
     if "TP_SETOR_TXT" not in out.columns and "CD_TIPO" in out.columns:
-        out["TP_SETOR_TXT"] = pd.to_numeric(out["CD_TIPO"], errors="coerce").map(TIPO_MAP)
+        if _is_arrow(out["CD_TIPO"]):
+            out["TP_SETOR_TXT"] = _arrow_lookup(out["CD_TIPO"], TIPO_MAP)
+        else:
+            out["TP_SETOR_TXT"] = pd.to_numeric(out["CD_TIPO"], errors="coerce").map(TIPO_MAP)
     if "SITUACAO" not in out.columns:
         if "CD_SITUACAO" in out.columns:
-            out["SITUACAO"] = out["CD_SITUACAO"].apply(_derive_macro_from_cd)
+            if _is_arrow(out["CD_SITUACAO"]):
+                out["SITUACAO"] = _arrow_macro(out["CD_SITUACAO"], _URBAN_CODES)
+            else:
+                out["SITUACAO"] = out["CD_SITUACAO"].apply(_derive_macro_from_cd)
         elif "SITUACAO_DET_TXT" in out.columns:
-            urb = {"Área urbana de alta densidade de edificações de cidade ou vila","Área urbana de baixa densidade de edificações de cidade ou vila","Núcleo urbano"}
-            out["SITUACAO"] = out["SITUACAO_DET_TXT"].apply(lambda s: "Urbana" if s in urb else "Rural")
+            if _is_arrow(out["SITUACAO_DET_TXT"]):
+                txt = out["SITUACAO_DET_TXT"].fillna("")
+                out["SITUACAO"] = _arrow_macro(txt, _URBAN_DET_TXT)
+            else:
+                out["SITUACAO"] = out["SITUACAO_DET_TXT"].apply(lambda s: "Urbana" if s in _URBAN_DET_TXT else "Rural")
     return out
 
 def _normalize_simple(s: str) -> str:
@@ -179,104 +280,39 @@ def _normalize_simple(s: str) -> str:
 
 def _norm_cd_mun(series: pd.Series) -> pd.Series:
     """Normaliza códigos de município para 7 dígitos (string de números)."""
-    return pd.Series(series).astype(str).str.replace(r"\D", "", regex=True).str.zfill(7)
-
-def _file_mtime(path: str) -> float:
-    try:
-        return os.path.getmtime(path)
-    except Exception:
-        return 0.0
-
-@lru_cache(maxsize=8)
-def _rm_au_lookup_from_excel_cached(excel_path: str, mtime: float) -> Tuple[Optional[Dict[str, str]], Optional[Dict[str, str]]]:
-    """Carrega mapas RM/AU do Excel, cacheado por caminho+mtime.
+    series = pd.Series(series)
+    if _is_arrow(series):
+        digits = pc.replace_substring_regex(_pa_text(series), r"\D", "")
+        return _from_pa(pc.utf8_lpad(digits, 7, "0"), series.index)
+    return series.astype(str).str.replace(r"\D", "", regex=True).str.zfill(7)
 
-    Retorna tupla (rm_map_dict, au_map_dict) mapeando CD_MUN -> nome.
-    """
-    try:
-        xls = pd.ExcelFile(excel_path, engine="openpyxl")
-    except Exception:
-        return None, None
-
-    def _exact_map(sheet_name: str, value_col_name: str) -> Optional[Dict[str, str]]:
-        if sheet_name not in xls.sheet_names:
-            return None
-        try:
-            tmp = pd.read_excel(xls, sheet_name=sheet_name)
-        except Exception:
-            return None
-        cols = {str(c).strip(): c for c in tmp.columns}
-        inv = { _normalize_simple(k).upper(): v for k, v in cols.items() }
-        get = lambda k: inv.get(_normalize_simple(k).upper())
-        cod = get("COD_MUN")
-        nom = get("NOME_CATMETROPOL")
-        uf  = get("SIGLA_UF")
-        if not (cod and nom and uf):
-            return None
-        tmp = tmp[[cod, nom, uf]].copy()
-        tmp = tmp[tmp[uf].astype(str).str.upper().eq("SP")]
-        if tmp.empty:
-            return None
-        tmp["CD_MUN"] = _norm_cd_mun(tmp[cod])
-        tmp = tmp[["CD_MUN", nom]].dropna().drop_duplicates()
-        return dict(zip(tmp["CD_MUN"], tmp[nom]))
-
-    rm_map = _exact_map("Composição - Recortes Metropoli", "RM_NOME")
-    au_map = _exact_map("Composição - Aglomerações Urban", "AU_NOME")
-
-    # Fallback heurístico se preciso
-    if rm_map is None or au_map is None:
-        try:
-            norm = lambda s: _normalize_simple(s).lower()
-            rm_sheet = None
-            au_sheet = None
-            for name in xls.sheet_names:
-                n = norm(name)
-                if "metrop" in n and ("composicao" in n or "composi" in n):
-                    rm_sheet = name
-                if "aglomer" in n and ("urban" in n or "urbana" in n or "urbanas" in n):
-                    au_sheet = name
-            rm_sheet = rm_sheet or "Composição - Recortes Metropoli"
-            au_sheet = au_sheet or "Composição - Aglomerações Urban"
-            rm_df = pd.read_excel(xls, sheet_name=rm_sheet)
-            au_df = pd.read_excel(xls, sheet_name=au_sheet)
-            # tentar detectar colunas
-            def build_map(d: pd.DataFrame, name_candidates: List[str]) -> Optional[Dict[str, str]]:
-                d = d.copy()
-                d.columns = [_normcol(c) for c in d.columns]
-                if "COD_MUN" not in d.columns:
-                    # tenta CODIGO_DO_MUNICIPIO etc
-                    for c in list(d.columns):
-                        if c in {"CODIGO_DO_MUNICIPIO","COD_MUNICIPIO","CD_GEOCODM","CD_MUN","COD_MUN"}:
-                            d.rename(columns={c: "COD_MUN"}, inplace=True)
-                            break
-                nom_col = next((c for c in name_candidates if c in d.columns), None)
-                if "COD_MUN" not in d.columns or nom_col is None:
-                    return None
-                d["CD_MUN"] = _norm_cd_mun(d["COD_MUN"])
-                d = d[["CD_MUN", nom_col]].dropna().drop_duplicates()
-                return dict(zip(d["CD_MUN"], d[nom_col]))
-            if rm_map is None:
-                rm_map = build_map(rm_df, ["NOME_CATMETROPOL","RM_NOME","RM","NOME_RM"])
-            if au_map is None:
-                au_map = build_map(au_df, ["NOME_CATAU","AU_NOME","AU","NOME_AU"])
-        except Exception:
-            pass
-
-    return rm_map, au_map
+def _rm_au_maps(excel_path: str) -> Tuple[Optional[Dict[str, str]], Optional[Dict[str, str]]]:
+    """(rm_map, au_map) CD_MUN -> nome, do lookup compilado (rm_au.py); o Excel só é lido na compilação."""
+    from .rm_au import load_rm_au_lookup
+    return load_rm_au_lookup(excel_path)
 
 def enrich_with_municipality_lookup(df: pd.DataFrame, mapping: Dict[str, str], new_col: str,
-                                    source_col: str = "CD_MUN", overwrite: bool = False) -> pd.DataFrame:
+                                    source_col: str = "CD_MUN", overwrite: bool = False,
+                                    inplace: bool = False) -> pd.DataFrame:
     """Enriquece df mapeando códigos de município para um novo rótulo.
 
     - mapping: dict CD_MUN (7 dígitos) -> valor
     - new_col: coluna a ser criada/preenchida
     - overwrite: se False (padrão), só preenche valores ausentes
+    - inplace: altera e devolve o próprio df (sem cópia)
     """
     if not mapping or source_col not in df.columns:
         return df
-    out = df.copy()
+    out = df if inplace else df.copy()
     out[source_col] = _norm_cd_mun(out[source_col])
+    if _is_arrow(out[source_col]):
+        mapped = _arrow_lookup(out[source_col], mapping)
+        if overwrite or new_col not in out.columns:
+            out[new_col] = mapped
+        else:
+            cur = out[new_col] if _is_arrow(out[new_col]) else out[new_col].astype(pd.ArrowDtype(pa.string()))
+            out[new_col] = _from_pa(pc.coalesce(pa.array(cur.array), pa.array(mapped.array)), out.index)
+        return out
     mapped = out[source_col].map(mapping)
     if overwrite or new_col not in out.columns:
         out[new_col] = mapped
@@ -284,34 +320,31 @@ def enrich_with_municipality_lookup(df: pd.DataFrame, mapping: Dict[str, str], n
         out[new_col] = out[new_col].where(out[new_col].notna(), mapped)
     return out
 
-def _merge_rm_au(df: pd.DataFrame, excel_path: str = "insumos/Composicao_RM_2024.xlsx") -> pd.DataFrame:
-    """Enriquece o DataFrame com nomes de RM/AU com base no Excel fornecido.
-
-    Regras prioritárias (exatas) conforme especificação:
-    - Ler as abas:
-        • "Composição - Aglomerações Urban" (AU)
-        • "Composição - Recortes Metropoli" (RM)
-    - Usar as colunas: COD_MUN, NOME_CATMETROPOL, SIGLA_UF
-    - Filtrar apenas SIGLA_UF == "SP"
-    - Produzir mapas: CD_MUN -> AU_NOME / RM_NOME
+def _merge_rm_au(df: pd.DataFrame, excel_path: str = "insumos/Composicao_RM_2024.xlsx",
+                 inplace: bool = False) -> pd.DataFrame:
+    """Enriquece o DataFrame com RM_NOME/AU_NOME a partir do lookup RM/AU compilado.
 
-    Caso as abas/colunas exatas não existam, faz fallback heurístico anterior.
-    Também cria coluna auxiliar REGIAO_RM_AU (prioriza RM, senão AU).
+    Os mapas CD_MUN -> RM_NOME / AU_NOME vêm de rm_au.load_rm_au_lookup, que lê o CSV
+    compilado do workbook (abas de composição, SIGLA_UF == "SP") e só recompila quando
+    o workbook muda; o Excel não é lido aqui. Sem lookup disponível, as colunas não
+    são criadas. Também cria coluna auxiliar REGIAO_RM_AU (prioriza RM, senão AU).
     """
     p = _P(excel_path)
     if not p.exists():
         return df
-    out = df.copy()
+    out = df if inplace else df.copy()
     if "CD_MUN" not in out.columns:
         return out
     out["CD_MUN"] = _norm_cd_mun(out["CD_MUN"])
 
-    rm_map, au_map = _rm_au_lookup_from_excel_cached(p.as_posix(), _file_mtime(p.as_posix()))
+    rm_map, au_map = _rm_au_maps(p.as_posix())
     if rm_map:
-        out = enrich_with_municipality_lookup(out, rm_map, new_col="RM_NOME", source_col="CD_MUN", overwrite=False)
+        out = enrich_with_municipality_lookup(out, rm_map, new_col="RM_NOME", source_col="CD_MUN", overwrite=False, inplace=True)
     if au_map:
-        out = enrich_with_municipality_lookup(out, au_map, new_col="AU_NOME", source_col="CD_MUN", overwrite=False)
+        out = enrich_with_municipality_lookup(out, au_map, new_col="AU_NOME", source_col="CD_MUN", overwrite=False, inplace=True)
 
+    if _is_arrow(out["CD_MUN"]):
+        return _rm_au_aux_arrow(out)
     if "REGIAO_RM_AU" not in out.columns:
         out["REGIAO_RM_AU"] = out.get("RM_NOME")
         if "AU_NOME" in out.columns:
@@ -330,49 +363,580 @@ def _merge_rm_au(df: pd.DataFrame, excel_path: str = "insumos/Composicao_RM_2024
         out["NOME_RM_AU"] = out["REGIAO_RM_AU"]
     return out
 
+def _rm_au_aux_arrow(out: pd.DataFrame) -> pd.DataFrame:
+    """REGIAO_RM_AU / TIPO_RM_AU / NOME_RM_AU em colunas Arrow (mesmas regras de _merge_rm_au)."""
+    null = pa.nulls(len(out), pa.string())
+    rm = pa.array(out["RM_NOME"].array) if "RM_NOME" in out.columns else null
+    au = pa.array(out["AU_NOME"].array) if "AU_NOME" in out.columns else null
+    rm = rm if pa.types.is_string(rm.type) else pc.cast(rm, pa.string())
+    au = au if pa.types.is_string(au.type) else pc.cast(au, pa.string())
+    if "REGIAO_RM_AU" not in out.columns:
+        out["REGIAO_RM_AU"] = _from_pa(pc.coalesce(rm, au), out.index)
+    if "TIPO_RM_AU" not in out.columns:
+        tipo = pc.if_else(pc.is_valid(rm), "RM", pc.if_else(pc.is_valid(au), "AU", pa.scalar(None, pa.string())))
+        out["TIPO_RM_AU"] = _from_pa(tipo, out.index)
+    if "NOME_RM_AU" not in out.columns and "REGIAO_RM_AU" in out.columns:
+        out["NOME_RM_AU"] = out["REGIAO_RM_AU"]
+    return out
+
+# Regex única para as 22 colunas Sexo x faixa: captura sexo e faixa etária
+_AGE_SEX_COL_RE = re.compile(
+    r"^Sexo\s*(masculino|feminino)\s*,\s*(" + "|".join(re.escape(g) for g in AGE_GROUPS) + r")\s*(?:_\d+)?$",
+    re.IGNORECASE,
+)
+_AGE_GROUP_INDEX = {g.lower(): i for i, g in enumerate(AGE_GROUPS)}
+
 def _pick_exact_age_cols(columns: List[str]) -> Tuple[List[str], List[str]]:
-    male_cols, female_cols = [], []
-    for grp in ["0 a 4 anos","5 a 9 anos","10 a 14 anos","15 a 19 anos","20 a 24 anos","25 a 29 anos","30 a 39 anos","40 a 49 anos","50 a 59 anos","60 a 69 anos","70 anos ou mais"]:
-        pat_m = re.compile(rf"^Sexo\s*masculino\s*,\s*{re.escape(grp)}\s*(?:_\d+)?$", re.IGNORECASE)
-        pat_f = re.compile(rf"^Sexo\s*feminino\s*,\s*{re.escape(grp)}\s*(?:_\d+)?$", re.IGNORECASE)
-        m_match = next((c for c in columns if pat_m.match(str(c).strip())), None)
-        f_match = next((c for c in columns if pat_f.match(str(c).strip())), None)
-        if m_match: male_cols.append(m_match)
-        if f_match: female_cols.append(f_match)
+    """(masculinas, femininas) na ordem de AGE_GROUPS; primeira coluna que casa por faixa."""
+    found: Dict[Tuple[str, int], str] = {}
+    for c in columns:
+        m = _AGE_SEX_COL_RE.match(str(c).strip())
+        if m:
+            found.setdefault((m.group(1).lower(), _AGE_GROUP_INDEX[m.group(2).lower()]), c)
+    male_cols = [found[("masculino", i)] for i in range(len(AGE_GROUPS)) if ("masculino", i) in found]
+    female_cols = [found[("feminino", i)] for i in range(len(AGE_GROUPS)) if ("feminino", i) in found]
     return male_cols, female_cols
 
-def load_sp_age_sex_enriched(path_parquet: str, limit: Optional[int] = None, verbose: bool = False, uf_code: str = "35", excel_path: Optional[str] = None) -> pd.DataFrame:
-    if duckdb is None:
-        raise ModuleNotFoundError("Instale 'duckdb' (pip install duckdb).")
-    p = _P(path_parquet)
+# Famílias de colunas para projeção: a página declara o que usa e apenas essas
+# colunas são lidas do Parquet (a base completa tem ~1.456 colunas).
+COLUMN_FAMILIES: Dict[str, Tuple[str, ...]] = {
+    "geo": ("CD_SETOR","CD_MUN","NM_MUN","CD_UF","NM_UF","NM_RGINT","NM_RGI","RM_NOME","AU_NOME"),
+    "situacao": ("CD_SITUACAO","SITUACAO","SITUACAO_DET_TXT"),
+    "tipo": ("CD_TIPO","TP_SETOR_TXT"),
+    "variaveis": tuple(VAR_LABELS.keys()),
+    "idade_sexo": (),  # resolvida por _pick_exact_age_cols (22 colunas Sexo x faixa)
+}
+
+# Famílias usadas pela página Demografia (pirâmide + filtros + recortes)
+DEMOGRAFIA_FAMILIES: Tuple[str, ...] = ("geo", "situacao", "tipo", "variaveis", "idade_sexo")
+
+def _resolve_projection(columns: Sequence[str], families: Sequence[str],
+                        extra_columns: Optional[Sequence[str]] = None, schema=None) -> List[str]:
+    """Seleciona as colunas físicas do Parquet pertencentes às famílias pedidas.
+
+    - families: chaves de COLUMN_FAMILIES
+    - extra_columns: nomes adicionais (físicos ou canônicos), ex.: colunas de domicílios
+    - schema: ParquetSchema já resolvido (evita refazer nomes canônicos e colunas etárias)
+    Mantém a ordem original do arquivo.
+    """
+    unknown = [f for f in families if f not in COLUMN_FAMILIES]
+    if unknown:
+        raise ValueError(f"Família(s) de colunas desconhecida(s): {unknown}. Use: {sorted(COLUMN_FAMILIES)}")
+    canon = schema.canon if schema is not None else _canonical_column_names(columns)
+    wanted = set()
+    for fam in families:
+        wanted.update(COLUMN_FAMILIES[fam])
+    wanted.update(extra_columns or [])
+    if "idade_sexo" in families and schema is not None:
+        wanted.update(schema.age_sex_cols)
+    elif "idade_sexo" in families:
+        inv = {v: k for k, v in canon.items()}
+        m_cols, f_cols = _pick_exact_age_cols(list(canon.values()))
+        wanted.update(inv.get(c, c) for c in m_cols + f_cols)
+    return [c for c in columns if c in wanted or canon[c] in wanted]
+
+# Filtros aceitos pelo carregamento filtrado (chaves canônicas). Os que não puderem
+# ser traduzidos para SQL são aplicados em pandas após o enriquecimento.
+FILTER_KEYS: Tuple[str, ...] = (
+    "SITUACAO","CD_SITUACAO","SITUACAO_DET_TXT","CD_TIPO","TP_SETOR_TXT",
+    "CD_SETOR","CD_MUN","NM_MUN","NM_RGI","NM_RGINT",
+    "RM_NOME","AU_NOME","NOME_RM_AU","REGIAO_RM_AU","TIPO_RM_AU",
+)
+_RM_AU_KEYS = ("RM_NOME","AU_NOME","NOME_RM_AU","REGIAO_RM_AU","TIPO_RM_AU")
+_NUMERIC_SQL_TYPES = ("TINYINT","SMALLINT","INTEGER","BIGINT","HUGEINT","UTINYINT","USMALLINT","UINTEGER","UBIGINT","FLOAT","DOUBLE","DECIMAL")
+
+def _sql_in(col: str, values: Sequence, numeric: bool) -> str:
+    """Monta '"col" IN (...)' com literais adequados ao tipo físico da coluna."""
+    if not values:
+        return "FALSE"
+    if numeric:
+        lits = [str(int(v)) for v in values]
+    else:
+        lits = ["'" + str(v).replace("'", "''") + "'" for v in values]
+    return f'"{col}" IN ({", ".join(lits)})'
+
+def _rm_au_municipalities(key: str, values: Sequence, excel_path: str) -> List[str]:
+    """Municípios (CD_MUN 7 dígitos) cujo rótulo RM/AU derivado do Excel está em values."""
+    p = _P(excel_path)
     if not p.exists():
-        raise FileNotFoundError(f"Parquet não encontrado: {p}")
-    path_parquet = p.as_posix()
-    con = duckdb.connect()
-    cols_df = con.execute(f"SELECT * FROM read_parquet('{path_parquet}') LIMIT 0").fetchdf()
-    cols = cols_df.columns.tolist()
-    uf_candidates = [c for c in cols if re.fullmatch(r"(?i)(CD_UF|CODIGO_DA_UNIDADE_DA_FEDERACAO|UF_CODIGO)", str(c))]
-    uf_col = uf_candidates[0] if uf_candidates else None
+        return []
+    rm_map, au_map = _rm_au_maps(p.as_posix())
+    rm_map, au_map = rm_map or {}, au_map or {}
+    vals = {str(v) for v in values}
+    if key == "RM_NOME":
+        return sorted(m for m, n in rm_map.items() if str(n) in vals)
+    if key == "AU_NOME":
+        return sorted(m for m, n in au_map.items() if str(n) in vals)
+    muns = set(rm_map) | set(au_map)
+    if key == "TIPO_RM_AU":
+        vals = {v.upper() for v in vals}
+        return sorted(m for m in muns if ("RM" if m in rm_map else "AU") in vals)
+    # NOME_RM_AU / REGIAO_RM_AU: RM tem prioridade sobre AU
+    return sorted(m for m in muns if str(rm_map.get(m, au_map.get(m))) in vals)
+
+def _filter_values(key: str, values) -> Optional[List]:
+    """Valores de um filtro canônico normalizados (None = sem filtro); comum ao SQL e ao pandas."""
+    if values is None or (not isinstance(values, (str, int)) and len(values) == 0):
+        return None  # mesma convenção das páginas: seleção vazia = tudo
+    vals = [values] if isinstance(values, (str, int)) else list(values)
+    if key in ("CD_TIPO","CD_SITUACAO"):
+        vals = [int(v) for v in vals]
+    elif key == "CD_MUN":
+        vals = _norm_cd_mun(pd.Series(vals)).tolist()
+    elif key == "CD_SETOR":
+        vals = [str(v) for v in vals]
+    return vals
+
+def _build_filter_where(filters: Dict[str, Sequence], col_types: Dict[str, str], canon: Dict[str, str],
+                        excel_path: str) -> Tuple[List[str], Dict[str, List]]:
+    """Traduz filtros canônicos em condições SQL sobre as colunas físicas do Parquet.
+
+    Inclui derivados: SITUACAO via CD_SITUACAO/SITUACAO_DET_TXT, CD_TIPO <-> TP_SETOR_TXT,
+    CD_SITUACAO <-> SITUACAO_DET_TXT e RM/AU via lista de municípios do Excel.
+    Retorna (condições SQL, filtros residuais a aplicar em pandas).
+    """
+    phys = {v: k for k, v in canon.items()}  # canônico -> físico
+    is_num = lambda c: str(col_types.get(c, "")).upper().startswith(_NUMERIC_SQL_TYPES)
+    conds: List[str] = []
+    residual: Dict[str, List] = {}
+    for key, values in filters.items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Filtro não suportado: {key}. Use: {list(FILTER_KEYS)}")
+        vals = _filter_values(key, values)
+        if vals is None:
+            continue
+        col = phys.get(key)
+        if col is not None and key == "CD_SETOR":
+            # CD_SETOR é normalizado para o primeiro bloco de dígitos (ver _normalize_codes)
+            lits = ", ".join("'" + str(v).replace("'", "''") + "'" for v in vals)
+            conds.append(f"regexp_extract(CAST(\"{col}\" AS VARCHAR), '(\\d+)', 1) IN ({lits})")
+        elif col is not None:
+            conds.append(_sql_in(col, vals, is_num(col)))
+        elif key == "SITUACAO" and phys.get("CD_SITUACAO"):
+            c = phys["CD_SITUACAO"]
+            parts = []
+            if "Urbana" in vals:
+                parts.append(f'TRY_CAST("{c}" AS INTEGER) IN {_URBAN_CODES}')
+            if "Rural" in vals:
+                parts.append(f'TRY_CAST("{c}" AS INTEGER) NOT IN {_URBAN_CODES}')
+            conds.append("(" + " OR ".join(parts) + ")" if parts else "FALSE")
+        elif key == "SITUACAO" and phys.get("SITUACAO_DET_TXT"):
+            c = phys["SITUACAO_DET_TXT"]
+            urb = _sql_in(c, sorted(_URBAN_DET_TXT), False)
+            parts = []
+            if "Urbana" in vals:
+                parts.append(urb)
+            if "Rural" in vals:
+                parts.append(f'("{c}" IS NULL OR NOT {urb})')
+            conds.append("(" + " OR ".join(parts) + ")" if parts else "FALSE")
+        elif key == "CD_TIPO" and phys.get("TP_SETOR_TXT"):
+            conds.append(_sql_in(phys["TP_SETOR_TXT"], [TIPO_MAP[v] for v in vals if v in TIPO_MAP], False))
+        elif key == "TP_SETOR_TXT" and phys.get("CD_TIPO"):
+            invt = {v: k for k, v in TIPO_MAP.items()}
+            conds.append(_sql_in(phys["CD_TIPO"], [invt[v] for v in vals if v in invt], is_num(phys["CD_TIPO"])))
+        elif key == "CD_SITUACAO" and phys.get("SITUACAO_DET_TXT"):
+            conds.append(_sql_in(phys["SITUACAO_DET_TXT"], [SITUACAO_DET_MAP[v] for v in vals if v in SITUACAO_DET_MAP], False))
+        elif key == "SITUACAO_DET_TXT" and phys.get("CD_SITUACAO"):
+            inv = {v: k for k, v in SITUACAO_DET_MAP.items()}
+            conds.append(_sql_in(phys["CD_SITUACAO"], [inv[v] for v in vals if v in inv], is_num(phys["CD_SITUACAO"])))
+        elif key in _RM_AU_KEYS and phys.get("CD_MUN") and not any(k in phys for k in ("RM_NOME","AU_NOME")):
+            muns = _rm_au_municipalities(key, vals, excel_path)
+            c = phys["CD_MUN"]
+            conds.append(_sql_in(c, [int(m) for m in muns] if is_num(c) else muns, is_num(c)))
+        else:
+            residual[key] = vals
+    return conds, residual
+
+def _apply_filters_pandas(df: pd.DataFrame, filters: Dict[str, Sequence]) -> pd.DataFrame:
+    """Aplica filtros canônicos sobre o frame enriquecido (mesmas entradas e resultado do WHERE)."""
+    for key, values in filters.items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Filtro não suportado: {key}. Use: {list(FILTER_KEYS)}")
+        vals = _filter_values(key, values)
+        if vals is None:
+            continue
+        if key not in df.columns:
+            return df.iloc[0:0]
+        col = df[key]
+        if key in ("CD_TIPO","CD_SITUACAO"):
+            col = pd.to_numeric(col, errors="coerce")
+        elif key in ("CD_MUN","CD_SETOR"):
+            # frame compacto guarda os códigos como inteiros
+            if pd.api.types.is_numeric_dtype(col):
+                vals = pd.to_numeric(pd.Series(vals), errors="coerce").dropna().astype("int64").tolist()
+            else:
+                col = col.astype(str)
+        elif key == "TIPO_RM_AU":
+            col, vals = col.astype(str).str.upper(), [str(v).upper() for v in vals]
+        df = df[col.isin(vals)]
+    return df
+
+# Plano de tipos compactos do frame de setores (load_sp_age_sex_enriched(compact=True)).
+# Geocódigos viram inteiros de largura fixa, rótulos de baixa cardinalidade viram
+# categóricos e contagens viram uint32. Com nulos, usa o tipo anulável equivalente.
+COMPACT_INT_COLS: Dict[str, str] = {
+    "CD_SETOR": "int64", "CD_MUN": "int32", "CD_UF": "uint8",
+    "CD_SITUACAO": "uint8", "CD_TIPO": "uint8",
+}
+COMPACT_CATEGORY_COLS: Tuple[str, ...] = (
+    "NM_UF","NM_MUN","NM_RGINT","NM_RGI","RM_NOME","AU_NOME","REGIAO_RM_AU","TIPO_RM_AU","NOME_RM_AU",
+    "SITUACAO","SITUACAO_DET_TXT","TP_SETOR_TXT",
+)
+COMPACT_COUNT_DTYPE = "uint32"  # 22 colunas Sexo x faixa e V0001–V0004, V0007
+_NULLABLE_INT = {"int64": "Int64", "int32": "Int32", "uint8": "UInt8", "uint32": "UInt32"}
+
+def _compact_int(s: pd.Series, dtype: str) -> Optional[pd.Series]:
+    """Converte para o inteiro pedido; None se houver texto, frações ou estouro de faixa."""
+    num = pd.to_numeric(s, errors="coerce")
+    if num.isna().sum() > s.isna().sum():
+        return None
+    valid = num.dropna()
+    info = np.iinfo(dtype)
+    if len(valid) and (valid.min() < info.min or valid.max() > info.max):
+        return None
+    if pd.api.types.is_float_dtype(valid.dtype) and (np.mod(valid.to_numpy(dtype="float64"), 1) != 0).any():
+        return None
+    return num.astype(_NULLABLE_INT[dtype] if num.isna().any() else dtype)
+
+def compact_frame(df: pd.DataFrame, inplace: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Aplica o plano de tipos compactos e devolve (frame, relatório de memória por coluna).
+
+    Colunas que não cabem no tipo declarado ficam como estão (marcadas no relatório).
+    """
+    before = _mem_profile(df)
+    out = df if inplace else df.copy()
+    m_cols, f_cols = _pick_exact_age_cols(out.columns.tolist())
+    plan: Dict[str, str] = {c: t for c, t in COMPACT_INT_COLS.items() if c in out.columns}
+    plan.update({c: "category" for c in COMPACT_CATEGORY_COLS if c in out.columns})
+    counts = m_cols + f_cols + [v for v in ("V0001","V0002","V0003","V0004","V0007") if v in out.columns]
+    plan.update({c: COMPACT_COUNT_DTYPE for c in counts})
+    skipped = []
+    for col, dtype in plan.items():
+        if dtype == "category":
+            out[col] = out[col].astype("category")
+            continue
+        conv = _compact_int(out[col], dtype)
+        if conv is None:
+            skipped.append(col)
+        else:
+            out[col] = conv
+    return out, memory_report(before, out, skipped=skipped)
+
+def _mem_profile(df: pd.DataFrame) -> Dict[str, Tuple[str, int]]:
+    """coluna -> (dtype, bytes deep); permite medir o 'antes' sem guardar uma cópia."""
+    usage = df.memory_usage(index=False, deep=True)
+    return {c: (str(df[c].dtype), int(usage[c])) for c in df.columns}
+
+def memory_report(before, after, skipped: Sequence[str] = ()) -> pd.DataFrame:
+    """Memória (deep) por coluna antes/depois, ordenada pela economia, com linha TOTAL.
+
+    before/after: DataFrames ou perfis de _mem_profile.
+    """
+    b = before if isinstance(before, dict) else _mem_profile(before)
+    a = after if isinstance(after, dict) else _mem_profile(after)
+    cols = [c for c in a if c in b]
+    rep = pd.DataFrame({
+        "coluna": cols,
+        "dtype_antes": [b[c][0] for c in cols],
+        "dtype_depois": [a[c][0] for c in cols],
+        "bytes_antes": [b[c][1] for c in cols],
+        "bytes_depois": [a[c][1] for c in cols],
+    })
+    rep["economia_bytes"] = rep["bytes_antes"] - rep["bytes_depois"]
+    rep["ignorada"] = rep["coluna"].isin(list(skipped))
+    rep = rep.sort_values("economia_bytes", ascending=False).reset_index(drop=True)
+    total = {"coluna": "TOTAL", "dtype_antes": "", "dtype_depois": "",
+             "bytes_antes": int(rep["bytes_antes"].sum()), "bytes_depois": int(rep["bytes_depois"].sum()),
+             "economia_bytes": int(rep["economia_bytes"].sum()), "ignorada": False}
+    rep = pd.concat([rep, pd.DataFrame([total])], ignore_index=True)
+    rep["economia_pct"] = (100.0 * rep["economia_bytes"] / rep["bytes_antes"].where(rep["bytes_antes"] > 0)).round(1)
+    return rep
+
+def load_sp_age_sex_enriched(path_parquet: str, limit: Optional[int] = None, verbose: bool = False, uf_code: str = "35", excel_path: Optional[str] = None,
+                             families: Optional[Sequence[str]] = None, columns: Optional[Sequence[str]] = None,
+                             filters: Optional[Dict[str, Sequence]] = None, arrow: bool = False,
+                             compact: bool = False, cluster: bool = False) -> pd.DataFrame:
+    """Lê o Parquet (UF indicada), normaliza, decodifica e enriquece com RM/AU.
+
+    - families: famílias de COLUMN_FAMILIES a ler (None = todas as colunas, como antes)
+    - columns: colunas adicionais (nomes físicos ou canônicos) a incluir na projeção
+    - filters: dict chave canônica (FILTER_KEYS) -> valores aceitos; vira WHERE no DuckDB,
+      de modo que só os setores correspondentes são materializados
+    - arrow: busca uma tabela Arrow do DuckDB e mantém textos/inteiros em buffers Arrow
+      (pd.ArrowDtype) em toda a normalização, decodificação e merge RM/AU
+    - compact: aplica o plano de tipos compactos (compact_frame) ao final; o relatório de
+      memória por coluna fica em df.attrs["memory_report"] (lista de registros)
+    - cluster: ordena as linhas por (CD_MUN, CD_SETOR) (cluster_by_geo), exigência do
+      OffsetIndex; sem ele as linhas ficam na ordem de leitura do Parquet
+    Tempo e RSS de cada etapa ficam em df.attrs["pipeline_stats"].
+    """
+    if arrow and pa is None:
+        raise ModuleNotFoundError("Instale 'pyarrow' (pip install pyarrow) para arrow=True.")
+    q, canon, residual, excel_path = _build_load_query(path_parquet, uf_code, excel_path, families, columns, filters, limit)
+    if verbose:
+        print(q)
+    # Pipeline dono do frame: cada etapa altera df no lugar (sem cópias do frame inteiro)
+    # e registra tempo e RSS em df.attrs["pipeline_stats"].
+    stats: List[Dict] = []
+    df = _read_frame(q, arrow, stats)
+    df = _enrich_frame(df, canon, excel_path, residual, arrow=arrow, stats=stats)
+    if cluster:
+        with _stage(stats, "ordenar"):
+            df = cluster_by_geo(df)
+    report = None
+    if compact:
+        with _stage(stats, "compactar"):
+            df, report = compact_frame(df, inplace=True)
+        df.attrs["memory_report"] = report.to_dict("records")
+    df.attrs["pipeline_stats"] = stats
+    if verbose:
+        print(_format_stats(stats))
+        if report is not None:
+            print(report.to_string(index=False))
+    return df
+
+def _read_frame(q: str, arrow: bool, stats: List[Dict]) -> pd.DataFrame:
+    with _stage(stats, "leitura"):
+        with _db_cursor() as con:
+            if arrow:
+                res = con.execute(q)
+                tbl = res.to_arrow_table() if hasattr(res, "to_arrow_table") else res.fetch_arrow_table()
+                df = tbl.to_pandas(types_mapper=pd.ArrowDtype)
+                del tbl
+            else:
+                df = con.execute(q).fetchdf()
+    return df
+
+def _build_load_query(path_parquet: str, uf_code: Optional[str], excel_path: Optional[str],
+                      families: Optional[Sequence[str]], columns: Optional[Sequence[str]],
+                      filters: Optional[Dict[str, Sequence]], limit: Optional[int] = None):
+    """(SQL, nomes canônicos, filtros residuais, excel_path) do carregamento."""
+    from .schema import get_parquet_schema
+    # Nomes/tipos/canônicos vêm do registro (rodapé do Parquet, resolvido uma vez por arquivo)
+    schema = get_parquet_schema(path_parquet)
+    # Layout otimizado (docs/optimize_parquet.py): lê só a partição CD_UF=<uf>
+    source, uf_pruned = parquet_source(path_parquet, uf_code)
+    cols = list(schema.columns)
+    canon = schema.canon
+    excel_path = excel_path or "insumos/Composicao_RM_2024.xlsx"
+    conds, residual = _build_filter_where(filters or {}, schema.types, canon, excel_path)
+    if schema.uf_col and uf_code and not uf_pruned:
+        conds.insert(0, f'"{schema.uf_col}" = \'{uf_code}\'')
+    if families is not None or columns:
+        cols = _resolve_projection(cols, families or (), columns, schema=schema)
+        if not cols:
+            raise ValueError("Nenhuma coluna do Parquet corresponde às famílias/colunas pedidas.")
     sel_cols = [f'"{c}"' for c in cols]
-    where = f'WHERE "{uf_col}" = \'{uf_code}\'' if uf_col else ""
-    q = f"SELECT {', '.join(sel_cols)} FROM read_parquet('{path_parquet}') {where}"
+    where = ("WHERE " + " AND ".join(conds)) if conds else ""
+    q = f"SELECT {', '.join(sel_cols)} FROM {source} {where}"
     if limit:
         q += f" LIMIT {int(limit)}"
-    if verbose:
-        print(q)
-    df = con.execute(q).fetchdf()
-    df = _rename_by_alias(df)
-    df = _normalize_codes(df)
-    df = _ensure_decodes(df)
-    for v in [c for c in df.columns if c.startswith("V000")]:
-        if v in ("V0005","V0006"):
-            df[v] = pd.to_numeric(df[v], errors="coerce").astype("float64")
-        else:
-            df[v] = pd.to_numeric(df[v], errors="coerce")
-    df = _merge_rm_au(df, excel_path=excel_path or "insumos/Composicao_RM_2024.xlsx")
+    return q, canon, residual, excel_path
+
+def _enrich_frame(df: pd.DataFrame, canon: Dict[str, str], excel_path: str, residual: Dict[str, List],
+                  arrow: bool = False, stats: Optional[List[Dict]] = None, rm_au: bool = True) -> pd.DataFrame:
+    """Aliases, códigos, decodificações, V000x, RM/AU e filtros residuais, no lugar.
+
+    rm_au=False pula o merge RM/AU por setor (o layout estrela o faz na dimensão).
+    """
+    stats = [] if stats is None else stats
+    with _stage(stats, "aliases"):
+        df.columns = [canon.get(c, c) for c in df.columns]
+    with _stage(stats, "normalizar_codigos"):
+        _normalize_codes(df, inplace=True)
+    with _stage(stats, "decodificar"):
+        _ensure_decodes(df, inplace=True)
+    with _stage(stats, "variaveis"):
+        for v in [c for c in df.columns if c.startswith("V000")]:
+            if v in ("V0005","V0006"):
+                df[v] = pd.to_numeric(df[v], errors="coerce").astype(pd.ArrowDtype(pa.float64()) if arrow else "float64")
+            else:
+                df[v] = pd.to_numeric(df[v], errors="coerce")
+    if rm_au:
+        with _stage(stats, "rm_au"):
+            _merge_rm_au(df, excel_path=excel_path, inplace=True)
+    if residual:
+        with _stage(stats, "filtros_residuais"):
+            df = _apply_filters_pandas(df, residual).reset_index(drop=True)
     return df
 
-def wide_to_long_pyramid(df_wide: pd.DataFrame) -> pd.DataFrame:
+# --- Layout estrela: dimensão de municípios + fato só com chaves e contagens ---
+# Atributos territoriais que dependem apenas do município: ficam uma vez por CD_MUN na
+# dimensão, e não repetidos em cada setor (ou 22x no formato long).
+MUNICIPALITY_DIM_COLS: Tuple[str, ...] = (
+    "NM_MUN","CD_UF","NM_UF","NM_RGINT","NM_RGI",
+    "RM_NOME","AU_NOME","REGIAO_RM_AU","NOME_RM_AU","TIPO_RM_AU",
+)
+
+def _mun_key(s: pd.Series) -> pd.Series:
+    """CD_MUN como inteiro (int32); mantém o original se não for numérico."""
+    k = _compact_int(s, COMPACT_INT_COLS["CD_MUN"])
+    return s if k is None else k
+
+def municipality_dimension(df: pd.DataFrame) -> pd.DataFrame:
+    """Uma linha por CD_MUN com os atributos territoriais (primeiro valor não nulo)."""
+    if "CD_MUN" not in df.columns:
+        raise ValueError("Coluna CD_MUN ausente: sem chave para a dimensão de municípios.")
+    cols = [c for c in MUNICIPALITY_DIM_COLS if c in df.columns]
+    return (df[["CD_MUN"] + cols].groupby("CD_MUN", sort=True, observed=True).first()
+                                 .reset_index())
+
+def split_star(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(fato, dimensão): o fato perde os atributos de município e guarda CD_MUN inteiro."""
+    dim = municipality_dimension(df)
+    fact = df.drop(columns=[c for c in MUNICIPALITY_DIM_COLS if c in df.columns])
+    fact["CD_MUN"] = _mun_key(fact["CD_MUN"])
+    dim["CD_MUN"] = _mun_key(dim["CD_MUN"])
+    return fact, dim
+
+def join_dimension(df: pd.DataFrame, dim: pd.DataFrame, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Anexa rótulos da dimensão por CD_MUN (fato wide, long ou agregado); CD_MUN deve ter o mesmo tipo nos dois."""
+    cols = [c for c in (columns or dim.columns) if c != "CD_MUN" and c in dim.columns]
+    lookup = dim.set_index("CD_MUN")[cols]
+    keys = df["CD_MUN"].to_numpy()
+    out = df.copy()
+    for c in cols:
+        out[c] = pd.Series(lookup[c].reindex(keys).array, index=df.index)
+    return out
+
+def load_sp_age_sex_star(path_parquet: str, uf_code: str = "35", excel_path: Optional[str] = None,
+                         families: Optional[Sequence[str]] = None, columns: Optional[Sequence[str]] = None,
+                         filters: Optional[Dict[str, Sequence]] = None, arrow: bool = False,
+                         compact: bool = False, cluster: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Como load_sp_age_sex_enriched, mas devolve (fato, dimensão de municípios).
+
+    O merge RM/AU roda sobre a dimensão (uma linha por município), salvo quando há
+    filtro residual por RM/AU, que precisa dos nomes em cada setor.
+    cluster=True ordena o fato por (CD_MUN, CD_SETOR), como no carregador enriquecido.
+    """
+    if arrow and pa is None:
+        raise ModuleNotFoundError("Instale 'pyarrow' (pip install pyarrow) para arrow=True.")
+    q, canon, residual, excel_path = _build_load_query(path_parquet, uf_code, excel_path, families, columns, filters)
+    stats: List[Dict] = []
+    df = _read_frame(q, arrow, stats)
+    rm_au_rows = any(k in _RM_AU_KEYS for k in residual)
+    df = _enrich_frame(df, canon, excel_path, residual, arrow=arrow, stats=stats, rm_au=rm_au_rows)
+    if cluster:
+        with _stage(stats, "ordenar"):
+            df = cluster_by_geo(df)
+    with _stage(stats, "dimensao"):
+        dim = municipality_dimension(df)
+        if not rm_au_rows:
+            dim = _merge_rm_au(dim, excel_path=excel_path, inplace=True)
+            dim = dim[["CD_MUN"] + [c for c in MUNICIPALITY_DIM_COLS if c in dim.columns]]
+        fact = df.drop(columns=[c for c in MUNICIPALITY_DIM_COLS if c in df.columns])
+        del df
+        fact["CD_MUN"] = _mun_key(fact["CD_MUN"])
+        dim["CD_MUN"] = _mun_key(dim["CD_MUN"])
+    if compact:
+        with _stage(stats, "compactar"):
+            fact, report = compact_frame(fact, inplace=True)
+        fact.attrs["memory_report"] = report.to_dict("records")
+    fact.attrs["pipeline_stats"] = stats
+    return fact, dim
+
+# Linhas por lote no modo streaming (o DuckDB entrega em vetores de 2.048 linhas)
+STREAM_BATCH_ROWS = 65_536
+# Famílias necessárias para a pirâmide agregada em streaming
+STREAM_PYRAMID_FAMILIES: Tuple[str, ...] = ("geo", "situacao", "tipo", "idade_sexo")
+
+def _df_chunks(res, vectors: int) -> Iterator[pd.DataFrame]:
+    while True:
+        chunk = res.fetch_df_chunk(vectors)
+        if chunk is None or chunk.empty:
+            return
+        yield chunk
+
+def iter_sp_age_sex_batches(path_parquet: str, batch_rows: int = STREAM_BATCH_ROWS, uf_code: Optional[str] = "35",
+                            excel_path: Optional[str] = None, families: Optional[Sequence[str]] = None,
+                            columns: Optional[Sequence[str]] = None, filters: Optional[Dict[str, Sequence]] = None,
+                            arrow: bool = False) -> Iterator[pd.DataFrame]:
+    """Lê o Parquet em lotes e entrega cada lote já normalizado e enriquecido.
+
+    A memória fica limitada pelo tamanho do lote, não pelo número de setores.
+    uf_code=None lê todas as UFs (arquivo nacional).
+    O gerador ocupa uma vaga de duckdb.max_concurrent_queries do primeiro lote até ser
+    esgotado ou fechado: quem para no meio deve chamar close() (ou usar
+    contextlib.closing), que devolve a vaga na hora em vez de esperar a coleta.
+    """
+    if arrow and pa is None:
+        raise ModuleNotFoundError("Instale 'pyarrow' (pip install pyarrow) para arrow=True.")
+    q, canon, residual, excel_path = _build_load_query(path_parquet, uf_code, excel_path, families, columns, filters)
+    vectors = max(1, -(-int(batch_rows) // 2048))
+    with _db_cursor(dedicated=True) as con:
+        res = con.execute(q)
+        if arrow:
+            reader = res.to_arrow_reader(vectors * 2048) if hasattr(res, "to_arrow_reader") else res.fetch_record_batch(vectors * 2048)
+            chunks = (rb.to_pandas(types_mapper=pd.ArrowDtype) for rb in reader)
+        else:
+            chunks = _df_chunks(res, vectors)
+        for chunk in chunks:
+            batch = _enrich_frame(chunk, canon, excel_path, residual, arrow=arrow)
+            if len(batch):
+                yield batch
+
+def aggregate_pyramid_streaming(path_parquet: str, group_by: Sequence[str] | None = None,
+                                batch_rows: int = STREAM_BATCH_ROWS, **load_kwargs) -> pd.DataFrame:
+    """aggregate_pyramid sobre o Parquet lido em lotes, somando parciais por grupo.
+
+    Nunca materializa o frame wide completo: a cada lote, agrega e incorpora a soma
+    corrente (que tem uma linha por grupo x faixa x sexo). Mesmo resultado que
+    aggregate_pyramid(load_sp_age_sex_enriched(...), group_by).
+    """
+    group_by = list(group_by or [])
+    load_kwargs.setdefault("families", STREAM_PYRAMID_FAMILIES)
+    running: Optional[pd.DataFrame] = None
+    keys: List[str] = []
+    # closing: uma exceção na agregação devolve a vaga do DuckDB sem esperar a coleta
+    with closing(iter_sp_age_sex_batches(path_parquet, batch_rows=batch_rows, **load_kwargs)) as batches:
+        for batch in batches:
+            part = aggregate_pyramid(batch, group_by)
+            keys = [c for c in group_by if c in part.columns] + ["idade_grupo","sexo"]
+            running = part if running is None else _fold_partials(running, part, keys)
+    if running is None:
+        return pd.DataFrame(columns=group_by + ["idade_grupo","sexo","valor"])
+    return running.sort_values(keys).reset_index(drop=True)
+
+def _fold_partials(running: pd.DataFrame, part: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    both = pd.concat([running, part], ignore_index=True)
+    both["idade_grupo"] = pd.Categorical(both["idade_grupo"], categories=AGE_GROUPS, ordered=True)
+    return both.groupby(keys, dropna=False, as_index=False, observed=True)["valor"].sum()
+
+def load_sp_age_sex_filtered(path_parquet: str, filters: Dict[str, Sequence], **kwargs) -> pd.DataFrame:
+    """Carregamento filtrado: atalho para load_sp_age_sex_enriched(..., filters=filters).
+
+    Ex.: {"SITUACAO": ["Urbana"], "CD_TIPO": [0, 1], "CD_MUN": ["3550308"]}
+    """
+    return load_sp_age_sex_enriched(path_parquet, filters=filters, **kwargs)
+
+# Chaves geográficas/contexto preservadas no formato long (quando existirem)
+_PYRAMID_ID_VARS = [
+    "CD_SETOR","CD_MUN","NM_MUN","CD_UF","NM_UF",
+    "CD_SITUACAO","SITUACAO","SITUACAO_DET_TXT","CD_TIPO","TP_SETOR_TXT","V0001",
+    "RM_NOME","AU_NOME","NM_RGINT","NM_RGI",
+    "NOME_RM_AU","TIPO_RM_AU","REGIAO_RM_AU",
+]
+_PYRAMID_KEEP = [
+    "CD_SETOR","CD_MUN","NM_MUN","CD_UF","NM_UF","CD_SITUACAO","SITUACAO","SITUACAO_DET_TXT","CD_TIPO","TP_SETOR_TXT","V0001",
+    "RM_NOME","AU_NOME","NM_RGINT","NM_RGI","idade_grupo","sexo","valor",
+]
+PYRAMID_ENGINES = ("pandas", "duckdb")
+
+@lru_cache(maxsize=256)
+def _parse_age_sex_key(k: str) -> Tuple[str, str]:
+    """Separa 'Sexo masculino, 0 a 4 anos' em (sexo, faixa). Feito uma vez por nome de coluna."""
+    s = str(k).strip()
+    if s.lower().startswith("sexo masculino"):
+        sexo = "Masculino"; idade = s.split(",",1)[1].strip()
+    elif s.lower().startswith("sexo feminino"):
+        sexo = "Feminino"; idade = s.split(",",1)[1].strip()
+    else:
+        sexo = "Total"; idade = s
+    idade = re.sub(r"_\d+$","", idade).strip()
+    return sexo, idade
+
+def _pyramid_inputs(df_wide: pd.DataFrame, star: bool = False) -> Tuple[pd.DataFrame, List[str], List[str]]:
+    """Retorna (df_wide, id_vars, val_cols) para o reshape da pirâmide."""
     if "SITUACAO" not in df_wide.columns and "CD_SITUACAO" in df_wide.columns:
         df_wide = df_wide.copy()
         df_wide["SITUACAO"] = df_wide["CD_SITUACAO"].apply(_derive_macro_from_cd)
@@ -380,36 +944,139 @@ def wide_to_long_pyramid(df_wide: pd.DataFrame) -> pd.DataFrame:
     val_cols = m_cols + f_cols
     if not val_cols:
         raise ValueError("As colunas etárias esperadas (11 por sexo) não foram encontradas.")
-    geo_keys = [
-        "CD_SETOR","CD_MUN","NM_MUN","CD_UF","NM_UF",
-        "CD_SITUACAO","SITUACAO","SITUACAO_DET_TXT","CD_TIPO","TP_SETOR_TXT","V0001",
-        "RM_NOME","AU_NOME","NM_RGINT","NM_RGI",
-        "NOME_RM_AU","TIPO_RM_AU","REGIAO_RM_AU",
-    ]
-    id_vars = [c for c in geo_keys if c in df_wide.columns]
+    id_vars = [c for c in _PYRAMID_ID_VARS if c in df_wide.columns
+               and not (star and c in MUNICIPALITY_DIM_COLS)]
+    return df_wide, id_vars, val_cols
+
+def _count_dtype(df_wide: pd.DataFrame, val_cols: Sequence[str]) -> str:
+    """uint32 quando o frame wide já vem compactado (compact_frame); senão int64."""
+    return "uint32" if all(str(df_wide[c].dtype) in ("uint32", "UInt32") for c in val_cols) else "int64"
+
+def _age_key_table(val_cols: Sequence[str]) -> pd.DataFrame:
+    """Tabela (chave, ord, sexo, idade_grupo, idade_ord) com uma linha por coluna etária."""
+    rows = []
+    for i, c in enumerate(val_cols):
+        sexo, idade = _parse_age_sex_key(c)
+        rows.append((c, i, sexo, idade if idade in AGE_GROUPS else None,
+                     AGE_GROUPS.index(idade) if idade in AGE_GROUPS else None))
+    return pd.DataFrame(rows, columns=["chave","ord","sexo","idade_grupo","idade_ord"])
+
+def _q(c: str) -> str:
+    return '"' + str(c).replace('"', '""') + '"'
+
+def _unpivot_sql(id_vars: Sequence[str], val_cols: Sequence[str]) -> str:
+    """SQL do UNPIVOT (relação 'w' + tabela de chaves 'k'), com coerção numérica de valor."""
+    ids = ", ".join(_q(c) for c in id_vars)
+    casts = ", ".join(f"TRY_CAST({_q(c)} AS DOUBLE) AS {_q(c)}" for c in val_cols)
+    src = f"SELECT {ids + ', ' if ids else ''}__rid, {casts} FROM w"
+    return (
+        f"SELECT u.* EXCLUDE (chave, valor), k.ord, k.sexo, k.idade_grupo, k.idade_ord, "
+        f"COALESCE(CAST(trunc(u.valor) AS BIGINT), 0) AS valor "
+        f"FROM ({src}) UNPIVOT INCLUDE NULLS (valor FOR chave IN ({', '.join(_q(c) for c in val_cols)})) u "
+        f"JOIN k ON u.chave = k.chave"
+    )
+
+def _restore_dtypes(out: pd.DataFrame, src: pd.DataFrame, cols: Sequence[str]) -> pd.DataFrame:
+    for c in cols:
+        try:
+            out[c] = out[c].astype(src[c].dtype)
+        except Exception:
+            pass
+    return out
+
+def _wide_to_long_duckdb(df_wide: pd.DataFrame, id_vars: List[str], val_cols: List[str]) -> pd.DataFrame:
+    if duckdb is None:
+        raise ModuleNotFoundError("Instale 'duckdb' (pip install duckdb).")
+    # Só valores e índice de linha passam pelo DuckDB; as chaves são reunidas por posição
+    # (take), evitando o vai-e-vem de strings entre DuckDB e pandas.
+    keys = _age_key_table(val_cols)
+    views = {"w": df_wide[val_cols].assign(__rid=range(len(df_wide))), "k": keys}
+    with _db_cursor(register=views) as con:
+        res = con.execute(
+            f"SELECT __rid, ord, valor FROM ({_unpivot_sql([], val_cols)}) ORDER BY ord, __rid"
+        ).fetchnumpy()
+    long = df_wide[id_vars].take(res["__rid"]).reset_index(drop=True)
+    ords = res["ord"]
+    long["idade_grupo"] = pd.Categorical(keys["idade_grupo"].to_numpy()[ords], categories=AGE_GROUPS, ordered=True)
+    long["sexo"] = keys["sexo"].to_numpy()[ords]
+    long["valor"] = res["valor"].astype(_count_dtype(df_wide, val_cols))
+    return long[[c for c in _PYRAMID_KEEP if c in long.columns]]
+
+def wide_to_long_pyramid(df_wide: pd.DataFrame, engine: str = "pandas", star: bool = False) -> pd.DataFrame:
+    """Converte o frame wide (22 colunas Sexo x faixa) para o formato long da pirâmide.
+
+    - engine="pandas": melt em memória
+    - engine="duckdb": UNPIVOT no DuckDB (mesmo resultado, menor pico de memória)
+    - star=True: só chaves e contagens; rótulos de município via join_dimension
+    Em ambos, o par sexo/faixa é extraído uma vez por nome de coluna, não por linha.
+    """
+    if engine not in PYRAMID_ENGINES:
+        raise ValueError(f"engine inválido: {engine}. Use: {PYRAMID_ENGINES}")
+    df_wide, id_vars, val_cols = _pyramid_inputs(df_wide, star=star)
+    if engine == "duckdb":
+        return _wide_to_long_duckdb(df_wide, id_vars, val_cols)
+    long = _melt_pyramid(df_wide, id_vars, val_cols)
+    return long[[c for c in _PYRAMID_KEEP if c in long.columns]]
+
+def _melt_pyramid(df_wide: pd.DataFrame, id_vars: List[str], val_cols: List[str]) -> pd.DataFrame:
+    """melt das colunas etárias mantendo id_vars + sexo, idade_grupo e valor."""
     long = df_wide.melt(id_vars=id_vars, value_vars=val_cols, var_name="chave", value_name="valor")
-    long["valor"] = pd.to_numeric(long["valor"], errors="coerce").fillna(0).astype("int64")
-    def parse_key(k: str):
-        s = str(k).strip()
-        if s.lower().startswith("sexo masculino"):
-            sexo = "Masculino"; idade = s.split(",",1)[1].strip()
-        elif s.lower().startswith("sexo feminino"):
-            sexo = "Feminino"; idade = s.split(",",1)[1].strip()
-        else:
-            sexo = "Total"; idade = s
-        idade = re.sub(r"_\d+$","", idade).strip()
-        return sexo, idade
-    parsed = long["chave"].apply(parse_key)
-    long["sexo"] = parsed.map(lambda t: t[0])
-    long["idade_grupo"] = parsed.map(lambda t: t[1])
-    long["idade_grupo"] = pd.Categorical(long["idade_grupo"], categories=AGE_GROUPS, ordered=True)
-    keep = [c for c in ["CD_SETOR","CD_MUN","NM_MUN","CD_UF","NM_UF","CD_SITUACAO","SITUACAO","SITUACAO_DET_TXT","CD_TIPO","TP_SETOR_TXT","V0001","RM_NOME","AU_NOME","NM_RGINT","NM_RGI","idade_grupo","sexo","valor"] if c in long.columns]
-    return long[keep]
-
-def aggregate_pyramid(df: pd.DataFrame, group_by: Sequence[str] | None = None) -> pd.DataFrame:
+    long["valor"] = pd.to_numeric(long["valor"], errors="coerce").fillna(0).astype(_count_dtype(df_wide, val_cols))
+    # melt empilha coluna a coluna: cada bloco de len(df_wide) linhas vem de uma chave
+    n = len(df_wide)
+    parsed = [_parse_age_sex_key(c) for c in val_cols]
+    long["sexo"] = pd.Series([p[0] for p in parsed], dtype=object).repeat(n).to_numpy()
+    long["idade_grupo"] = pd.Categorical(pd.Series([p[1] for p in parsed], dtype=object).repeat(n).to_numpy(),
+                                         categories=AGE_GROUPS, ordered=True)
+    return long.drop(columns="chave")
+
+def _wide_group_keys(df_wide: pd.DataFrame, group_by: Sequence[str], val_cols: Sequence[str]) -> List[str]:
+    # chaves de agrupamento presentes no frame wide (qualquer coluna que não seja contagem etária)
+    vals = set(val_cols)
+    return [c for c in group_by if c in df_wide.columns and c not in vals]
+
+def _aggregate_pyramid_duckdb(df: pd.DataFrame, group_by: List[str]) -> pd.DataFrame:
+    """GROUP BY (group_by, idade_grupo, sexo) no DuckDB; aceita frame wide ou long."""
+    if duckdb is None:
+        raise ModuleNotFoundError("Instale 'duckdb' (pip install duckdb).")
+    if {"idade_grupo","sexo","valor"} <= set(df.columns):
+        keys = [c for c in group_by if c in df.columns]
+        src_df = df
+        w = df[keys + ["sexo","valor"]].assign(idade_grupo=df["idade_grupo"].astype(object))
+        views = {"w": w, "ages": pd.DataFrame({"idade_grupo": AGE_GROUPS, "idade_ord": range(len(AGE_GROUPS))})}
+        src = ("SELECT w.* EXCLUDE (idade_grupo), a.idade_grupo, a.idade_ord, "
+               "COALESCE(TRY_CAST(w.valor AS BIGINT), 0) AS valor2 FROM w LEFT JOIN ages a ON w.idade_grupo = a.idade_grupo")
+        val = "valor2"
+    else:
+        src_df, _, val_cols = _pyramid_inputs(df)
+        keys = _wide_group_keys(src_df, group_by, val_cols)
+        w = src_df[keys + val_cols].assign(__rid=range(len(src_df)))
+        views = {"w": w, "k": _age_key_table(val_cols)}
+        src = _unpivot_sql(keys, val_cols)
+        val = "valor"
+    gcols = ", ".join(_q(c) for c in keys)
+    order = ", ".join([f"{_q(c)} NULLS LAST" for c in keys] + ["idade_ord NULLS LAST", "sexo NULLS LAST"])
+    with _db_cursor(register=views) as con:
+        out = con.execute(
+            f"SELECT {gcols + ', ' if gcols else ''}idade_grupo, sexo, CAST(SUM({val}) AS BIGINT) AS valor "
+            f"FROM ({src}) GROUP BY {gcols + ', ' if gcols else ''}idade_grupo, idade_ord, sexo ORDER BY {order}"
+        ).fetchdf()
+    out = _restore_dtypes(out, src_df, keys)
+    out["idade_grupo"] = pd.Categorical(out["idade_grupo"], categories=AGE_GROUPS, ordered=True)
+    return out[keys + ["idade_grupo","sexo","valor"]]
+
+def aggregate_pyramid(df: pd.DataFrame, group_by: Sequence[str] | None = None, engine: str = "pandas") -> pd.DataFrame:
     group_by = list(group_by or [])
-    need_long = not ({"idade_grupo","sexo","valor"} <= set(df.columns))
-    df_long = wide_to_long_pyramid(df) if need_long else df.copy()
+    if engine not in PYRAMID_ENGINES:
+        raise ValueError(f"engine inválido: {engine}. Use: {PYRAMID_ENGINES}")
+    if engine == "duckdb":
+        return _aggregate_pyramid_duckdb(df, group_by)
+    if {"idade_grupo","sexo","valor"} <= set(df.columns):
+        df_long = df.copy()
+    else:
+        # frame wide: o melt leva só as chaves pedidas (as mesmas do UNPIVOT no DuckDB)
+        src_df, _, val_cols = _pyramid_inputs(df)
+        df_long = _melt_pyramid(src_df, _wide_group_keys(src_df, group_by, val_cols), val_cols)
     if "idade_grupo" in df_long.columns:
         df_long["idade_grupo"] = pd.Categorical(df_long["idade_grupo"], categories=AGE_GROUPS, ordered=True)
     keys = [c for c in group_by if c in df_long.columns] + ["idade_grupo","sexo"]
@@ -419,11 +1086,38 @@ def aggregate_pyramid(df: pd.DataFrame, group_by: Sequence[str] | None = None) -
     return out
 
 # --- Aliases em PT-BR (não quebram compatibilidade) ---
-def carregar_sp_idade_sexo_enriquecido(path_parquet: str, limite: Optional[int] = None, detalhar: bool = False, uf: str = "35", caminho_excel: Optional[str] = None) -> pd.DataFrame:
-    return load_sp_age_sex_enriched(path_parquet, limit=limite, verbose=detalhar, uf_code=uf, excel_path=caminho_excel)
+def carregar_sp_idade_sexo_enriquecido(path_parquet: str, limite: Optional[int] = None, detalhar: bool = False, uf: str = "35", caminho_excel: Optional[str] = None,
+                                       familias: Optional[Sequence[str]] = None, colunas: Optional[Sequence[str]] = None,
+                                       filtros: Optional[Dict[str, Sequence]] = None, arrow: bool = False,
+                                       compactar: bool = False, agrupar_geo: bool = False) -> pd.DataFrame:
+    return load_sp_age_sex_enriched(path_parquet, limit=limite, verbose=detalhar, uf_code=uf, excel_path=caminho_excel,
+                                    families=familias, columns=colunas, filters=filtros, arrow=arrow, compact=compactar,
+                                    cluster=agrupar_geo)
+
+def carregar_sp_idade_sexo_filtrado(path_parquet: str, filtros: Dict[str, Sequence], **kwargs) -> pd.DataFrame:
+    return load_sp_age_sex_filtered(path_parquet, filters=filtros, **kwargs)
+
+def compactar_tipos(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return compact_frame(df)
+
+def largura_para_longo_piramide(df_largo: pd.DataFrame, motor: str = "pandas", estrela: bool = False) -> pd.DataFrame:
+    return wide_to_long_pyramid(df_largo, engine=motor, star=estrela)
+
+def agregar_piramide(df: pd.DataFrame, agrupar_por: Sequence[str] | None = None, motor: str = "pandas") -> pd.DataFrame:
+    return aggregate_pyramid(df, group_by=agrupar_por, engine=motor)
+
+def dimensao_municipios(df: pd.DataFrame) -> pd.DataFrame:
+    return municipality_dimension(df)
+
+def separar_estrela(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return split_star(df)
 
-def largura_para_longo_piramide(df_largo: pd.DataFrame) -> pd.DataFrame:
-    return wide_to_long_pyramid(df_largo)
+def juntar_dimensao(df: pd.DataFrame, dim: pd.DataFrame, colunas: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    return join_dimension(df, dim, columns=colunas)
 
-def agregar_piramide(df: pd.DataFrame, agrupar_por: Sequence[str] | None = None) -> pd.DataFrame:
-    return aggregate_pyramid(df, group_by=agrupar_por)
+def carregar_sp_idade_sexo_estrela(path_parquet: str, uf: str = "35", caminho_excel: Optional[str] = None,
+                                   familias: Optional[Sequence[str]] = None, colunas: Optional[Sequence[str]] = None,
+                                   filtros: Optional[Dict[str, Sequence]] = None, arrow: bool = False,
+                                   compactar: bool = False, agrupar_geo: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return load_sp_age_sex_star(path_parquet, uf_code=uf, excel_path=caminho_excel, families=familias,
+                                columns=colunas, filters=filtros, arrow=arrow, compact=compactar, cluster=agrupar_geo)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import re
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+for p in (ROOT / "src", ROOT):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+EXCEL_RM_AU = str(ROOT / "insumos" / "Composicao_RM_2024.xlsx")
+# SP: sem RM/AU, duas RMs, duas AUs e a capital; RJ fica fora da UF 35
+MUNICIPIOS = ("3500105", "3500204", "3500600", "3503000", "3508207", "3550308", "3300100", "3300209")
+TIPOS = ("Não especial", "Favela e Comunidade Urbana", "Quartel e base militar", "Unidade prisional")
+
+
+def _age_columns() -> list:
+    cm = pd.read_csv(ROOT / "docs" / "columns_map.csv", encoding="utf-8-sig")
+    return [c for c in cm["parquet_column"] if re.fullmatch(r"Sexo (masculino|feminino), [^,]*anos[^,]*", c)]
+
+
+def make_wide_parquet(path: Path, per_mun: int = 12, seed: int = 0) -> Path:
+    """Parquet sintético com as colunas físicas que o carregador usa (nomes do columns_map)."""
+    import duckdb
+
+    rng = np.random.default_rng(seed)
+    n = len(MUNICIPIOS) * per_mun
+    cd_mun = np.repeat(MUNICIPIOS, per_mun)
+    seq = np.tile(np.arange(per_mun), len(MUNICIPIOS))
+    df = pd.DataFrame({
+        # alguns setores com sufixo (normalizados para o bloco de dígitos)
+        "Geocódigo de Setor Censitário": [f"{m}{s:08d}P" if s % 5 == 0 else f"{m}{s:08d}" for m, s in zip(cd_mun, seq)],
+        "Código do Município": cd_mun,
+        "Nome do Município": [f"MUNICIPIO {m}" for m in cd_mun],
+        "Código da Unidade da Federação": [m[:2] for m in cd_mun],
+        "Nome da Unidade da Federação": ["São Paulo" if m.startswith("35") else "Rio de Janeiro" for m in cd_mun],
+        "CD_SIT": rng.choice(["1", "2", "3", "5", "6", "7", "8"], n),
+        "Tipo do Setor Censitário": rng.choice(TIPOS, n, p=[.6, .2, .1, .1]),
+        "Nome da Região Geográfica Intermediária": [f"RGINT {int(m[4:6]) % 3}" for m in cd_mun],
+        "Nome da Região Geográfica Imediata": [f"RGI {int(m[3:7]) % 5}" for m in cd_mun],
+    })
+    df["SITUACAO"] = np.where(df["CD_SIT"].astype(int) <= 3, "Urbana", "Rural")
+    age = _age_columns()
+    for c in age:
+        df[c] = rng.integers(0, 40, n).astype("int64")
+    df["v0001"] = df[age].sum(axis=1)
+    # células anonimizadas
+    df.loc[df.index[::7], age[0]] = None
+    con = duckdb.connect()
+    con.register("df", df)
+    con.execute(f"COPY df TO '{path.as_posix()}' (FORMAT PARQUET)")
+    con.close()
+    return path
+
+
+@pytest.fixture(scope="session")
+def wide_parquet(tmp_path_factory) -> str:
+    return str(make_wide_parquet(tmp_path_factory.mktemp("censo") / "base.parquet"))
+
+
+@pytest.fixture(scope="session")
+def wide(wide_parquet) -> pd.DataFrame:
+    """Base enriquecida do fixture, na ordem agrupada das páginas que montam o OffsetIndex."""
+    from censo_app.transform import load_sp_age_sex_enriched
+    return load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, cluster=True)
+
+
+def ref_pyramid(df_wide: pd.DataFrame) -> np.ndarray:
+    """Pirâmide (11, 2) de referência: melt + groupby do pandas."""
+    from censo_app.tensor import SEXES
+    from censo_app.transform import AGE_GROUPS, aggregate_pyramid
+    agg = aggregate_pyramid(df_wide)
+    pv = agg.pivot_table(index="idade_grupo", columns="sexo", values="valor", aggfunc="sum", observed=False)
+    return pv.reindex(index=list(AGE_GROUPS), columns=list(SEXES)).fillna(0).to_numpy(dtype=np.uint64)
+
+
+def sorted_frame(df: pd.DataFrame, keys) -> pd.DataFrame:
+    return df.sort_values(list(keys)).reset_index(drop=True)
+
+
+def filter_mask(df: pd.DataFrame, situacao=None, tipos=None) -> pd.Series:
+    """Máscara pandas de Situação/Tipo (None = sem filtro)."""
+    m = pd.Series(True, index=df.index)
+    if situacao is not None:
+        m &= df["SITUACAO"].isin(situacao)
+    if tipos is not None:
+        m &= df["CD_TIPO"].isin(tipos)
+    return m
+
+
+# Sequência de trocas de filtro (Situação, Tipo), incluindo seleção vazia e volta ao início
+TOGGLES = [
+    (None, None),
+    (["Urbana"], None),
+    (["Urbana"], [0]),
+    (["Urbana", "Rural"], [0, 1]),
+    (["Rural"], [1, 2, 3]),
+    ([], None),
+    (None, [3]),
+    (None, None),
+]
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.transform import aggregate_pyramid, load_sp_age_sex_enriched
+
+from conftest import EXCEL_RM_AU, sorted_frame
+
+pytest.importorskip("pyarrow")
+
+
+def _plain(df: pd.DataFrame) -> pd.DataFrame:
+    """Valores como object, nulos como None: compara o conteúdo sem olhar o backend."""
+    return pd.DataFrame({c: df[c].astype(object).where(df[c].notna(), None) for c in df.columns})
+
+
+@pytest.mark.parametrize("filters", [None, {"SITUACAO": ["Urbana"]}, {"NOME_RM_AU": ["Região Metropolitana de São Paulo"]}])
+def test_arrow_load_matches_numpy(wide_parquet, filters):
+    ref = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, filters=filters)
+    got = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, filters=filters, arrow=True)
+    assert list(got.columns) == list(ref.columns) and len(got) > 0
+    assert all(isinstance(t, pd.ArrowDtype) or str(t).endswith("[pyarrow]") for t in got.dtypes)
+    pd.testing.assert_frame_equal(_plain(sorted_frame(got, ["CD_SETOR"])), _plain(sorted_frame(ref, ["CD_SETOR"])),
+                                  check_dtype=False)
+
+
+def test_arrow_pyramid_matches_numpy(wide_parquet):
+    ref = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU)
+    got = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, arrow=True)
+    keys = ["NOME_RM_AU", "idade_grupo", "sexo"]
+    a = sorted_frame(aggregate_pyramid(got, ["NOME_RM_AU"]), keys)
+    b = sorted_frame(aggregate_pyramid(ref, ["NOME_RM_AU"]), keys)
+    pd.testing.assert_frame_equal(_plain(a), _plain(b), check_dtype=False)
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from censo_app.bitmap import BitmapIndex
+
+
+def test_bitmap_select_matches_isin(wide):
+    idx = BitmapIndex.from_frame(wide)
+    for filters in ({}, {"SITUACAO": ["Urbana"]}, {"SITUACAO": ["Rural"], "CD_TIPO": [0, 2]},
+                    {"NOME_RM_AU": [wide["NOME_RM_AU"].dropna().iloc[0]], "CD_TIPO": [0]},
+                    {"NM_RGI": ["nao existe"]}, {"CD_TIPO": []}):
+        bits = idx.select(**filters)
+        ref = pd.Series(True, index=wide.index)
+        for col, vals in filters.items():
+            if vals:
+                ref &= wide[col].isin(vals)
+        np.testing.assert_array_equal(idx.mask(bits), ref.to_numpy())
+        np.testing.assert_array_equal(idx.positions(bits), np.flatnonzero(ref.to_numpy()))
+        assert idx.count(bits) == int(ref.sum())
+        assert set(idx.present("NM_RGI", bits)) == set(wide.loc[ref, "NM_RGI"].dropna())
+
+
+def test_bitmap_rm_au_pair(wide):
+    idx = BitmapIndex.from_frame(wide)
+    rec = wide.dropna(subset=["NOME_RM_AU"]).iloc[0]
+    bits = idx.select(RM_AU=[(str(rec["TIPO_RM_AU"]).upper(), rec["NOME_RM_AU"])])
+    ref = wide["TIPO_RM_AU"].astype(str).str.upper().eq(str(rec["TIPO_RM_AU"]).upper()) & wide["NOME_RM_AU"].eq(rec["NOME_RM_AU"])
+    np.testing.assert_array_equal(idx.mask(bits), ref.to_numpy())
+
+
+def test_select_within_narrows(wide):
+    idx = BitmapIndex.from_frame(wide)
+    urb = idx.select(SITUACAO=["Urbana"])
+    both = idx.select(urb, CD_TIPO=[0])
+    ref = wide["SITUACAO"].eq("Urbana") & wide["CD_TIPO"].eq(0)
+    np.testing.assert_array_equal(idx.mask(both), ref.to_numpy())
+    # select não altera o bitmap de entrada
+    np.testing.assert_array_equal(idx.mask(urb), wide["SITUACAO"].eq("Urbana").to_numpy())
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.clustered import OffsetIndex, cluster_by_geo
+from censo_app.transform import load_sp_age_sex_enriched
+
+from conftest import EXCEL_RM_AU
+
+
+def test_cluster_is_opt_in(wide_parquet, wide):
+    plain = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU)
+    assert "ordenar" not in [s["etapa"] for s in plain.attrs["pipeline_stats"]]
+    assert "ordenar" in [s["etapa"] for s in wide.attrs["pipeline_stats"]]
+    pd.testing.assert_frame_equal(cluster_by_geo(plain), wide)
+
+
+def test_offset_take_matches_boolean_filter(wide):
+    shuffled = wide.sample(frac=1.0, random_state=0).reset_index(drop=True)
+    with pytest.raises(ValueError):
+        OffsetIndex.from_frame(shuffled)
+    df = cluster_by_geo(shuffled)
+    off = OffsetIndex.from_frame(df)
+    mask = df["SITUACAO"].eq("Urbana").to_numpy()
+    for mun in df["CD_MUN"].unique():
+        pd.testing.assert_frame_equal(off.take(df, "CD_MUN", mun), df[df["CD_MUN"].eq(mun)])
+        pd.testing.assert_frame_equal(off.take(df, "CD_MUN", mun, mask), df[df["CD_MUN"].eq(mun) & mask])
+    muns = ["3550308", "3500105", "9999999"]
+    pd.testing.assert_frame_equal(off.take_many(df, "CD_MUN", muns, mask), df[df["CD_MUN"].isin(muns) & mask])
+    setor = df["CD_SETOR"].iloc[5]
+    pd.testing.assert_frame_equal(off.take(df, "CD_SETOR", setor), df[df["CD_SETOR"].eq(setor)])
+    assert off.range("CD_MUN", "9999999") == (0, 0)
+    assert off.take_many(df, "CD_MUN", ["9999999"]).empty
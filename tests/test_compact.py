@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from censo_app.transform import (
+    COMPACT_COUNT_DTYPE,
+    COMPACT_INT_COLS,
+    aggregate_pyramid,
+    compact_frame,
+    load_sp_age_sex_enriched,
+    memory_report,
+)
+
+from conftest import EXCEL_RM_AU
+
+
+def _plain(s: pd.Series) -> pd.Series:
+    """Valores como object (números inteiros como int), nulos como None."""
+    def conv(v):
+        if pd.isna(v):
+            return None
+        if isinstance(v, (int, float, np.number)) and float(v).is_integer():
+            return int(v)
+        return v
+    return pd.Series([conv(v) for v in s.astype(object)], index=s.index, dtype=object)
+
+
+def test_compact_frame_types_and_values(wide):
+    out, rep = compact_frame(wide)
+    assert out is not wide and str(wide["SITUACAO"].dtype) != "category"
+    assert out["SITUACAO"].dtype == "category" and out["NM_RGI"].dtype == "category"
+    assert str(out["Sexo feminino, 5 a 9 anos"].dtype) == COMPACT_COUNT_DTYPE
+    # coluna com células anonimizadas vira inteiro anulável
+    assert str(out["Sexo masculino, 0 a 4 anos"].dtype) == "UInt32"
+    for c in wide.columns:
+        # geocódigos viram inteiros: compara com a versão numérica do original
+        ref = pd.to_numeric(wide[c]) if c in COMPACT_INT_COLS else wide[c]
+        pd.testing.assert_series_equal(_plain(out[c]), _plain(ref), check_names=False)
+    pd.testing.assert_frame_equal(aggregate_pyramid(out), aggregate_pyramid(wide), check_dtype=False)
+    total = rep.iloc[-1]
+    assert total["coluna"] == "TOTAL" and total["bytes_depois"] < total["bytes_antes"]
+    assert total["economia_bytes"] == rep["economia_bytes"].iloc[:-1].sum()
+    assert not rep["ignorada"].any()
+    assert rep["economia_bytes"].iloc[:-1].is_monotonic_decreasing
+
+
+def test_compact_skips_columns_that_do_not_fit():
+    df = pd.DataFrame({"V0001": [1, 2**40], "CD_TIPO": ["0", "x"], "V0002": [1.0, 2.5],
+                       "SITUACAO": ["Urbana", "Rural"]})
+    out, rep = compact_frame(df)
+    for c in ("V0001", "CD_TIPO", "V0002"):
+        pd.testing.assert_series_equal(out[c], df[c])
+    assert set(rep.loc[rep["ignorada"], "coluna"]) == {"V0001", "CD_TIPO", "V0002"}
+    assert out["SITUACAO"].dtype == "category"
+
+
+def test_compact_inplace_reuses_frame():
+    df = pd.DataFrame({"V0001": np.arange(4, dtype="int64")})
+    out, _ = compact_frame(df, inplace=True)
+    assert out is df and str(df["V0001"].dtype) == COMPACT_COUNT_DTYPE
+
+
+def test_memory_report_accepts_profiles(wide):
+    rep = memory_report(wide, wide)
+    assert (rep["economia_bytes"] == 0).all() and rep["economia_pct"].iloc[-1] == 0
+
+
+def test_load_compact_attaches_report(wide_parquet):
+    df = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, compact=True)
+    ref = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU)
+    rep = pd.DataFrame(df.attrs["memory_report"])
+    assert rep["coluna"].iloc[-1] == "TOTAL" and set(rep["coluna"].iloc[:-1]) == set(df.columns)
+    assert "compactar" in [s["etapa"] for s in df.attrs["pipeline_stats"]]
+    assert df.memory_usage(deep=True).sum() < ref.memory_usage(deep=True).sum()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from censo_app.comparators import ComparatorEngine
+from censo_app.cube import ESTADO
+from censo_app.shared import SharedDataset
+
+from conftest import TOGGLES, filter_mask, ref_pyramid
+
+
+@pytest.fixture(scope="module")
+def shared(wide):
+    return SharedDataset.from_wide(wide)
+
+
+def _node_rows(sectors: pd.DataFrame, key) -> pd.Series:
+    level, value = key
+    if level == ESTADO:
+        return pd.Series(True, index=sectors.index)
+    if level == "RM_AU":
+        return sectors["TIPO_RM_AU"].astype(str).str.upper().eq(value[0]) & sectors["NOME_RM_AU"].eq(value[1])
+    return sectors[level].eq(value)
+
+
+@pytest.mark.parametrize("cd_mun", ["3500105", "3503000", "3550308"])
+def test_comparators_match_pandas(wide, shared, cd_mun):
+    eng = ComparatorEngine(shared.tensor, shared.cube, shared.sectors)
+    comps = eng.candidates(cd_mun, include_municipality=True)
+    assert comps[0].key == ("CD_MUN", cd_mun)
+    assert comps[-1].key == (ESTADO, None)
+    assert eng.candidates(cd_mun) == comps[1:]
+    levels = [c.key[0] for c in comps]
+    assert ("RM_AU" in levels) == wide.loc[wide["CD_MUN"].eq(cd_mun), "NOME_RM_AU"].notna().any()
+    restrict = shared.sectors["SITUACAO"].eq("Urbana").to_numpy()
+    for situacao, tipos in TOGGLES[:5]:
+        got = eng.pyramids(comps, situacao, tipos)
+        cut = eng.pyramids(comps, situacao, tipos, restrict=restrict, restrict_key="urbana")
+        for c in comps:
+            rows = _node_rows(shared.sectors, c.key).to_numpy() & filter_mask(wide, situacao, tipos).to_numpy()
+            np.testing.assert_array_equal(got[c.key], ref_pyramid(wide[rows]))
+            np.testing.assert_array_equal(cut[c.key], ref_pyramid(wide[rows & restrict]))
+
+
+def test_comparator_memo_reuses_pyramids(shared):
+    comps = ComparatorEngine(shared.tensor, shared.cube, shared.sectors).candidates("3550308", include_municipality=True)
+    eng = ComparatorEngine(shared.tensor, shared.cube, shared.sectors, max_entries=len(comps))
+    first = eng.pyramids(comps, ["Urbana"], None)
+    again = eng.pyramids(comps[:2], ["Urbana"], None)
+    assert all(again[c.key] is first[c.key] for c in comps[:2])
+    assert not first[comps[0].key].flags.writeable
+    # filtros diferentes não compartilham resultado
+    other = eng.pyramids(comps[:1], ["Rural"], None)
+    assert other[comps[0].key] is not first[comps[0].key]
+    assert len(eng._memo) == len(comps)
+    # despejo LRU: o mais antigo (comps[2]) saiu, os reusados ficaram
+    assert (comps[2].key, (("Urbana",), None, None)) not in eng._memo
+    assert (comps[0].key, (("Urbana",), None, None)) in eng._memo
+    assert eng.candidates("9999999") == [eng.candidates("3550308")[-1]]
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from censo_app.cube import ESTADO, PyramidCube
+from censo_app.tensor import PyramidTensor
+
+from conftest import TOGGLES, filter_mask, ref_pyramid
+
+
+@pytest.fixture(scope="module")
+def cube(wide):
+    return PyramidCube.from_tensor(PyramidTensor.from_wide(wide))
+
+
+@pytest.mark.parametrize("situacao,tipos", TOGGLES)
+def test_cube_pyramid_matches_pandas(wide, cube, situacao, tipos):
+    np.testing.assert_array_equal(cube.pyramid(ESTADO, situacao=situacao, tipos=tipos),
+                                  ref_pyramid(wide[filter_mask(wide, situacao, tipos)]))
+    for mun in ("3500105", "3550308"):
+        sub = wide[wide["CD_MUN"].eq(mun) & filter_mask(wide, situacao, tipos)]
+        np.testing.assert_array_equal(cube.pyramid("CD_MUN", mun, situacao, tipos), ref_pyramid(sub))
+    assert not cube.pyramid("CD_MUN", "9999999", situacao, tipos).any()
+
+
+@pytest.mark.parametrize("level", ["NM_RGINT", "NM_RGI", "RM_AU"])
+def test_every_node_matches_pandas(wide, cube, level):
+    labels, _ = cube.nodes[level]
+    for value in labels:
+        if level == "RM_AU":
+            rows = wide["TIPO_RM_AU"].astype(str).str.upper().eq(value[0]) & wide["NOME_RM_AU"].eq(value[1])
+        else:
+            rows = wide[level].eq(value)
+        np.testing.assert_array_equal(cube.pyramid(level, value), ref_pyramid(wide[rows]))
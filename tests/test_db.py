@@ -0,0 +1,154 @@
+from __future__ import annotations
+import gc
+import threading
+
+import pytest
+
+from censo_app import db
+from censo_app.transform import iter_sp_age_sex_batches, load_sp_age_sex_enriched
+
+from conftest import EXCEL_RM_AU
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Pool novo com 2 vagas e espera curta; devolvido ao estado padrão ao final."""
+    db.reset_pool()
+    monkeypatch.setattr(db, "_load_settings", lambda: dict(db._DEFAULTS, max_concurrent_queries=2, acquire_timeout_s=2))
+    yield
+    db.reset_pool()
+
+
+def _closed(cur) -> bool:
+    try:
+        cur.execute("SELECT 1")
+    except Exception:
+        return True
+    return False
+
+
+def _in_thread(fn):
+    out = {}
+
+    def run():
+        try:
+            out["v"] = fn()
+        except Exception as e:
+            out["e"] = e
+
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+    if "e" in out:
+        raise out["e"]
+    return out["v"]
+
+
+def _started(gen):
+    next(gen)
+    return gen
+
+
+def test_thread_cursor_closed_on_thread_exit(pool):
+    def work():
+        with db.cursor() as cur:
+            assert cur.execute("SELECT 1").fetchone() == (1,)
+            return cur
+
+    cur = _in_thread(work)
+    gc.collect()
+    assert _closed(cur)
+    assert db.pool_stats()["cursors_created"] == 1
+
+
+def test_thread_cursor_reused_within_thread(pool):
+    with db.cursor() as a:
+        pass
+    with db.cursor() as b:
+        assert b is a and not _closed(b)
+    with db.cursor(dedicated=True) as c:
+        assert c is not a
+    assert _closed(c)
+
+
+def test_reset_waits_for_running_queries(pool):
+    held, release, done = threading.Event(), threading.Event(), threading.Event()
+    seen = {}
+
+    def query():
+        with db.cursor() as cur:
+            held.set()
+            release.wait(5)
+            seen["ok"] = cur.execute("SELECT 42").fetchone()
+        seen["cur"] = cur
+
+    t = threading.Thread(target=query)
+    t.start()
+    held.wait(5)
+    r = threading.Thread(target=lambda: (db.reset_pool(), done.set()))
+    r.start()
+    # a instância antiga continua aberta enquanto há consulta em andamento
+    assert not done.wait(0.2)
+    # consultas novas já vão para outra instância
+    with db.cursor() as cur:
+        assert cur.execute("SELECT 1").fetchone() == (1,)
+    release.set()
+    t.join()
+    r.join()
+    assert done.is_set() and seen["ok"] == (42,)
+    assert _closed(seen["cur"])
+
+
+def test_reset_timeout_leaves_old_instance_open(pool):
+    held, release = threading.Event(), threading.Event()
+
+    def query():
+        with db.cursor() as cur:
+            held.set()
+            release.wait(5)
+            assert cur.execute("SELECT 1").fetchone() == (1,)
+
+    t = threading.Thread(target=query)
+    t.start()
+    held.wait(5)
+    with pytest.raises(TimeoutError):
+        db.reset_pool(timeout=0.1)
+    release.set()
+    t.join()
+
+
+def test_stream_releases_slot_on_close(pool, wide_parquet):
+    closed = _started(iter_sp_age_sex_batches(wide_parquet, batch_rows=8, excel_path=EXCEL_RM_AU))
+    # a outra vaga fica com um gerador iniciado em outra thread
+    dropped = _in_thread(lambda: _started(iter_sp_age_sex_batches(wide_parquet, batch_rows=8, excel_path=EXCEL_RM_AU)))
+    assert db.pool_stats()["active"] == 2
+    # todas as vagas ocupadas pelos geradores abertos
+    with pytest.raises(TimeoutError):
+        _in_thread(lambda: db.cursor(timeout=0.1).__enter__())
+    closed.close()
+    assert db.pool_stats()["active"] == 1
+    # gerador abandonado: GeneratorExit na coleta passa pelo finally do cursor
+    del dropped
+    gc.collect()
+    assert db.pool_stats()["active"] == 0
+    with db.cursor(timeout=0.1) as cur:
+        assert cur.execute("SELECT 1").fetchone() == (1,)
+
+
+def test_nested_cursor_reuses_thread_slot(monkeypatch, wide_parquet):
+    db.reset_pool()
+    monkeypatch.setattr(db, "_load_settings", lambda: dict(db._DEFAULTS, max_concurrent_queries=1, acquire_timeout_s=2))
+    batches = iter_sp_age_sex_batches(wide_parquet, batch_rows=8, excel_path=EXCEL_RM_AU)
+    try:
+        first = next(batches)
+        # consulta na mesma thread com a única vaga presa no gerador: não espera na fila
+        df = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU)
+        assert db.pool_stats()["active"] == 1 and db.pool_stats()["timeouts"] == 0
+        # outra thread continua limitada à vaga única
+        with pytest.raises(TimeoutError):
+            _in_thread(lambda: db.cursor(timeout=0.1).__enter__())
+        assert len(first) + sum(len(b) for b in batches) == len(df)
+        assert db.pool_stats()["active"] == 0
+    finally:
+        batches.close()
+        db.reset_pool()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.transform import FILTER_KEYS, _apply_filters_pandas, load_sp_age_sex_enriched
+
+from conftest import EXCEL_RM_AU
+
+
+@pytest.fixture(scope="module")
+def full(wide_parquet):
+    return load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU)
+
+
+def _values(full: pd.DataFrame, key: str) -> list:
+    if key not in full.columns:
+        return ["X"] if key not in ("CD_TIPO", "CD_SITUACAO") else [1]
+    vals = full[key].dropna().drop_duplicates().sort_values().tolist()
+    return vals[:2]
+
+
+def _same(a: pd.DataFrame, b: pd.DataFrame) -> None:
+    a = a.sort_values("CD_SETOR").reset_index(drop=True)
+    b = b.sort_values("CD_SETOR").reset_index(drop=True)
+    pd.testing.assert_frame_equal(a, b, check_like=True)
+
+
+@pytest.mark.parametrize("key", FILTER_KEYS)
+def test_sql_pushdown_matches_pandas_filter(wide_parquet, full, key):
+    vals = _values(full, key)
+    sql = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, filters={key: vals})
+    _same(sql, _apply_filters_pandas(full, {key: vals}))
+
+
+@pytest.mark.parametrize("filters", [
+    {"CD_TIPO": ["0", "1"]},
+    {"CD_TIPO": 2},
+    {"CD_MUN": [3500204, "3550308"]},
+    {"SITUACAO": "Urbana", "TIPO_RM_AU": ["rm"]},
+    {"CD_TIPO": []},
+])
+def test_string_and_numeric_inputs_agree(wide_parquet, full, filters):
+    sql = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, filters=filters)
+    pand = _apply_filters_pandas(full, filters)
+    _same(sql, pand)
+    if filters != {"CD_TIPO": []}:
+        assert 0 < len(pand) < len(full)
+
+
+def test_unknown_filter_key_is_rejected(full):
+    with pytest.raises(ValueError):
+        _apply_filters_pandas(full, {"XYZ": [1]})
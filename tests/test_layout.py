@@ -0,0 +1,65 @@
+from __future__ import annotations
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from censo_app.layout import LAYOUT_MARKER, detect_layout, parquet_glob, parquet_source, source_stat
+from censo_app.schema import clear_schema_registry, get_parquet_schema
+from censo_app.transform import load_sp_age_sex_enriched
+
+from conftest import EXCEL_RM_AU, MUNICIPIOS, ROOT, sorted_frame
+
+
+@pytest.fixture(scope="module")
+def optimized(tmp_path_factory, wide_parquet):
+    out = tmp_path_factory.mktemp("layout") / "base_otimizado"
+    subprocess.run([sys.executable, str(ROOT / "docs" / "optimize_parquet.py"), wide_parquet, str(out),
+                    "--row-group-size", "16"], check=True, capture_output=True, cwd=ROOT)
+    return str(out)
+
+
+def test_single_file_is_not_optimized(wide_parquet):
+    assert detect_layout(wide_parquet) is None
+    assert parquet_source(wide_parquet, "35") == (f"read_parquet('{wide_parquet}')", False)
+    assert parquet_glob(wide_parquet) == wide_parquet
+
+
+def test_optimized_layout_detected(optimized):
+    meta = detect_layout(optimized)
+    assert meta["rows"] == len(MUNICIPIOS) * 12 and set(meta["partitions"]) == {"33", "35"}
+    src, pruned = parquet_source(optimized, "35")
+    assert pruned and "CD_UF=35" in src
+    # UF sem partição: lê todas e filtra pela coluna
+    assert parquet_source(optimized, "41")[1] is False
+    assert parquet_glob(optimized).endswith("/*/*.parquet")
+
+
+def test_marker_is_the_fingerprint(tmp_path, optimized):
+    marker = f"{optimized}/{LAYOUT_MARKER}"
+    meta = json.loads(open(marker, encoding="utf-8").read())
+    st = os.stat(marker)
+    assert source_stat(optimized) == (st.st_mtime_ns, st.st_size)
+    # marcador de outra versão ou partição: não é o layout
+    bad = [{**meta, "version": meta["version"] + 1}, {**meta, "partition": "CD_MUN"}]
+    for i, text in enumerate([json.dumps(m) for m in bad] + ["{"]):
+        d = tmp_path / f"d{i}"
+        d.mkdir()
+        (d / LAYOUT_MARKER).write_text(text, encoding="utf-8")
+        assert detect_layout(str(d)) is None
+
+
+def test_optimized_layout_loads_same_frame(wide_parquet, optimized):
+    clear_schema_registry()
+    assert get_parquet_schema(optimized).num_rows == get_parquet_schema(wide_parquet).num_rows
+    ref = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU)
+    got = load_sp_age_sex_enriched(optimized, excel_path=EXCEL_RM_AU)
+    # CD_UF vem da partição (fim da projeção)
+    assert sorted(got.columns) == sorted(ref.columns)
+    pd.testing.assert_frame_equal(sorted_frame(got, ["CD_SETOR"])[list(ref.columns)], sorted_frame(ref, ["CD_SETOR"]),
+                                  check_dtype=False)
+    mun = load_sp_age_sex_enriched(optimized, excel_path=EXCEL_RM_AU, filters={"CD_MUN": ["3550308"]})
+    assert len(mun) == 12 and set(mun["CD_MUN"]) == {"3550308"}
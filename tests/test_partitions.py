@@ -0,0 +1,64 @@
+from __future__ import annotations
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from censo_app.cube import PyramidCube
+from censo_app.tensor import PyramidTensor
+
+from conftest import TOGGLES, filter_mask, ref_pyramid
+
+
+@pytest.fixture(scope="module")
+def tensor(wide):
+    return PyramidTensor.from_wide(wide)
+
+
+@pytest.fixture(scope="module")
+def cube(tensor):
+    return PyramidCube.from_tensor(tensor)
+
+
+def test_partition_deltas_follow_toggles(wide, cube):
+    node = wide["NM_RGINT"].iloc[0]
+    parts = cube.partitions("NM_RGINT", node)
+    sub = wide[wide["NM_RGINT"].eq(node)]
+    for situacao, tipos in TOGGLES:
+        np.testing.assert_array_equal(parts.pyramid(situacao, tipos), ref_pyramid(sub[filter_mask(sub, situacao, tipos)]))
+
+
+def test_partitions_for_rows_match_pandas(wide, tensor, cube):
+    rows = np.random.default_rng(1).choice(len(wide), size=len(wide) // 3, replace=False)
+    parts = cube.partitions_for_rows(tensor, rows)
+    sub = wide.iloc[rows]
+    for situacao, tipos in TOGGLES:
+        np.testing.assert_array_equal(parts.pyramid(situacao, tipos), ref_pyramid(sub[filter_mask(sub, situacao, tipos)]))
+    assert not cube.partitions_for_rows(tensor, np.array([], dtype=np.intp)).pyramid().any()
+
+
+def test_missing_node_is_zero(cube):
+    assert not cube.partitions("CD_MUN", "9999999").pyramid(["Urbana"], [0]).any()
+
+
+def test_shared_partitions_stay_consistent_across_threads(wide, cube):
+    node = wide["NM_RGINT"].iloc[0]
+    parts = cube.partitions("NM_RGINT", node)
+    sub = wide[wide["NM_RGINT"].eq(node)]
+    refs = [ref_pyramid(sub[filter_mask(sub, situacao, tipos)]) for situacao, tipos in TOGGLES]
+
+    def run(offset):
+        for i in range(300):
+            j = (i + offset) % len(TOGGLES)
+            np.testing.assert_array_equal(parts.pyramid(*TOGGLES[j]), refs[j])
+
+    # mesmo objeto usado por várias sessões ao mesmo tempo (cache_resource da página); trocas
+    # de thread frequentes expõem leituras de células e soma vindas de chamadas diferentes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(run, range(4)))
+    finally:
+        sys.setswitchinterval(interval)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+import sys
+
+import numpy as np
+import pytest
+
+from censo_app import perf
+from censo_app.perf import _maxrss_bytes, format_stats, stage
+
+
+def test_maxrss_units_per_platform():
+    assert _maxrss_bytes(2048, "linux") == 2048 * 1024
+    assert _maxrss_bytes(2048, "freebsd13") == 2048 * 1024
+    assert _maxrss_bytes(2048, "darwin") == 2048
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="VmHWM só no Linux")
+def test_peak_rss_matches_proc_status():
+    with open("/proc/self/status") as fh:
+        hwm_kb = next(int(line.split()[1]) for line in fh if line.startswith("VmHWM:"))
+    # MB nas duas fontes (ru_maxrss em KB não pode virar GB nem bytes)
+    assert abs(perf.peak_rss_mb() - hwm_kb / 1024) < 64
+
+
+def test_stage_fields_and_format():
+    stats: list = []
+    with stage(stats, "a"):
+        pass
+    rec = stats[0]
+    assert set(rec) == {"etapa", "segundos", "rss_mb", "delta_rss_mb", "pico_etapa_mb", "pico_rss_mb"}
+    assert rec["etapa"] == "a" and rec["segundos"] >= 0
+    out = format_stats(stats).splitlines()
+    assert len(out) == 2 and out[1].startswith("a")
+
+
+def _touch(mb: int) -> int:
+    buf = np.ones(mb * 2**20 // 8)
+    return int(buf[:: 4096 // 8].sum())
+
+
+def test_stage_peak_from_maxrss_only_when_stage_raises_it(monkeypatch):
+    monkeypatch.setattr(perf, "psutil", None)
+    if perf.peak_rss_mb() is None:
+        pytest.skip("sem resource")
+    stats: list = []
+    with stage(stats, "aloca"):
+        _touch(int(perf.peak_rss_mb()) + 64)
+    with stage(stats, "leve"):
+        pass
+    assert stats[0]["pico_etapa_mb"] == stats[0]["pico_rss_mb"]
+    # a etapa seguinte não elevou a marca do processo: pico da etapa desconhecido
+    assert stats[1]["pico_etapa_mb"] is None
+    assert stats[1]["rss_mb"] is None and stats[1]["delta_rss_mb"] is None
+
+
+def test_stage_samples_peak_inside_stage():
+    pytest.importorskip("psutil")
+    stats: list = []
+    with stage(stats, "aloca", interval=0.001):
+        _touch(128)
+    with stage(stats, "leve", interval=0.001):
+        pass
+    # o buffer foi liberado ao fim da etapa: o pico amostrado fica acima do RSS final
+    assert stats[0]["pico_etapa_mb"] >= stats[0]["rss_mb"] + 64
+    assert stats[1]["pico_etapa_mb"] < stats[0]["pico_etapa_mb"]
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.demog_utils import pad_pyramid_categories
+from censo_app.pipeline import Stage, StageGraph, demography_graph
+from censo_app.tables import build_abnt_demographic_table, compare_abnt_tables
+
+FAIXAS = ("0 a 4 anos", "5 a 9 anos")
+
+
+def _pyr(m: int, f: int) -> pd.DataFrame:
+    return pd.DataFrame({"sexo": ["Masculino", "Masculino", "Feminino", "Feminino"],
+                         "faixa_etaria": list(FAIXAS) * 2, "populacao": [m, m + 1, f, f + 1]})
+
+
+def test_scope_keys_never_share_results():
+    g = demography_graph("fp")
+    vazio = g.run("tabela", {"piramide": lambda: _pyr(0, 0).head(0)},
+                  escopo=("RM_AU_VAZIO", "RM", "X"), filtros=(), faixas=FAIXAS)
+    total = g.run("tabela", {"piramide": lambda: _pyr(10, 20)},
+                  escopo=("TOTAL_FILTRADO",), filtros=(), faixas=FAIXAS)
+    assert vazio.loc[vazio["Faixa Etária"] == "TOTAL", "Total"].iloc[0] == 0
+    assert total.loc[total["Faixa Etária"] == "TOTAL", "Total"].iloc[0] == 62
+    assert g.hits == 0
+
+
+def test_same_key_is_reused_and_comparator_switch_keeps_main_branch():
+    g = demography_graph("fp")
+    calls = []
+
+    def src(name, m):
+        def f():
+            calls.append(name)
+            return _pyr(m, m)
+        return f
+
+    params = dict(escopo=("CD_MUN", "1"), filtros=(), faixas=FAIXAS)
+    a = g.run("tabela_comparada", {"piramide": src("p", 5), "comparador": src("c", 7)}, comp_escopo="A", **params)
+    b = g.run("tabela_comparada", {"piramide": src("p", 5), "comparador": src("c", 9)}, comp_escopo="B", **params)
+    assert calls == ["p", "c", "c"]
+    ref = compare_abnt_tables(build_abnt_demographic_table(pad_pyramid_categories(_pyr(5, 5), list(FAIXAS)), list(FAIXAS)),
+                              build_abnt_demographic_table(pad_pyramid_categories(_pyr(9, 9), list(FAIXAS)), list(FAIXAS)))
+    pd.testing.assert_frame_equal(b, ref)
+    assert g.run("tabela_comparada", comp_escopo="A", **params) is a
+
+
+def test_fingerprint_and_filters_are_part_of_the_key():
+    g1, g2 = StageGraph([Stage("x", params=("k",))], "a"), StageGraph([Stage("x", params=("k",))], "b")
+    assert g1.key("x", {"k": 1}) != g2.key("x", {"k": 1})
+    g = demography_graph("fp")
+    g.run("piramide", {"piramide": lambda: 1}, escopo=("E",), filtros=("Urbana",))
+    assert g.run("piramide", {"piramide": lambda: 2}, escopo=("E",), filtros=("Rural",)) == 2
+
+
+def test_lru_eviction_and_graph_validation():
+    g = StageGraph([Stage("x", params=("k",))], max_entries=2)
+    for k in range(3):
+        g.run("x", {"x": lambda k=k: k}, k=k)
+    assert g.run("x", {"x": lambda: "novo"}, k=0) == "novo"
+    with pytest.raises(ValueError):
+        StageGraph([Stage("a", lambda v: v, deps=("b",)), Stage("b", lambda v: v, deps=("a",))])
+    with pytest.raises(KeyError):
+        g.run("x")
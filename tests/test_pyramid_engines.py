@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.transform import aggregate_pyramid, wide_to_long_pyramid
+
+from conftest import sorted_frame
+
+GROUP_BYS = [
+    [],
+    ["NOME_RM_AU"],
+    ["CD_MUN", "SITUACAO"],
+    ["TIPO_RM_AU", "NM_RGI"],
+    ["CD_TIPO"],
+    ["nao_existe", "NM_RGINT"],
+]
+
+
+@pytest.mark.parametrize("group_by", GROUP_BYS)
+def test_aggregate_engines_match_on_wide(wide, group_by):
+    pdf = aggregate_pyramid(wide, group_by)
+    ddb = aggregate_pyramid(wide, group_by, engine="duckdb")
+    keys = [c for c in group_by if c in wide.columns]
+    assert list(pdf.columns) == list(ddb.columns) == keys + ["idade_grupo", "sexo", "valor"]
+    pd.testing.assert_frame_equal(sorted_frame(pdf, keys + ["idade_grupo", "sexo"]),
+                                  sorted_frame(ddb, keys + ["idade_grupo", "sexo"]), check_dtype=False)
+
+
+@pytest.mark.parametrize("group_by", GROUP_BYS)
+def test_aggregate_engines_match_on_long(wide, group_by):
+    long = wide_to_long_pyramid(wide)
+    pdf = aggregate_pyramid(long, group_by)
+    ddb = aggregate_pyramid(long, group_by, engine="duckdb")
+    keys = [c for c in group_by if c in long.columns] + ["idade_grupo", "sexo"]
+    pd.testing.assert_frame_equal(sorted_frame(pdf, keys), sorted_frame(ddb, keys), check_dtype=False)
+    # long e wide agregam para os mesmos totais
+    assert pdf["valor"].sum() == aggregate_pyramid(wide, group_by)["valor"].sum()
+
+
+def test_unpivot_matches_melt(wide):
+    pdf = wide_to_long_pyramid(wide)
+    ddb = wide_to_long_pyramid(wide, engine="duckdb")
+    assert list(pdf.columns) == list(ddb.columns)
+    keys = ["CD_SETOR", "sexo", "idade_grupo"]
+    pd.testing.assert_frame_equal(sorted_frame(pdf, keys), sorted_frame(ddb, keys), check_dtype=False)
+
+
+def test_invalid_engine(wide):
+    with pytest.raises(ValueError):
+        aggregate_pyramid(wide, engine="spark")
+    with pytest.raises(ValueError):
+        wide_to_long_pyramid(wide, engine="spark")
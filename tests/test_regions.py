@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from censo_app import regions
+from censo_app.regions import RegionDef, RegionMatrix, load_region_defs, save_region_defs
+from censo_app.tensor import PyramidTensor
+
+from conftest import TOGGLES, filter_mask, ref_pyramid
+
+
+@pytest.fixture(scope="module")
+def tensor(wide):
+    return PyramidTensor.from_wide(wide)
+
+
+def _defs(wide):
+    setores = wide.loc[wide["CD_MUN"].eq("3503000"), "CD_SETOR"].iloc[:3].tolist()
+    return [
+        RegionDef("capital e vizinho", ("3550308", "3500105")),
+        RegionDef("setores soltos", (), tuple(setores)),
+        RegionDef("misto", ("3503000",), tuple(setores) + ("000",)),
+        RegionDef("inexistente", ("9999999",)),
+    ]
+
+
+def _region_rows(wide, d):
+    return wide["CD_MUN"].isin(d.municipalities) | wide["CD_SETOR"].isin(d.sectors)
+
+
+@pytest.mark.parametrize("batch", [1 << 20, 5])
+def test_aggregate_matches_pandas(monkeypatch, wide, tensor, batch):
+    monkeypatch.setattr(regions, "_GATHER_BATCH", batch)
+    defs = _defs(wide)
+    mat = RegionMatrix.from_defs(defs, tensor.sectors_frame())
+    counts = tensor.counts.copy()
+    for situacao, tipos in TOGGLES:
+        m = filter_mask(wide, situacao, tipos)
+        got = mat.aggregate(tensor.counts, m.to_numpy())
+        for i, d in enumerate(defs):
+            np.testing.assert_array_equal(got[i], ref_pyramid(wide[_region_rows(wide, d) & m]))
+    full = mat.aggregate(tensor.counts)
+    for i, d in enumerate(defs):
+        np.testing.assert_array_equal(full[i], ref_pyramid(wide[_region_rows(wide, d)]))
+    # a máscara recorta a CSR, não as contagens
+    np.testing.assert_array_equal(tensor.counts, counts)
+
+
+def test_masked_csr_keeps_only_selected_sectors(wide, tensor):
+    mat = RegionMatrix.from_defs(_defs(wide), tensor.sectors_frame())
+    mask = wide["SITUACAO"].eq("Urbana").to_numpy()
+    indptr, indices = mat._masked(mask)
+    assert mask[indices].all() and len(indptr) == len(mat.indptr)
+    for i in range(len(mat.names)):
+        ref = mat.indices[mat.indptr[i]:mat.indptr[i + 1]]
+        np.testing.assert_array_equal(indices[indptr[i]:indptr[i + 1]], ref[mask[ref]])
+    assert mat._masked(None) == (mat.indptr, mat.indices)
+
+
+def test_region_defs_round_trip(tmp_path):
+    path = tmp_path / "regioes.json"
+    assert load_region_defs(str(path)) == []
+    defs = [RegionDef("a", ("3550308",)), RegionDef("b", (), ("355030800000001",), "x"), RegionDef("a", ("3500105",))]
+    save_region_defs(defs, str(path))
+    assert load_region_defs(str(path)) == [RegionDef("a", ("3500105",)), defs[1]]
+    with pytest.raises(ValueError):
+        RegionDef.from_dict({"nome": "vazia"})
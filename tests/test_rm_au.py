@@ -0,0 +1,94 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from censo_app import rm_au
+from censo_app.rm_au import compile_rm_au_lookup, load_rm_au_lookup
+
+from conftest import EXCEL_RM_AU
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    return shutil.copy(EXCEL_RM_AU, tmp_path / "rm.xlsx")
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Contador de leituras do workbook."""
+    calls = []
+    real = rm_au._parse_excel
+
+    def counted(path):
+        calls.append(path)
+        return real(path)
+
+    monkeypatch.setattr(rm_au, "_parse_excel", counted)
+    return calls
+
+
+def test_compile_matches_excel(tmp_path, workbook):
+    out = compile_rm_au_lookup(str(workbook), str(tmp_path / "lookup.csv"))
+    rm_map, au_map = rm_au._parse_excel(str(workbook))
+    df = pd.read_csv(out, dtype=str, keep_default_na=False, na_values=[""])
+    assert tuple(df.columns) == rm_au.RM_AU_LOOKUP_SCHEMA
+    assert dict(zip(*df.dropna(subset=["RM_NOME"])[["CD_MUN", "RM_NOME"]].T.values)) == rm_map
+    meta = json.loads(rm_au._meta_path(out).read_text(encoding="utf-8"))
+    assert meta["rows"] == len(df) and meta["source"]["size"] == os.path.getsize(workbook)
+    assert rm_map["3550308"].startswith("Região Metropolitana de São Paulo")
+
+
+def test_load_reads_artifact_and_detects_stale(tmp_path, workbook, parses):
+    lookup = str(tmp_path / "lookup.csv")
+    first = load_rm_au_lookup(str(workbook), lookup)
+    assert len(parses) == 1
+    assert load_rm_au_lookup(str(workbook), lookup) == first and len(parses) == 1
+    # workbook alterado (mtime): recompila uma vez
+    st = os.stat(workbook)
+    os.utime(workbook, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert load_rm_au_lookup(str(workbook), lookup) == first and len(parses) == 2
+    assert load_rm_au_lookup(str(workbook), lookup) == first and len(parses) == 2
+    # CSV adulterado: o checksum falha e o artefato é refeito
+    with open(lookup, "a", encoding="utf-8") as fh:
+        fh.write("3500000,X,\n")
+    os.utime(rm_au._meta_path(tmp_path / "lookup.csv"), ns=(1, 1))
+    assert load_rm_au_lookup(str(workbook), lookup) == first and len(parses) == 3
+
+
+def test_missing_workbook_keeps_existing_artifact(tmp_path, workbook, parses):
+    lookup = str(tmp_path / "lookup.csv")
+    first = load_rm_au_lookup(str(workbook), lookup)
+    os.remove(workbook)
+    assert load_rm_au_lookup(str(workbook), lookup) == first and len(parses) == 1
+
+
+def test_unwritable_cache_fails_once_per_workbook(tmp_path, workbook, parses, caplog):
+    (tmp_path / "arquivo").write_text("")
+    lookup = str(tmp_path / "arquivo" / "lookup.csv")  # pai não é diretório: OSError na escrita
+    with caplog.at_level(logging.WARNING, logger="censo_app.rm_au"):
+        assert load_rm_au_lookup(str(workbook), lookup) == (None, None)
+        assert load_rm_au_lookup(str(workbook), lookup) == (None, None)
+    assert len(parses) == 1
+    assert len([r for r in caplog.records if "RM/AU" in r.getMessage()]) == 1
+    # workbook novo: tenta compilar de novo
+    st = os.stat(workbook)
+    os.utime(workbook, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert load_rm_au_lookup(str(workbook), lookup) == (None, None)
+    assert len(parses) == 2
+
+
+def test_unrecognised_workbook_is_not_reparsed(tmp_path, parses):
+    bad = tmp_path / "outro.xlsx"
+    pd.DataFrame({"a": [1]}).to_excel(bad, sheet_name="Planilha1", index=False)
+    lookup = str(tmp_path / "lookup.csv")
+    with pytest.raises(ValueError):
+        compile_rm_au_lookup(str(bad), lookup)
+    parses.clear()
+    assert load_rm_au_lookup(str(bad), lookup) == (None, None)
+    assert load_rm_au_lookup(str(bad), lookup) == (None, None)
+    assert len(parses) == 1
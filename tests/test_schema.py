@@ -0,0 +1,77 @@
+from __future__ import annotations
+import os
+import shutil
+
+import pytest
+
+from censo_app import schema as S
+from censo_app import transform as T
+from censo_app.schema import clear_schema_registry, get_parquet_schema
+
+from conftest import MUNICIPIOS
+
+
+@pytest.fixture
+def base(tmp_path, wide_parquet):
+    clear_schema_registry()
+    yield str(shutil.copy(wide_parquet, tmp_path / "base.parquet"))
+    clear_schema_registry()
+
+
+@pytest.fixture
+def footers(monkeypatch):
+    """Contador de leituras do footer."""
+    calls = []
+    real = S._read_footer
+
+    def counted(path):
+        calls.append(path)
+        return real(path)
+
+    monkeypatch.setattr(S, "_read_footer", counted)
+    return calls
+
+
+def test_schema_resolved_from_footer(base):
+    sch = get_parquet_schema(base)
+    assert sch.num_rows == len(MUNICIPIOS) * 12
+    assert sch.canon["Código do Município"] == "CD_MUN"
+    assert sch.physical("CD_MUN") == "Código do Município"
+    assert sch.physical("Código do Município") == "Código do Município"
+    assert sch.physical("nao_existe") is None
+    assert sch.uf_col == "Código da Unidade da Federação"
+    assert len(sch.male_cols) == len(sch.female_cols) == 11
+    assert all(c.startswith("Sexo masculino") for c in sch.male_cols)
+    # mesma seleção do carregador sobre os nomes canônicos
+    m, f = T._pick_exact_age_cols(list(sch.canon.values()))
+    assert [sch.canon[c] for c in sch.age_sex_cols] == m + f
+
+
+def test_registry_reuses_until_source_changes(base, footers):
+    first = get_parquet_schema(base)
+    assert get_parquet_schema(base) is first and len(footers) == 1
+    st = os.stat(base)
+    os.utime(base, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    again = get_parquet_schema(base)
+    assert again is not first and again.fingerprint != first.fingerprint and len(footers) == 2
+    assert again.columns == first.columns
+    clear_schema_registry()
+    get_parquet_schema(base)
+    assert len(footers) == 3
+
+
+def test_registry_tracks_colmap(tmp_path, base, footers):
+    colmap = tmp_path / "columns_map.csv"
+    shutil.copy(T.COLMAP_DEFAULT_PATH, colmap)
+    get_parquet_schema(base, colmap_path=str(colmap))
+    get_parquet_schema(base, colmap_path=str(colmap))
+    assert len(footers) == 1
+    st = os.stat(colmap)
+    os.utime(colmap, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    get_parquet_schema(base, colmap_path=str(colmap))
+    assert len(footers) == 2
+
+
+def test_missing_parquet(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        get_parquet_schema(str(tmp_path / "nao_existe.parquet"))
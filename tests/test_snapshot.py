@@ -0,0 +1,87 @@
+from __future__ import annotations
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from censo_app import snapshot
+from censo_app import transform as T
+from censo_app.snapshot import load_sp_age_sex_snapshot
+
+from conftest import EXCEL_RM_AU
+
+
+@pytest.fixture
+def base(tmp_path, wide_parquet):
+    return str(shutil.copy(wide_parquet, tmp_path / "base.parquet"))
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Contador de execuções do pipeline completo."""
+    calls = []
+    real = T.load_sp_age_sex_enriched
+
+    def counted(*args, **kwargs):
+        calls.append(kwargs)
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(T, "load_sp_age_sex_enriched", counted)
+    return calls
+
+
+def _snapshots(cache):
+    return sorted(p.name for p in cache.glob("*.parquet"))
+
+
+def test_snapshot_round_trip(tmp_path, base, loads):
+    cache = tmp_path / "cache"
+    built = load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache))
+    read = load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache))
+    assert len(loads) == 1 and len(_snapshots(cache)) == 1
+    pd.testing.assert_frame_equal(read, built)
+    # colunas de texto com nulos voltam como object, não como str
+    for col in built.columns[built.dtypes.eq(object)]:
+        assert read[col].dtype == object
+
+
+def test_snapshot_invalidation(tmp_path, base, loads):
+    cache = tmp_path / "cache"
+    load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache))
+    first = _snapshots(cache)
+    # Parquet de origem alterado: reconstrói e remove o snapshot antigo
+    st = os.stat(base)
+    os.utime(base, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache))
+    assert len(loads) == 2 and len(_snapshots(cache)) == 1 and _snapshots(cache) != first
+    # rebuild força o pipeline mesmo com o snapshot válido
+    load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache), rebuild=True)
+    assert len(loads) == 3
+    # parâmetros diferentes: snapshot próprio, sem apagar o da outra carga
+    clustered = load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache), cluster=True)
+    assert len(loads) == 4 and len(_snapshots(cache)) == 2
+    assert loads[-1]["cluster"] is True
+    pd.testing.assert_frame_equal(
+        load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache), cluster=True), clustered)
+    assert len(loads) == 4
+
+
+def test_corrupted_snapshot_is_rebuilt(tmp_path, base, loads):
+    cache = tmp_path / "cache"
+    built = load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache))
+    (cache / _snapshots(cache)[0]).write_bytes(b"nao e parquet")
+    pd.testing.assert_frame_equal(load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache)), built)
+    assert len(loads) == 2
+    pd.testing.assert_frame_equal(load_sp_age_sex_snapshot(base, excel_path=EXCEL_RM_AU, cache_dir=str(cache)), built)
+    assert len(loads) == 2
+
+
+def test_fingerprint_tracks_colmap(tmp_path, base):
+    colmap = tmp_path / "columns_map.csv"
+    shutil.copy(T.COLMAP_DEFAULT_PATH, colmap)
+    fp = snapshot.source_fingerprint(base, excel_path=EXCEL_RM_AU, colmap_path=str(colmap))
+    assert snapshot.source_fingerprint(base, excel_path=EXCEL_RM_AU, colmap_path=str(colmap)) == fp
+    with open(colmap, "a", encoding="utf-8") as fh:
+        fh.write("\n")
+    assert snapshot.source_fingerprint(base, excel_path=EXCEL_RM_AU, colmap_path=str(colmap)) != fp
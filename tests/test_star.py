@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.transform import (
+    MUNICIPALITY_DIM_COLS,
+    aggregate_pyramid,
+    join_dimension,
+    load_sp_age_sex_enriched,
+    load_sp_age_sex_star,
+    municipality_dimension,
+    split_star,
+)
+
+from conftest import EXCEL_RM_AU, sorted_frame
+
+
+def _rejoined(fact: pd.DataFrame, dim: pd.DataFrame, like: pd.DataFrame) -> pd.DataFrame:
+    """Fato + dimensão na ordem de colunas de like, com CD_MUN de volta a texto."""
+    out = join_dimension(fact, dim)
+    out["CD_MUN"] = out["CD_MUN"].astype(str).astype(like["CD_MUN"].dtype)
+    return out[list(like.columns)]
+
+
+def _plain(df: pd.DataFrame) -> pd.DataFrame:
+    """Nulos como None: pd.NA/NaN variam com o dtype de texto após o join."""
+    return pd.DataFrame({c: df[c].astype(object).where(df[c].notna(), None) for c in df.columns})
+
+
+def test_split_and_join_round_trip(wide):
+    fact, dim = split_star(wide)
+    assert not set(MUNICIPALITY_DIM_COLS) & set(fact.columns)
+    assert dim["CD_MUN"].is_unique and len(dim) == wide["CD_MUN"].nunique()
+    assert fact["CD_MUN"].dtype == dim["CD_MUN"].dtype == "int32"
+    pd.testing.assert_frame_equal(_plain(_rejoined(fact, dim, wide)), _plain(wide))
+
+
+def test_join_subset_of_columns_on_aggregate(wide):
+    fact, dim = split_star(wide)
+    agg = aggregate_pyramid(fact, ["CD_MUN"])
+    out = join_dimension(agg, dim, columns=["NM_MUN", "CD_MUN", "nao_existe"])
+    assert list(out.columns) == list(agg.columns) + ["NM_MUN"]
+    names = dict(zip(wide["CD_MUN"].astype(int), wide["NM_MUN"]))
+    assert out["NM_MUN"].tolist() == [names[k] for k in out["CD_MUN"]]
+    # município fora da dimensão: rótulo nulo
+    miss = join_dimension(pd.DataFrame({"CD_MUN": [9999999]}).astype("int32"), dim, columns=["NM_MUN"])
+    assert miss["NM_MUN"].isna().all()
+
+
+def test_dimension_requires_cd_mun(wide):
+    with pytest.raises(ValueError):
+        municipality_dimension(wide.drop(columns=["CD_MUN"]))
+
+
+@pytest.mark.parametrize("filters", [None, {"NOME_RM_AU": ["Região Metropolitana de São Paulo"]}])
+def test_star_load_matches_enriched(wide_parquet, filters):
+    ref = load_sp_age_sex_enriched(wide_parquet, excel_path=EXCEL_RM_AU, filters=filters)
+    fact, dim = load_sp_age_sex_star(wide_parquet, excel_path=EXCEL_RM_AU, filters=filters)
+    assert len(fact) == len(ref) > 0
+    # merge RM/AU na dimensão dá os mesmos rótulos do merge por setor
+    pd.testing.assert_frame_equal(_plain(sorted_frame(_rejoined(fact, dim, ref), ["CD_SETOR"])),
+                                  _plain(sorted_frame(ref, ["CD_SETOR"])))
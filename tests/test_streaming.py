@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from censo_app.transform import aggregate_pyramid, aggregate_pyramid_streaming, iter_sp_age_sex_batches
+
+from conftest import EXCEL_RM_AU, sorted_frame
+
+
+@pytest.mark.parametrize("group_by", [[], ["CD_MUN"], ["NOME_RM_AU", "SITUACAO"]])
+def test_streaming_matches_full_load(wide_parquet, wide, group_by):
+    stream = aggregate_pyramid_streaming(wide_parquet, group_by, batch_rows=16, excel_path=EXCEL_RM_AU)
+    full = aggregate_pyramid(wide, group_by)
+    keys = group_by + ["idade_grupo", "sexo"]
+    pd.testing.assert_frame_equal(sorted_frame(stream, keys)[keys + ["valor"]],
+                                  sorted_frame(full, keys)[keys + ["valor"]], check_dtype=False, check_categorical=False)
+
+
+def test_batches_cover_the_load(wide_parquet, wide):
+    batches = list(iter_sp_age_sex_batches(wide_parquet, batch_rows=8, excel_path=EXCEL_RM_AU))
+    got = pd.concat(batches, ignore_index=True)
+    assert sorted(got["CD_SETOR"]) == sorted(wide["CD_SETOR"])
+
+
+def test_streaming_with_filter_matches_full_load(wide_parquet, wide):
+    stream = aggregate_pyramid_streaming(wide_parquet, ["CD_MUN"], batch_rows=16, excel_path=EXCEL_RM_AU,
+                                         filters={"SITUACAO": ["Urbana"]})
+    full = aggregate_pyramid(wide[wide["SITUACAO"].eq("Urbana")], ["CD_MUN"])
+    assert stream["valor"].sum() == full["valor"].sum()
+    assert set(stream["CD_MUN"]) == set(full["CD_MUN"])
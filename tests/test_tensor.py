@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from censo_app.tensor import PyramidTensor
+
+from conftest import ref_pyramid
+
+
+@pytest.fixture(scope="module")
+def tensor(wide):
+    return PyramidTensor.from_wide(wide)
+
+
+def test_tensor_matches_pandas(wide, tensor):
+    np.testing.assert_array_equal(tensor.pyramid(), ref_pyramid(wide))
+    rows = np.flatnonzero(wide["CD_MUN"].eq("3550308").to_numpy())
+    np.testing.assert_array_equal(tensor.pyramid(rows), ref_pyramid(wide.iloc[rows]))
+
+
+def test_tensor_by_level(wide, tensor):
+    labels, sums = tensor.by("CD_MUN")
+    for lab, pyr in zip(labels, sums):
+        np.testing.assert_array_equal(pyr, ref_pyramid(wide[wide["CD_MUN"].eq(lab)]))
+
+
+def test_sectors_frame_flags_missing_cells(wide, tensor):
+    sectors = tensor.sectors_frame()
+    assert sectors["__ix"].tolist() == list(range(len(wide)))
+    # o fixture anonimiza uma célula etária a cada 7 setores
+    assert sectors["__nulo"].any() and not sectors["__nulo"].all()
+    sub = sectors[sectors["CD_MUN"].eq("3500105")]
+    np.testing.assert_array_equal(tensor.pyramid(sub["__ix"].to_numpy()),
+                                  ref_pyramid(wide[wide["CD_MUN"].eq("3500105")]))